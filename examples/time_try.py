@@ -1,11 +1,14 @@
-import os
 import time
 import ntplib
+from gbroke.clock import ClockSync
+
+# Estimate the local clock's offset from NTP time instead of setting the system clock
 c = ntplib.NTPClient()
-response = c.request('cn.pool.ntp.org')
-ts = response.tx_time
-_date = time.strftime('%Y-%m-%d',time.localtime(ts))
-_time = time.strftime('%X',time.localtime(ts))
-print(ts)
-print(_date,_time)
-os.system('date {} && time {}'.format(_date,_time))
+clock = ClockSync()
+for _ in range(5):
+    sent = time.time()
+    response = c.request('cn.pool.ntp.org')
+    clock.add_rest(response.tx_time, sent, time.time())
+    time.sleep(1)
+print('offset {:+.3f} sec, best round trip {:.3f} sec'.format(clock.offset_at(), clock.best_rtt))
+print(time.strftime('%Y-%m-%d %X', time.localtime(clock.now())))
@@ -19,36 +19,59 @@ Convenience wrapper for Interactive Brokers API.
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import importlib
+import os
 import random
 import sys
 import threading
 import time
 from collections import defaultdict, namedtuple
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, tzinfo
 import logging
-from copy import copy
 import math
 from itertools import takewhile, tee, starmap
+from operator import attrgetter
 from queue import Queue, Empty
-from typing import Optional, Tuple, Iterable, Union, Any, Callable
-import unittest
-
-
-import gdax
-import json
-import datetime as dt
+from typing import Optional, Tuple, Iterable, Union, Any, Callable, TYPE_CHECKING
 
 #from ib.opt import ibConnection
 #from ib.ext.Contract import Contract
 #from ib.ext.Order import Order as IBOrder
 #from ib.ext.TickType import TickType
 
-
-from pytz import timezone, utc
-import ciso8601
-import time
-import uuid
-
+from .metrics import MetricsRegistry
+from .clock import ClockSync
+from .book import Level2Book
+from .indicators import Indicator, make_indicator
+from . import logs
+from .logs import create_logger
+from .watchdog import FeedWatchdog
+from .products import ProductRegistry
+from .pretrade import OrderRejected, check_order
+from .triggers import Trigger, TriggerEngine
+if TYPE_CHECKING:
+    from .quotes import QuoteManager
+
+
+class _LazyModule:
+    """Stands in for the module global `name` until an attribute is first used, then imports module `module`
+    and replaces itself with it, so later uses cost nothing extra.  Keeps ``import gbroke`` fast for scripts
+    that never touch the feed, REST client or timezone tables."""
+    def __init__(self, name, module=None):
+        self._name = name
+        self._module = module or name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._module)
+        globals()[self._name] = module
+        return getattr(module, attr)
+
+
+gdax = _LazyModule('gdax')
+pytz = _LazyModule('pytz')
+ciso8601 = _LazyModule('ciso8601')
+uuid = _LazyModule('uuid')
+history = _LazyModule('history', 'gbroke.history')       # Imports numpy
 
 __version__ = "0.3.1"
 __all__ = ('GBroke', 'Instrument', 'Order', 'Bar', 'now')
@@ -80,6 +103,16 @@ LOG_LEVELS = {
     4: logging.DEBUG,
     5: logging.DEBUG,
 }
+#: Market data feed levels for :meth:`GBroke.register`, cheapest first: top of book and trades; aggregated depth; every order
+FEED_LEVELS = ('ticker', 'level2', 'full')
+#: Feed channels subscribed for each level below 'full' (which uses the full channel through gdax.OrderBook)
+FEED_CHANNELS = {'ticker': ['ticker', 'heartbeat'], 'level2': ['level2', 'matches', 'heartbeat']}
+#: Feed message types after which tick handlers are called, for the levels below 'full'
+TICK_MESSAGES = frozenset(('ticker', 'snapshot', 'l2update', 'match'))
+#: Maps Ticumulator input to ticker message field
+TICKER_FIELDS = (('bid', 'best_bid'), ('bidsize', 'best_bid_size'), ('ask', 'best_ask'), ('asksize', 'best_ask_size'))
+#: Ticumulator inputs for the top of a 'full' feed's order book, in the order WSClient passes them to GBroke._quote_full()
+FULL_TOP_FIELDS = ('bid', 'bidsize', 'bid_depth', 'ask', 'asksize', 'ask_depth')
 InstrumentDefaults = namedtuple('InstrumentDefaults', 'symbol sec_type exchange currency expiry strike opt_type')
 #: Default values for instrument fields
 INSTRUMENT_DEFAULTS = InstrumentDefaults(None, 'STK', 'GDAX', 'USD', None, 0.0, None)
@@ -146,11 +179,12 @@ class Instrument:
     Returned by :meth:`IBroke.get_instrument`, cannot be created directly by user code.
     """
     #def __init__(self, broker, contract_details):
-    def __init__(self, broker, contract):
+    def __init__(self, broker, contract, product=None):
         """Create an Instrument object defining what will be traded, at which exchange and in which currency.
 
         :param IBroke broker: :class:`IBroke` instance
         :param ContractDetails contract_details: IBPy :class:`ContractDetails` object (must have valid `conID` from `contractDetails()`)
+        :param Product product: The exchange's trading rules for it, if known (see :mod:`gbroke.products`).
         """
         # TODO: The design of this class makes me uneasy.  Ideally it should be immutable, but the underlying ContractDetails can
         # change, e.g., market hours day-to-day.  And clients keep references around.
@@ -163,6 +197,12 @@ class Instrument:
 
         if not self._contract.m_conId:
             raise ValueError('Contract must have conId (obtained from contractDetails()).')
+        #: A unique ID for this instrument: the product ID, e.g. ``'BTC-USD'``.  Instruments are compared and hashed (in
+        #: every handler dict) by it, so it and its hash are computed once here.
+        self.id = self._contract.m_conId
+        self._hash = hash(self.id)
+        #: The :class:`~gbroke.products.Product` (increments, size limits, status), or None if the exchange didn't list it
+        self.product = product
         try:
             #: The leverage multiplier, i.e., what you multiply the quote by to get the actual underlying value."""
             self.leverage = float(self._contract.m_multiplier)      # Not a property method because we only want to parse / warn once.
@@ -195,7 +235,7 @@ class Instrument:
                     yield datetime.combine(date, start), datetime.combine(date, end)
 
     @staticmethod
-    def _normalize_trading_hours(datetimes: Iterable[Tuple[datetime, datetime]], tz: timezone) -> Tuple[Tuple[datetime, datetime], ...]:
+    def _normalize_trading_hours(datetimes: Iterable[Tuple[datetime, datetime]], tz: tzinfo) -> Tuple[Tuple[datetime, datetime], ...]:
         """:Return: a sorted tuple of :class`datetime` ranges (pairs) where "wraparound" time ranges have been replaced with
         properly ordered, collapsed ranges, and the given `timezone` has been set.
 
@@ -243,11 +283,6 @@ class Instrument:
     def opt_type(self):
         return self._contract.m_right
 
-    @property
-    def id(self):
-        """:Return: a unique ID for this instrument."""
-        return GBroke._instrument_id_from_contract(self._contract)
-
     def tuple(self):
         """:Return: The instrument as a 7-tuple."""
         return tuple(getattr(self, prop) for prop in InstrumentDefaults._fields)
@@ -259,18 +294,47 @@ class Instrument:
         return str(self)
 
     def __eq__(self, other):
-        """:Return: True iff `other` has the same IB Contract ID as this Instrument."""
-        return self.id == other.id
+        """:Return: True iff `other` has the same ID as this Instrument."""
+        return self is other or self.id == other.id
 
     def __hash__(self):
-        return self.id
+        return self._hash
 
 
-class Order:
-    """An order for an :class:`Instrument`.
+#: Fields of an :class:`Order`
+ORDER_FIELDS = ('id', 'instrument', 'price', 'quantity', 'filled', 'avg_price', 'open', 'cancelled', 'profit', 'commission', 'open_time', 'fill_time')
 
-    Not created by user code directly.
+
+class Order(namedtuple('Order', ORDER_FIELDS)):
+    """An immutable snapshot of an order for an :class:`Instrument`, as of its latest change.
+
+    Not created by user code directly.  One snapshot is made per change and shared by every order handler,
+    :meth:`GBroke.get_open_orders` and :meth:`GBroke.order`, so keep and pass them around freely.
+
+    `quantity` is positive for buy, negative for sell.  `profit` is realized profit so far, net commissions
+    (negative for loss).  `open_time` is the server time the order opened and `fill_time` that of the most recent
+    fill (epoch sec), or None.
     """
+    __slots__ = ()
+
+    @property
+    def complete(self):
+        """:Return: True iff ``filled == quantity``."""
+        return self.filled == self.quantity
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        inst = tuple(val for default, val in zip(INSTRUMENT_DEFAULTS, self.instrument.tuple()) if val != default)
+        return "Order<{inst} {filled}/{quantity} @ {price} {open}{cancelled} #{id}>".format(
+            id=self.id, inst=inst, filled=self.filled, quantity=self.quantity, price=self.price, open='open' if self.open else 'closed', cancelled=' cancelled' if self.cancelled else '')
+
+
+class _OrderRecord:
+    """The live, mutable state of an order, kept by :class:`GBroke`.  Handlers get :meth:`snapshot`\\ s."""
+    __slots__ = ORDER_FIELDS + ('_snapshot',)
+
     def __init__(self, id_, instrument, price, quantity, filled, open, cancelled):
         """
         :param int quantity: Positive for buy, negative for sell
@@ -291,6 +355,19 @@ class Order:
         self.open_time = None           # openOrder server time (epoch sec)
         self.fill_time = None           # Most recent fill (epoch sec)
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_snapshot', None)     # Stale
+
+    def snapshot(self) -> Order:
+        """:Return: an :class:`Order` of the current state; the same object until the next change."""
+        snap = self._snapshot
+        if snap is None:
+            snap = tuple.__new__(Order, (self.id, self.instrument, self.price, self.quantity, self.filled, self.avg_price, self.open,
+                                         self.cancelled, self.profit, self.commission, self.open_time, self.fill_time))
+            object.__setattr__(self, '_snapshot', snap)
+        return snap
+
     @property
     def complete(self):
         """:Return: True iff ``filled == quantity``."""
@@ -298,20 +375,44 @@ class Order:
 
     @staticmethod
     def _from_gb(order, order_id, instrument):
-        """:Return: A new ibroke.Order object created from a :class:`ib.ext.Order.Order`."""
+        """:Return: A new order record created from a :class:`GOrder`."""
         qty = order.m_totalQuantity * (1 if order.m_action == 'BUY' else -1)
-        return Order(order_id, instrument, price=order.m_lmtPrice or None, quantity=order.m_totalQuantity, filled=0, open=True, cancelled=False)
+        return _OrderRecord(order_id, instrument, price=order.m_lmtPrice or None, quantity=order.m_totalQuantity, filled=0, open=True, cancelled=False)
 
     def __repr__(self):
         return str(self)
 
     def __str__(self):
-        inst = tuple(val for default, val in zip(INSTRUMENT_DEFAULTS, self.instrument.tuple()) if val != default)
-        return "Order<{inst} {filled}/{quantity} @ {price} {open}{cancelled} #{id}>".format(
-            id=self.id, inst=inst, filled=self.filled, quantity=self.quantity, price=self.price, open='open' if self.open else 'closed', cancelled=' cancelled' if self.cancelled else '')
+        return str(self.snapshot())
 
 
 Bar = namedtuple('Bar', ('time', 'bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize', 'lasttime', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'open_interest', 'bid_depth', 'ask_depth'))
+
+
+class TickView:
+    """A read-only view of an instrument's latest tick, passed to tick handlers registered with ``view=True``.
+
+    It has the same fields as a :class:`Bar`, but the same object is passed for every tick and reads the current
+    values on access, so delivering a tick allocates nothing.  It is only valid during the handler call: **copy what
+    you keep** (e.g. ``bid = view.bid``, or :meth:`bar` for all of it), because the values change under it.
+    """
+    __slots__ = ('_src',)
+
+    def __init__(self, src=None):
+        self._src = src         # Ticumulator, or a Bar from another process
+
+    def bar(self) -> 'Bar':
+        """:Return: a :class:`Bar` copy of the current values."""
+        src = self._src
+        return Bar._make(src.peek() if isinstance(src, Ticumulator) else src)
+
+    def __repr__(self):
+        return 'TickView({})'.format(self.bar())
+
+
+for _field in Bar._fields:
+    setattr(TickView, _field, property(attrgetter('_src.' + _field)))
+del _field
 Bar.__doc__ = """
 Bar is the usual open / high / low / close trade prices you are probably familiar with from stock quotes,
 plus the most recent bid, ask and trade prices, and the volume-weighted average trade price over the period.
@@ -374,28 +475,100 @@ class GBroke:
     #RTVOLUME = "233"
     #RT_TRADE_VOLUME = "375"
     #TICK_TYPE_RT_TRADE_VOLUME = 77
+    #: Reject orders needing more than the balance in the local ledger (see :meth:`check_order`); False to trade on margin
+    check_funds = True
 
-    def __init__(self,wsurl = 'wss://ws-feed-public.sandbox.gdax.com',posturl = 'https://api-public.sandbox.gdax.com', client_id=None, timeout_sec=5, verbose=3):
+    def __init__(self,wsurl = 'wss://ws-feed-public.sandbox.gdax.com',posturl = 'https://api-public.sandbox.gdax.com', client_id=None, timeout_sec=5, verbose=3, metrics_port=None, history_size=1024, cache_dir=None, shards=0, clock_sync_sec=60, depth_levels=1, stall_sec=5.0, paper=None, paper_latency_sec=0.1):
         """Connect to Interactive Brokers.
 
         :param int client_id: An integer identifying which API client made an order.  In order to report
           and modify orders created before this connection, you must use the same `client_id` they were created with.
         :param float timeout_sec: If a connection cannot be established within this time, an exception is raised.  Also used internally for request timeouts.
+        :param int metrics_port: If given, serve :attr:`metrics` as text on ``http://127.0.0.1:metrics_port/metrics``.
+        :param int history_size: Number of bars of history to keep per instrument and bar size for :meth:`get_bars`; 0 to keep none.
+        :param str cache_dir: Where to cache historic candles for :meth:`backfill` and product metadata; defaults to ``~/.gbroke``.
+        :param int shards: If nonzero, handle market data in this many worker processes (see :mod:`gbroke.shards`)
+          instead of in this one.  Use when one core can't keep up with all your products.
+        :param float clock_sync_sec: How often to sample server time to track the exchange clock (see :meth:`exchange_now`).
+        :param int depth_levels: Number of price levels summed into `bid_depth` and `ask_depth` for ``'level2'`` feeds
+          (see :meth:`register`).  With 1 they match ``'full'`` feeds: the total size at the best price.
+        :param float stall_sec: Reconnect a product's feed if it gets no message (not even a heartbeat) for this long;
+          see :class:`~gbroke.watchdog.FeedWatchdog`.  0 to never reconnect.
+        :param dict paper: If given, paper trade: don't send orders, but fill them against the live market data (see
+          :mod:`gbroke.paper`), starting with these balances, e.g. ``{'USD': 10000.0}``.
+        :param float paper_latency_sec: Delay for paper orders and cancels to reach the simulated exchange.
         """
         super().__init__()
         client_id = client_id if client_id is not None else random.randint(1, 2**31 - 1)       # TODO: It might be nice if this was a consistent hash of the caller's __file__ or __module__ or something.
         self.log = create_logger(__name__, LOG_LEVELS[verbose])
         self.verbose = verbose
+        self._init_state(timeout_sec, history_size, cache_dir, depth_levels)
+        if metrics_port is not None:
+            self.log.info('Serving metrics on port %d', self.metrics.serve(metrics_port))
+        self._watchdog = FeedWatchdog(self, stall_sec) if stall_sec else None       # Reconnects stalled feeds
+        self._paper = None                          # PaperExchange, if paper trading
+        if paper is not None:
+            from .paper import PaperExchange
+            self._paper = PaperExchange(self, paper_latency_sec, clock=self.exchange_now)
+            self._positions.update((currency, (float(balance), 0.0)) for currency, balance in paper.items())
+        self._shards = None                         # ShardSupervisor, if market data is handled in worker processes
+        if shards:
+            from .shards import ShardSupervisor
+            self._shards = ShardSupervisor(self, shards)
+        #############################################################################
+        self.wsurl = wsurl
+        self.posturl = posturl
+        self.public_client    = gdax.PublicClient(api_url = self.posturl)
+        self.products = ProductRegistry(self.public_client.get_products, os.path.join(self.cache_dir, 'products.json'), log=self.log).load()       # Product ID -> Product
+        self.log.info('%d products', len(self.products))
+        self.clock = ClockSync()                    # Exchange clock offset, from REST server time and feed timestamps; see exchange_now()
+        self._sync_clock()
+        self.log.info('Exchange clock offset %+.3f sec (round trip %.3f sec)', self.clock.offset_at(), self.clock.best_rtt)
+        RecurringTask(self._sync_clock, interval_sec=clock_sync_sec, init_sec=clock_sync_sec, daemon=True)
+        self.auth_client = gdax.AuthenticatedClient(key        = APK_KEY,
+                                                    b64secret  = API_SECRET,
+                                                    passphrase = API_PASSPHRASE,
+                                                    api_url    =  self.posturl)
+        if not self.auth_client:
+            raise RuntimeError('Error connecting to IB')
+        self.log.info('Connected to %s', self.posturl)
+        #############################################################################
+        start = time.time()
+        self.log.info('GBroke %s, client ID %s', __version__, client_id)
+        #self._conn.reqAccountSummary(0, 'All', 'AccountType')       # TODO: Wait, show value, verify
+        time.sleep(0.15)
+        if self._paper is None:
+            self.reconcile() #TODO
+        else:
+            self.user_id = self.profile_id = None   # No account; nothing on the feed is ours
+            self.log.info('Paper trading with %s', paper)
+        self.log_positions()
+        self.log_open_orders()
+
+    def _init_state(self, timeout_sec, history_size, cache_dir, depth_levels, threaded=True):
+        """Set up the local state: instruments, handlers, market data, orders, positions and metrics.  Connects to
+        nothing; shared with :class:`~gbroke.backtest.BacktestBroker`.  `threaded` is for :attr:`triggers`."""
         self.account = None
         self.account_type = None                    # INDIVIDUAL for paper or real accounts, UNIVERSAL for demo
         self.__next_order_id = 0
-        self._instruments = dict()                  # Maps instrument ID (contract ID) to Instrument object
+        self._instruments = dict()                  # Maps instrument ID (contract ID) to Instrument object; one per ID
         self._tick_errors = dict()                  # Maps instrument ID (contract ID) to queue of any exceptions (errors) generated by requesting that ticker
         self._tick_handlers = defaultdict(list)     # Maps instrument ID (contract ID) to list of functions to be called when that instrument's quote changes
         self._bar_handlers = defaultdict(list)      # Maps (bar_type, bar_size, instrument_id) to list of functions to be called with those bar events
         self._order_handlers = defaultdict(list)    # Maps instrument ID (contract ID) to list of functions to be called with order updates for that instrument
         self._alert_hanlders = defaultdict(list)    # Maps instrument ID (contract ID) to list of functions to be called with alerts for those tickers
+        self.triggers = TriggerEngine(self.order, self.log, threaded)       # Local stop, trailing stop and bracket orders
+        self._order_listeners = [self.triggers.on_order]      # Functions called with the live order record on every order update for any instrument
+        self._streams = []                          # Open Streams from stream() and order_events(), for the handler queue metrics
+        self._tick_views = dict()                   # Maps instrument ID to (TickView, Instrument, [(field mask, function)]) for tick handlers registered with view=True
         self._ticumulators = dict()                 # Maps instrument ID to Ticumulator for those ticks
+        self._bar_ticumulators = dict()             # Maps (instrument ID, bar_size) to the Ticumulator its time bars are taken from
+        self._feeds = dict()                        # Maps instrument ID to (feed level, websocket client)
+        self._books = dict()                        # Maps instrument ID to Level2Book, for level2 feeds
+        self.depth_levels = depth_levels
+        self._histories = dict()                    # Maps (instrument ID, bar_size) to BarHistory of time bars
+        self._indicators = defaultdict(dict)        # Maps (bar_type, bar_size, instrument_id) to dict of indicator key to shared Indicator
+        self._bar_lock = threading.Lock()           # Held while a bar goes into history and indicators, so indicator() can catch up on history atomically
         self._orders = dict()                       # Maps order_id to Order object
         self._executions = dict()                   # Maps execution IDs to order IDs.  Tracked because commissions are per-execution with no order ref.
         self._positions = dict()                    # Maps instrument ID to (number of shares held, average cost)
@@ -403,32 +576,18 @@ class GBroke:
         self._contract_details = []                 # Maps contractDetails() request id (int) to ContractDetails object.
         self._reconcile_open_orders_end = threading.Event() # Cleared and waited on by reconcile(), set by openOrderEnd
         self.timeout_sec = timeout_sec
+        if history_size and not history.available():
+            self.log.warning('numpy not installed; not keeping bar history')
+            history_size = 0
+        self.history_size = history_size
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(os.path.expanduser('~'), '.gbroke')
+        self._backfiller = None                     # Created on first backfill()
+        self._publishers = dict()                   # Maps shared memory name to FeedPublisher; see publish()
+        self._quote_managers = dict()               # Maps instrument ID to QuoteManager; see quote_manager()
+        self._order_limiter = None                  # RateLimiter shared by quote managers, created with the first quote_manager()
         self.connected = None                       # Tri-state: None -> never been connected, False: initially was connected but not now, True: connected
-        #############################################################################
-        self.wsurl = wsurl
-        self.posturl = posturl
-        self.public_client    = gdax.PublicClient(api_url = self.posturl)
-        self.log.debug ("time .....",float(self.public_client.get_time()['epoch'])-time.time())
-        ts = self.public_client.get_time()['epoch']
-        _date = time.strftime('%Y-%m-%d', time.localtime(ts))
-        _time = time.strftime('%X', time.localtime(ts))
-        import os
-        os.system('date {} && time {}'.format(_date, _time))
-        self.auth_client = gdax.AuthenticatedClient(key        = APK_KEY,
-                                                    b64secret  = API_SECRET,
-                                                    passphrase = API_PASSPHRASE,
-                                                    api_url    =  self.posturl)
-        if not self.auth_client:
-            raise RuntimeError('Error connecting to IB')
-        print("You has connected sandbox gdx ")
-        #############################################################################
-        start = time.time()
-        self.log.info('IBroke %s ,client ID %d', __version__, client_id)
-        #self._conn.reqAccountSummary(0, 'All', 'AccountType')       # TODO: Wait, show value, verify
-        time.sleep(0.15)
-        self.reconcile() #TODO
-        self.log_positions()
-        self.log_open_orders()
+        self.metrics = MetricsRegistry()            # Feed, book, order and scheduler counters; see _init_metrics()
+        self._init_metrics()
 
     def get_instrument(self, symbol: Union[str, ContractTuple, int, Instrument], sec_type: str = 'STK', exchange: str = 'GDAX', currency: str = 'USD', expiry: Optional[str] = None, strike: float = 0.0, opt_type: Optional[str] = None) -> Instrument:
         """Return an :class:`Instrument` object defining what will be purchased, at which exchange and in which currency.
@@ -444,23 +603,25 @@ class GBroke:
         :param exchange: The exchange to trade the contract on.  Usually: stock: SMART, futures: GLOBEX, forex: IDEALPRO
         :param strike: The strike price for options
         :param opt_type: 'PUT' or 'CALL' for options
+
+        Instruments are interned by ID: asking for the same product again returns the same object.
         """
 
         if isinstance(symbol, Instrument):
             return symbol
         elif isinstance(symbol, tuple):
             return self.get_instrument(*symbol)
+        elif not isinstance(symbol, (str, int)):
+            raise ValueError("symbol must be string, int, tuple, or Instrument")
+        inst = self._instruments.get(symbol)
+        if inst is not None:
+            return inst
         elif isinstance(symbol, int):
             contract = Contract()
             contract.m_conId = symbol
-            #inst = self._instruments.get(self._instrument_id_from_contract(contract))
-            #if inst is not None:
-            #    return inst
-        elif isinstance(symbol, str):
+        else:
             contract = make_contract(symbol, sec_type, exchange, currency, expiry, strike, opt_type)
             contract.m_conId = symbol
-        else:
-            raise ValueError("symbol must be string, int, tuple, or Instrument")
 
         # This functionality is split into request and response halves so elsewhere we can make the request in one callback and process the response in another.
         #req_id = self._request_contract_details(contract)
@@ -471,10 +632,19 @@ class GBroke:
         #self.auth_client.buy(price='100.00',  # USD
         #                     size='0.01',  # BTC
         #                     product_id='BTC-USD')
-        inst = Instrument(self, contract)
+        product = self.products.get(contract.m_conId)
+        if product is None and len(self.products):
+            self.log.warning('Unknown product %s', contract.m_conId)
+        inst = Instrument(self, contract, product)
         self._instruments[inst.id] = inst
         self._positions.setdefault(inst.id, (0,None))  # ib.reqPositions() (called in reconcile()) only gives 0 positions for instruments traded recently, so we
         return inst
+
+    def refresh_products(self) -> None:
+        """Fetch the exchange's product metadata again (e.g. after a status or increment change) and update instruments."""
+        self.products.refresh()
+        for inst in tuple(self._instruments.values()):
+            inst.product = self.products.get(inst.id)
     # def _request_contract_details(self, contract):
     #     """Call reqContractDetails and stuff the results in ``self._contract_details[req_id]``, where `req_id` is the return value."""
     #     req_id = len(self._contract_details)  # TODO: race condition between getting length and extending
@@ -503,7 +673,7 @@ class GBroke:
     #     self._instruments[inst.id] = inst
     #     self._positions.setdefault(inst.id, (0, None))  # ib.reqPositions() (called in reconcile()) only gives 0 positions for instruments traded recently, so we set our own
     #     return inst
-    def register(self, instrument: Union[str, ContractTuple, int, Instrument], on_bar: Callable[[Instrument, Bar], None] = None, on_order: Callable[[Order], None] = None, on_alert: Callable[[Instrument, str], None] = None, bar_type: str = 'time', bar_size: float = 1.0) -> None:
+    def register(self, instrument: Union[str, ContractTuple, int, Instrument], on_bar: Callable[[Instrument, Bar], None] = None, on_order: Callable[[Order], None] = None, on_alert: Callable[[Instrument, str], None] = None, bar_type: str = 'time', bar_size: float = 1.0, warmup: int = 0, feed: str = 'full', view: bool = False, fields: Optional[Iterable[str]] = None) -> None:
         """Register bar, order, and alert handlers for an `instrument`.
 
         :param instrument: The instrument to register callbacks for.  Can be symbol, contract tuple, or :class:`Instrument`.
@@ -512,7 +682,164 @@ class GBroke:
         :param on_alert: Call ``func(instrument, alert_type)`` for notification of session start/end, disconnects/reconnects, trading halts, corporate actions, etc related to `instrument`.
         :param bar_type: The type of bar to generate: `'time'` to get periodic bars, or `'tick'` to get updates with every quote change.
         :param bar_size: The period of a bar in seconds.  Ignored for ``bar_type == 'tick'``.
+        :param warmup: Pre-fill the bar history (and so any indicators on it) with this many historic bars, from
+          exchange candles, before live bars start.  `bar_size` must then be a multiple of 60.
+        :param feed: How much market data to subscribe to (see :data:`FEED_LEVELS`): ``'ticker'`` for top of book and
+          trades, ``'level2'`` for aggregated depth as well, or ``'full'`` for every order.  Bars have the same fields
+          either way, but the cheaper levels use a small fraction of the bandwidth and CPU.  An instrument is fed at
+          the highest level any registration asks for.
+        :param view: For ``bar_type == 'tick'``: call ``on_bar(instrument, view)`` with one reusable, read-only
+          :class:`TickView` instead of a new :class:`Bar` per tick.  Copy any values you keep.
+        :param fields: With `view`, only call `on_bar` for ticks that may have changed one of these :class:`Bar` fields,
+          e.g. ``('bid', 'ask')``.
+        """
+
+        assert bar_type in ('time', 'tick')
+        if feed not in FEED_LEVELS:
+            raise ValueError('feed must be one of {}'.format(FEED_LEVELS))
+        assert bar_size > 0
+        assert all(func is None or callable(func) for func in (on_bar, on_order, on_alert))
+        assert not all(func is None for func in (on_bar, on_order, on_alert))
+        instrument = self.get_instrument(instrument)
+        if on_bar:
+            if self._shards is None:
+                self._subscribe(instrument, feed)      # We need to accumulate ticks to make bars out of.
+            if bar_type == 'tick' and view:
+                self._add_tick_view(instrument, on_bar, fields)
+            elif bar_type == 'tick':
+                self._tick_handlers[instrument.id].append(on_bar)
+            elif bar_type == 'time':
+                first = (bar_type, bar_size, instrument.id) not in self._bar_handlers       # One timer per instrument and bar size
+                self._bar_handlers[(bar_type, bar_size, instrument.id)].append(on_bar)
+                if self.history_size and (instrument.id, bar_size) not in self._histories:
+                    self._histories[(instrument.id, bar_size)] = history.BarHistory(self.history_size)
+                    if warmup:
+                        self._warmup(instrument, bar_size, min(warmup, self.history_size))
+            if self._shards is not None:
+                self._shards.subscribe(instrument, bar_type, bar_size, feed)     # A worker makes the bars and sends them to _dispatch_bar()
+            elif bar_type == 'time' and first:
+                self._add_bar_ticumulator(instrument.id, bar_size)
+                self._schedule_bars(bar_size, instrument)
+            self.log.debug('REGISTER %s %s', instrument.id, instrument)
+        if on_order:
+            self._order_handlers[instrument.id].append(on_order)
+        if on_alert:
+            self._alert_hanlders[instrument.id].append(on_alert)
+
+        return instrument
+
+    def unregister(self, instrument: Union[str, ContractTuple, int, Instrument], on_bar: Callable[[Instrument, Bar], None] = None, on_order: Callable[[Order], None] = None, on_alert: Callable[[Instrument, str], None] = None, bar_type: str = 'time', bar_size: float = 1.0) -> None:
+        """Stop calling handlers previously passed to :meth:`register` with the same arguments.  Market data stays subscribed."""
+        instrument = self.get_instrument(instrument)
+        targets = []
+        if on_bar:
+            targets.append((self._tick_handlers, instrument.id, on_bar) if bar_type == 'tick' else (self._bar_handlers, (bar_type, bar_size, instrument.id), on_bar))
+        if on_order:
+            targets.append((self._order_handlers, instrument.id, on_order))
+        if on_alert:
+            targets.append((self._alert_hanlders, instrument.id, on_alert))
+        for handlers, key, func in targets:
+            if key in handlers:
+                handlers[key] = [handler for handler in handlers[key] if handler is not func]     # Copy on write; another thread may be calling the old list
+        views = self._tick_views.get(instrument.id)
+        if on_bar and bar_type == 'tick' and views is not None:
+            self._tick_views[instrument.id] = views[:2] + ([(mask, func) for mask, func in views[2] if func is not on_bar],)
+
+    def stream(self, instrument: Union[str, ContractTuple, int, Instrument], bar_type: str = 'time', bar_size: float = 1.0, maxsize: int = 4096):
+        """:Return: a :class:`~gbroke.streams.Stream` of the :class:`Bar`\\ s that a `bar_type` handler for `instrument` would get.
+
+        Read it at your own pace, e.g. ``for bar in stream`` or ``bars = stream.batch()``; close it to stop.
+        """
+        from .streams import Stream
+        handler = lambda _, bar: stream.put(bar)
+        def remove():
+            self.unregister(instrument, handler, bar_type=bar_type, bar_size=bar_size)
+            self._remove_stream(stream)
+        stream = Stream(maxsize, on_close=remove, on_drop=lambda: self._metric_handler_dropped.inc('stream'))
+        instrument = self.register(instrument, handler, bar_type=bar_type, bar_size=bar_size)
+        self._streams = self._streams + [stream]
+        return stream
+
+    def order_events(self, maxsize: int = 4096):
+        """:Return: a :class:`~gbroke.streams.Stream` of :class:`Order` copies, one per order update for any instrument."""
+        from .streams import Stream
+        listener = lambda order: stream.put(order.snapshot())
+        def remove():
+            self._order_listeners = [func for func in self._order_listeners if func is not listener]        # Copy on write, as in unregister()
+            self._remove_stream(stream)
+        stream = Stream(maxsize, on_close=remove, on_drop=lambda: self._metric_handler_dropped.inc('order_events'))
+        self._order_listeners = self._order_listeners + [listener]
+        self._streams = self._streams + [stream]
+        return stream
+
+    def _remove_stream(self, stream):
+        self._streams = [other for other in self._streams if other is not stream]
+
+    def publish(self, instrument: Union[str, ContractTuple, int, Instrument], name: str = 'gbroke', bar_type: str = 'time', bar_size: float = 1.0, slots: Optional[int] = None, feed: str = 'full'):
+        """Publish `instrument`'s `bar_type` bars (or ticks) to other processes through shared memory segment `name`.
+
+        Read them with a :class:`~gbroke.sharedfeed.FeedSubscriber`.  All calls with the same `name` share one ring
+        buffer of `slots` records (only used by the first).  The segment is removed on :meth:`disconnect`.
+        `feed` is as for :meth:`register`.
+
+        :return: The :class:`~gbroke.sharedfeed.FeedPublisher`.
+        """
+        from .sharedfeed import FeedPublisher, DEFAULT_SLOTS
+        publisher = self._publishers.get(name)
+        if publisher is None:
+            publisher = self._publishers[name] = FeedPublisher(name, slots or DEFAULT_SLOTS)
+        if bar_type == 'tick':
+            self.register(instrument, publisher.on_tick, bar_type='tick', feed=feed)
+        else:
+            self.register(instrument, publisher.bar_handler(bar_size), bar_type=bar_type, bar_size=bar_size, feed=feed)
+        return publisher
+
+    def record(self, instrument: Union[str, ContractTuple, int, Instrument], directory: str, rows: bool = False, compress: bool = False, feed: str = 'full', **kwargs):
+        """Record market data for `instrument` to binary files in `directory`.
+
+        :param rows: If False, record every tick as a ``(time, field, value)`` record (see :class:`~gbroke.recorder.TickRecorder`);
+          if True, record a whole top-of-book row on every quote change (see :class:`~gbroke.recorder.QuoteRecorder`).
+        :param compress: If True, record ticks to a compressed chunk file (see :class:`~gbroke.chunkstore.CompressedTickRecorder`).
+          Cannot be combined with `rows`.
+        :param feed: How much market data to subscribe to, as for :meth:`register`; ``'ticker'`` is enough for quotes and trades.
+        :param kwargs: Passed to the recorder, e.g. `file_size` and `flush_sec`, or `chunk_records` if compressing.
+          Compressed values are scaled by the product's `quote_increment` and `base_increment` unless `tick_size` and
+          `size_increment` are given.
+        :return: The recorder.  Call its `close()` method to stop recording; that also stops feeding it.
         """
+        from .recorder import TickRecorder, QuoteRecorder
+        if rows and compress:
+            raise ValueError('Only ticks (not rows) can be recorded compressed')
+        instrument = self.get_instrument(instrument)
+        self._subscribe(instrument, feed)
+        if rows:
+            recorder = QuoteRecorder(directory, instrument.id, **kwargs)
+            self._tick_handlers[instrument.id] = self._tick_handlers[instrument.id] + [recorder]      # Copy on write, as in unregister()
+            recorder.on_close = lambda: self.unregister(instrument, recorder, bar_type='tick')
+        else:
+            if compress:
+                from .chunkstore import CompressedTickRecorder
+                if instrument.product is not None:
+                    kwargs.setdefault('tick_size', instrument.product.quote_increment)
+                    kwargs.setdefault('size_increment', instrument.product.base_increment)
+                recorder = CompressedTickRecorder(directory, instrument.id, **kwargs)
+            else:
+                recorder = TickRecorder(directory, instrument.id, **kwargs)
+            acc = self._ticumulators[instrument.id]
+            acc.listeners = acc.listeners + [recorder]
+
+            def remove():
+                acc.listeners = [func for func in acc.listeners if func is not recorder]      # Copy on write; the feed thread may be iterating it
+            recorder.on_close = remove
+        self.log.info('RECORD %s to %s', instrument, recorder.path_prefix)
+        return recorder
+
+    def _subscribe(self, instrument: Instrument, feed: str = 'full') -> None:
+        """Subscribe to `feed` level market data for `instrument` and start accumulating its ticks, if not already
+        subscribed at that level or higher.  A lower level feed is replaced."""
+        current = self._feeds.get(instrument.id)
+        if current is not None and FEED_LEVELS.index(current[0]) >= FEED_LEVELS.index(feed):
+            return
 
         # class WSClient(gdax.WebsocketClient):
         #     def __init__(self,context,url,products):
@@ -542,6 +869,50 @@ class GBroke:
         #         self.context._call_alert_handlers('Disconnect')
 
 
+        conn = self._feed_client(instrument.symbol, feed)
+        if current is not None:
+            self.log.info('FEED %s from %s to %s', instrument.id, current[0], feed)
+            self._feeds[instrument.id] = (feed, conn)       # Before closing, so the old client's on_close knows it was replaced
+            current[1].close()
+            conn.start()
+            return
+
+        def unblock_register(*args):
+            """Temporary initial on_tick handler to unblock register() if a tick arrives"""
+            self._tick_errors[instrument.id].put_nowait(None)
+
+        self._tick_errors[instrument.id] = Queue()      # _error() stuffs an exception in if it gets an error message; unblock_register stuffs None if it gets a tick
+        self._tick_handlers[instrument.id].append(unblock_register)
+        self._ticumulators[instrument.id] = Ticumulator(clock=self.exchange_now)
+
+        #self._conn.reqMktData(instrument.id, instrument._contract, self.RTVOLUME, snapshot=False)       # Subscribe to continuous updates
+        self._feeds[instrument.id] = (feed, conn)
+        #self._conn.initialize(self)
+        conn.start()
+        # TODO: Request an initial snapshot so we can start sending ticks without NaNs.
+        # Hrm: Snapshots seem to take like 15 seconds...
+        # self._conn.reqMktData(instrument.id, instrument._contract, None, snapshot=True)        # Request all fields once initially, so we don't have to wait for them to fill in
+        # time.sleep(15)
+        # Wait for errors
+        # TODO: Something about waiting on errors.  There's no message on successful mkt data subscription,
+        # so it's hard to know when it worked.  There won't always be a tick on success.
+        # The delay compounds when subscribing to many tickers.  One shared
+        # Queue to wait on?  Poll all queues (python doesn't have a wait-on-multiple-queues select() type thing)?
+        try:
+            err = self._tick_errors[instrument.id].get(timeout=self.timeout_sec)
+            if err is not None:
+                raise err
+        except Empty:       # No errors (or ticks) within timeout
+            pass
+        assert len(self._tick_handlers[instrument.id]) == 1, 'Found more than initial tick handler on register {}: {}'.format(instrument.id, self._tick_handlers[instrument.id])
+        self._tick_handlers[instrument.id].pop()        # Remove initial handler
+
+    def _feed_client(self, product: str, feed: str):
+        """:Return: a new, unstarted websocket client for `feed` level market data for `product`.
+
+        Clients record when they were `started` and got their `last_message` (monotonic sec), whether they are `live`
+        (have had a message) and `closed`, for the :class:`~gbroke.watchdog.FeedWatchdog`.
+        """
         class WSClient(gdax.OrderBook):
             def __init__(self,context,url,products):
                 super(WSClient, self).__init__(url = url,
@@ -551,20 +922,31 @@ class GBroke:
                                                api_secret = API_SECRET,
                                                api_passphrase = API_PASSPHRASE
                                                )#
+                self.channels = ['full', 'heartbeat']
                 self._context = context
-                self._bid = None
-                self._ask = None
-                self._bid_depth = None
-                self._ask_depth = None
+                self._top = None            # Last (bid, bidsize, bid_depth, ask, asksize, ask_depth) passed on
                 self._products = products
-                print("products:",self._products)
+                self._last_sequence = None
+                self.started = self.last_message = time.monotonic()     # For the watchdog
+                self.live = False           # Has had a message
+                self.closed = False
 
             def on_open(self):
-                print("Let's count the messages!")
+                self._context.log.info('FEED %s open', self._products)
 
             def on_message(self, message):
                 #print("bookorder message:",message)
-                self._context.connected = True  # TODO
+                received = time.time()
+                self.last_message = time.monotonic()
+                if not self.live:
+                    self._context._on_feed_up(self)
+                if 'time' in message:
+                    self._context._on_feed_time(message['time'], received, self._products)
+                sequence = message.get('sequence')
+                if sequence is not None:
+                    if self._last_sequence is not None and sequence > self._last_sequence + 1:
+                        self._context._metric_sequence_gaps.inc(self._products)
+                    self._last_sequence = sequence
                 super(WSClient, self).on_message(message)
                 self._context._handle_message(message)
                 bid = self.get_bid()
@@ -573,88 +955,53 @@ class GBroke:
                 ask = self.get_ask()
                 asks = self.get_asks(ask)
                 ask_depth = sum([a['size'] for a in asks])
-                if self._bid == bid and self._ask == ask and self._bid_depth == bid_depth and self._ask_depth == ask_depth:
-                    # If there are no changes to the bid-ask spread since the last update, no need to print
-                    pass
-                else:
-                    # If there are differences, update the cache
-                    self._bid = bid
-                    self._ask = ask
-                    self._bid_depth = bid_depth
-                    self._ask_depth = ask_depth
-                    #print('{} {} bid: {:.3f} @ {:.2f}\task: {:.3f} @ {:.2f}'.format(
-                    #   dt.datetime.now(), self.product_id, bid_depth, bid, ask_depth, ask))
-                    # print("#########################################################",float(bid),float(ask),self.get_bid(bid),self.get_ask(ask))
-                acc = self._context._ticumulators.get(self._products)
-                acc.add('bid_depth', float(bid_depth))
-                acc.add('ask_depth', float(ask_depth))
-                # print("===============bid:",bid,bid['price'])
-                acc.add('bid', float(bid))
-                acc.add('ask', float(ask))
-                # print('$$$$:',type(bid),bid,bids[-1]['size'])
-                acc.add('bidsize', float(bids[-1]['size']) if bid_depth > 0.0 else 0.0)
-                acc.add('asksize', float(asks[-1]['size']) if ask_depth > 0.0 else 0.0)
+                top = (float(bid), float(bids[-1]['size']) if bid_depth > 0.0 else 0.0, float(bid_depth),
+                       float(ask), float(asks[-1]['size']) if ask_depth > 0.0 else 0.0, float(ask_depth))
+                if top != self._top:        # Most messages are for orders away from the top
+                    self._context._metric_book_updates.inc(self._products)
+                    self._top = top
+                    self._context._quote_full(self._products, top)
+                if self._context._ticumulators[self._products].changed:
+                    self._context._call_tick_handlers(self._products)
                 #print("bookorder message over:")
 
 
             def on_close(self):
-                print("-- Goodbye! --")
-                self._context.connected = False
-                self._context._call_alert_handlers('Disconnect')
+                self.closed = True
+                self._context._on_feed_close(self)
 
+        class ChannelClient(gdax.WebsocketClient):
+            """Feed of only `channels` for `products`; the broker's message handlers (e.g. :meth:`GBroke._ticker`) do the rest."""
+            def __init__(self, context, url, products, channels):
+                super(ChannelClient, self).__init__(url=url, products=products, channels=channels)
+                self._context = context
+                self._products = products
+                self.started = self.last_message = time.monotonic()
+                self.live = False
+                self.closed = False
 
-        assert bar_type in ('time', 'tick')
-        assert bar_size > 0
-        assert all(func is None or callable(func) for func in (on_bar, on_order, on_alert))
-        assert not all(func is None for func in (on_bar, on_order, on_alert))
-        instrument = self.get_instrument(instrument)
-        if on_bar:
-            # We need to accumulate ticks to make bars out of.
-            if not self._tick_handlers.get(instrument.id):      # New ticker (get() does not insert into defaultdict)
-                def unblock_register(*args):
-                    """Temporary initial on_tick handler to unblock register() if a tick arrives"""
-                    self._tick_errors[instrument.id].put_nowait(None)
-
-                self._tick_errors[instrument.id] = Queue()      # _error() stuffs an exception in if it gets an error message; unblock_register stuffs None if it gets a tick
-                self._tick_handlers[instrument.id].append(unblock_register)
-                self._ticumulators[instrument.id] = Ticumulator()
-
-                #self._conn.reqMktData(instrument.id, instrument._contract, self.RTVOLUME, snapshot=False)       # Subscribe to continuous updates
-                self._conn = WSClient(self,url=self.wsurl,products=instrument.symbol) #product 哪里给定？
-                #self._conn.initialize(self)
-                self._conn.start()
-                print("start ws client  ......... ")
-                # TODO: Request an initial snapshot so we can start sending ticks without NaNs.
-                # Hrm: Snapshots seem to take like 15 seconds...
-                # self._conn.reqMktData(instrument.id, instrument._contract, None, snapshot=True)        # Request all fields once initially, so we don't have to wait for them to fill in
-                # time.sleep(15)
-                # Wait for errors
-                # TODO: Something about waiting on errors.  There's no message on successful mkt data subscription,
-                # so it's hard to know when it worked.  There won't always be a tick on success.
-                # The delay compounds when subscribing to many tickers.  One shared
-                # Queue to wait on?  Poll all queues (python doesn't have a wait-on-multiple-queues select() type thing)?
-                try:
-                    err = self._tick_errors[instrument.id].get(timeout=self.timeout_sec)
-                    if err is not None:
-                        raise err
-                except Empty:       # No errors (or ticks) within timeout
-                    pass
-                assert len(self._tick_handlers[instrument.id]) == 1, 'Found more than initial tick handler on register {}: {}'.format(instrument.id, self._tick_handlers[instrument.id])
-                self._tick_handlers[instrument.id].pop()        # Remove initial handler
-            if bar_type == 'tick':
-                self._tick_handlers[instrument.id].append(on_bar)
-            elif bar_type == 'time':
-                if len(frozenset(inst.id for _, _, inst in self._bar_handlers)) > 1:
-                    raise NotImplementedError("Can't handle multiple bar types / sizes yet (instrument {})".format(instrument))
-                self._bar_handlers[(bar_type, bar_size, instrument.id)].append(on_bar)
-                RecurringTask(lambda: self._call_bar_handlers(bar_type, bar_size, instrument.id), interval_sec=bar_size, init_sec=1, daemon=True)        # This apparently sticks around even without maintaining a reference...
-            self.log.debug('REGISTER %d %s', instrument.id, instrument)
-        if on_order:
-            self._order_handlers[instrument.id].append(on_order)
-        if on_alert:
-            self._alert_hanlders[instrument.id].append(on_alert)
+            def on_open(self):
+                self._context.log.info('FEED %s %s open', self._products, self.channels)
 
-        return instrument
+            def on_message(self, message):
+                received = time.time()
+                self.last_message = time.monotonic()
+                context = self._context
+                if not self.live:
+                    context._on_feed_up(self)
+                if 'time' in message:
+                    context._on_feed_time(message['time'], received, self._products)
+                context._handle_message(message)
+                if message.get('type') in TICK_MESSAGES:
+                    context._call_tick_handlers(self._products)
+
+            def on_close(self):
+                self.closed = True
+                self._context._on_feed_close(self)
+
+        if feed == 'full':
+            return WSClient(self, url=self.wsurl, products=product)
+        return ChannelClient(self, url=self.wsurl, products=product, channels=FEED_CHANNELS[feed])
 
     # def watch_bookorder(self, instrument: Union[str, ContractTuple, int, Instrument]):
     #     class OrderBookConsole(gdax.OrderBook):
@@ -721,77 +1068,157 @@ class GBroke:
         """Place an order and return an Order object, or None if no order was made.
 
         The returned object does not change (will not update).
+
+        The order is first quantized and checked by :meth:`check_order`; if it fails, the reasons are logged and
+        None is returned without contacting the exchange.
+
+        Stop and bracket orders are held locally by :attr:`triggers` (see :mod:`gbroke.triggers`) and fire on the
+        last trade price:
+
+        - With `stop`, returns a :class:`~gbroke.triggers.Trigger` that sends a market (or with `limit`, limit) order
+          when the price reaches `stop`.  Cancel it with :meth:`cancel`.
+        - With `target` and `stop`, sends the entry order (at `limit`, or market) and returns it.  Once it is done,
+          whatever it filled is closed by a limit order at `target` or a market order at `stop`, whichever is reached
+          first.  Cancelling the entry before it fills cancels the bracket.
         """
-        if target:
-            raise NotImplementedError()
+        try:
+            if target:
+                if not stop:
+                    raise ValueError('A bracket order needs both target and stop')
+                quantity, limit, _ = self.check_order(instrument, quantity, limit)
+                _, target, _ = check_order(instrument.product, -quantity, limit=target)     # Exits can't be funded yet
+                _, _, stop = check_order(instrument.product, -quantity, stop=stop)
+            else:
+                quantity, limit, stop = self.check_order(instrument, quantity, limit, stop)
+        except OrderRejected as e:
+            self.log.warning('%s', e)
+            for reason, _ in e.reasons:
+                self._metric_orders_rejected.inc(instrument.id, reason)
+            return None
         if quantity == 0:
             return None
+        if target:
+            entry = self.order(instrument, quantity, limit=limit)
+            if entry is not None:
+                self._watch_triggers(instrument)
+                record = self._orders.get(entry.id)
+                self.triggers.bracket(record, quantity, target, stop)
+                self.triggers.on_order(record)      # In case it was done before the bracket was armed
+            return entry
+        elif stop:
+            self._watch_triggers(instrument)
+            return self.triggers.stop(instrument, quantity, stop, limit)
+        elif self._paper is not None:
+            return self._paper.order(instrument, quantity, limit)
         # if not self.connected:
         #     self.log.error('Cannot order when not connected')
         #     return None
 
-        typemap = {
-            (False, False): 'market',
-            (False, True):  'limit',
-            (True, False):  'stop',
-            (True, True):   'STP LMT',#TODO
-        }
-
-        # TODO: Check stop limit values are consistent
         #order = IBOrder()
         order = GOrder() #TODO
         order.m_action = 'BUY' if quantity >= 0 else 'SELL'
-        order.m_totalQuantity = round(abs(quantity),3)
-        order.m_orderType = typemap[(bool(stop), bool(limit))]
+        order.m_totalQuantity = abs(quantity)
+        order.m_orderType = 'limit' if limit else 'market'      # Stops are held by triggers, so never get here
         order.m_lmtPrice = limit
-        order.m_auxPrice = stop
         #order.m_tif = 'DAY'     # Time in force: DAY, GTC, IOC, GTD
         #order.m_allOrNone = False   # Fill or Kill
         #order.m_goodTillDate = "" #  FORMAT: 20060505 08:00:00 {time zone}
         #order.m_clientId = self._conn.clientId
         #order.m_orderId = order_id = self._next_order_id() #TODO
         order_id = '' #placeholder
-        self.log.debug('ORDER %s: %s %s', order_id, obj2dict(instrument._contract), obj2dict(order))
+        if self.log.isEnabledFor(logging.DEBUG):
+            self.log.debug('ORDER %s: %s %s', order_id, obj2dict(instrument._contract), obj2dict(order))
         #self._orders[order_id] = Order._from_gb(order, order_id, instrument)
         #self.log.info('ORDER %s', self._orders[order_id])
         #self._conn.placeOrder(order_id, instrument._contract, order)        # This needs to come after updating self._orders
-        print("============================order.m_action:",order.m_action,order.m_orderType,order.m_orderId,instrument.id,order.m_totalQuantity,order.m_lmtPrice)
         order_id = str(uuid.uuid4())
         if not self._orders.get(order_id):
-            self._orders[order_id] = Order._from_gb(order, order_id, instrument)
+            self._orders[order_id] = _OrderRecord._from_gb(order, order_id, instrument)
+        price = {'price': order.m_lmtPrice} if limit else {}        # USD; stops are local (see triggers)
         if order.m_action == 'BUY':
-            res = self.auth_client.buy(client_oid = order_id,
+            res = self._rest('buy', self.auth_client.buy, client_oid = order_id,
                                  type = order.m_orderType,
-                                 #price=order.m_lmtPrice,  # USD  #TODO FOR STOP
+                                 **price,
                                  overdraft_enable = True,
                                  time_in_force = "GTT", #TODO
                                  cancel_after='min',
                                  post_only = True,
                                  size=order.m_totalQuantity,  # BTC
                                  product_id=instrument.id)
-            print("============================order res:",res) #TODO  https://api.coinbase.com/v2/time
         elif order.m_action == 'SELL':
-            res = self.auth_client.sell(client_oid = order_id,
+            res = self._rest('sell', self.auth_client.sell, client_oid = order_id,
                                  type=order.m_orderType,
-                                 #price=order.m_lmtPrice,  # USD  #TODO FOR STOP
+                                 **price,
                                  overdraft_enable=True,
                                  time_in_force="GTT",
                                  cancel_after = 'min',
                                  post_only=True,
                                  size=order.m_totalQuantity,  # BTC
                                  product_id=instrument.id)
-            print("============================order res",res)
         else :
             pass
         if 'id' in res:
-            return copy(self._orders[order_id])
+            return self._orders[order_id].snapshot()
         else:
             try:
                 del self._orders[order_id]
             except:
                 pass
             return None
-    #
+
+    def check_order(self, instrument: Instrument, quantity: float, limit: float = 0.0, stop: float = 0.0) -> Tuple[float, float, float]:
+        """Quantize an order to `instrument`'s size and price increments and check it against the product's status
+        and limits, and (if :attr:`check_funds`) the balance in the local ledger; see :mod:`gbroke.pretrade`.
+
+        :Return: ``(quantity, limit, stop)`` as they would be sent.
+        :raises OrderRejected: with the `reasons` the exchange would reject it.
+        """
+        product = instrument.product
+        price, available = float('NaN'), None
+        if product is not None:
+            acc = self._ticumulators.get(instrument.id)
+            if acc is not None:
+                price = acc.ask if quantity > 0 else acc.bid
+            if self.check_funds:
+                balance = self._positions.get(product.quote_currency if quantity > 0 else instrument.id)
+                available = balance[0] if balance is not None else None
+        return check_order(product, quantity, limit, stop, price, available)
+
+    def quote_manager(self, instrument: Union[str, ContractTuple, int, Instrument], size_tolerance: float = 0.2) -> 'QuoteManager':
+        """:Return: the :class:`~gbroke.quotes.QuoteManager` for `instrument`, creating it (with `size_tolerance`) if
+        necessary.  Call its :meth:`~gbroke.quotes.QuoteManager.quote` with the bids and asks you want resting; it sends
+        the fewest orders and cancels to get there, within the private request rate limit shared by all of them.
+        """
+        instrument = self.get_instrument(instrument)
+        manager = self._quote_managers.get(instrument.id)
+        if manager is None:
+            from .quotes import PRIVATE_RATE_BURST, PRIVATE_RATE_LIMIT, QuoteManager
+            from .ratelimit import RateLimiter
+            if self._order_limiter is None:
+                self._order_limiter = RateLimiter(PRIVATE_RATE_LIMIT, PRIVATE_RATE_BURST)
+            manager = self._quote_managers[instrument.id] = QuoteManager(self, instrument, self._order_limiter, size_tolerance)
+        return manager
+
+    def trailing_stop(self, instrument: Instrument, quantity: float, trail: float) -> Trigger:
+        """:Return: a local :class:`~gbroke.triggers.Trigger` that sends a market order for `quantity` when the last
+        trade price moves `trail` against its best since now: down from its high for a sell, up from its low for a buy."""
+        self._watch_triggers(instrument)
+        price = self._ticumulators[instrument.id].last
+        if price != price:
+            raise ValueError('No trades yet for {}'.format(instrument.id))
+        self.check_order(instrument, quantity)
+        return self.triggers.trailing_stop(instrument, quantity, trail, price)
+
+    def _watch_triggers(self, instrument):
+        """Feed `instrument`'s trades to :attr:`triggers`, subscribing to its ticker if necessary."""
+        views = self._tick_views.get(instrument.id)
+        if views is None or all(handler != self.triggers.on_tick for _, handler in views[2]):
+            if self._shards is not None:
+                self.log.warning('Triggers for %s need its ticks in this process; they will not fire with shards', instrument.id)
+            else:
+                self._subscribe(instrument, 'ticker')
+            self._add_tick_view(instrument, self.triggers.on_tick, ('last',))
+
     def order_target(self, instrument, quantity, limit=0.0, stop=0.0):
         """Place orders as necessary to bring position in `instrument` to `quantity`.
 
@@ -799,11 +1226,108 @@ class GBroke:
         """
         return self.order(instrument, quantity - self.get_position(instrument), limit=limit, stop=stop)
 
+    def get_book(self, instrument: Union[str, ContractTuple, int, Instrument]) -> Optional[Level2Book]:
+        """:Return: the live :class:`~gbroke.book.Level2Book` of `instrument`, registered with ``feed='level2'``, or None
+        if it has none (yet).  For top-N levels and depth, e.g. ``book.bid_levels(5)``.  Only read it from tick or
+        bar handlers, since the feed thread updates it between them.
+        """
+        return self._books.get(self.get_instrument(instrument).id)
+
+    def get_bars(self, instrument: Instrument, n: Optional[int] = None, bar_size: Optional[float] = None) -> 'history.Bars':
+        """:Return: the last `n` time bars (or all kept, if None) for `instrument` as :class:`~gbroke.history.Bars`
+        of read-only NumPy arrays, oldest first.
+
+        The arrays are views of a history shared by all handlers, and are overwritten after `history_size` more bars;
+        copy them if you need to keep them.
+
+        :param bar_size: Which registered bar size to get; may be omitted if only one is registered for `instrument`.
+        """
+        instrument = self.get_instrument(instrument)
+        if bar_size is None:
+            sizes = [size for inst_id, size in self._histories if inst_id == instrument.id]
+            if len(sizes) != 1:
+                raise ValueError('bar_size must be given for {} (registered sizes: {})'.format(instrument, sizes))
+            bar_size = sizes[0]
+        hist = self._histories.get((instrument.id, bar_size))
+        if hist is None:
+            raise ValueError('No {} sec bar history for {}'.format(bar_size, instrument))
+        return hist.get(n)
+
+    def indicator(self, instrument: Instrument, name: str, bar_type: str = 'time', bar_size: Optional[float] = None, **params) -> Indicator:
+        """:Return: a streaming :class:`~gbroke.indicators.Indicator` of type `name` (e.g. ``'ema'``, see
+        :data:`~gbroke.indicators.INDICATORS`) over the `bar_type` bars of `instrument`.
+
+        The indicator is updated once per bar, before bar handlers are called, and the same object is returned to
+        everyone asking for the same indicator and `params`.  Read its `value` in your bar handler.
+
+        :param bar_type: ``'time'`` to update on the `bar_size` bars (which must already be registered), or ``'tick'`` on every tick.
+        :param bar_size: Which registered time bar size; may be omitted if only one is registered for `instrument`.
+        :param params: Indicator parameters, e.g. ``period=20``.
+        """
+        instrument = self.get_instrument(instrument)
+        if bar_type == 'tick':
+            if self._shards is None:
+                self._subscribe(instrument)
+            else:
+                self._shards.subscribe(instrument, 'tick', None)
+            bar_size = None
+        elif bar_type == 'time':
+            sizes = [size for type_, size, inst_id in self._bar_handlers if type_ == 'time' and inst_id == instrument.id]
+            if bar_size is None and len(sizes) == 1:
+                bar_size = sizes[0]
+            if bar_size not in sizes:
+                raise ValueError('Register {} bars for {} before asking for indicators on them (registered sizes: {})'.format(bar_size, instrument, sizes))
+        else:
+            raise ValueError("bar_type must be 'time' or 'tick'")
+        stream = (bar_type, bar_size, instrument.id)
+        key = (name,) + tuple(sorted(params.items()))
+        with self._bar_lock:        # No bar may slip in between catching up and installing, or it would be missed
+            indicator = self._indicators[stream].get(key)
+            if indicator is None:
+                indicator = make_indicator(name, **params)
+                hist = self._histories.get((instrument.id, bar_size)) if bar_type == 'time' else None
+                if hist is not None:        # Catch up on bars (live or backfilled) seen before anyone asked
+                    for row in zip(*hist.get()):
+                        indicator.update(Bar._make(row))
+                self._indicators[stream] = {**self._indicators[stream], key: indicator}      # Copy on write; the feed thread may be iterating the old dict for ticks
+        return indicator
+
+    def backfill(self, instrument: Instrument, start, end=None, granularity: int = 60):
+        """:Return: a NumPy array of historic candles (see :data:`gbroke.backfill.CANDLE_DTYPE`) for `instrument`
+        starting in ``[start, end)``, oldest first.
+
+        Pages are fetched concurrently within the public rate limit, and complete days are cached under :attr:`cache_dir`.
+
+        :param start: Epoch seconds or datetime.
+        :param end: Epoch seconds or datetime; defaults to now.
+        :param granularity: Candle size in seconds; one of :data:`gbroke.backfill.GRANULARITIES`.
+        """
+        from . import backfill
+        if self._backfiller is None:
+            self._backfiller = backfill.Backfiller(lambda *args, **kwargs: self._rest('get_product_historic_rates', self.public_client.get_product_historic_rates, *args, **kwargs),
+                                                   os.path.join(self.cache_dir, 'candles'))
+        return self._backfiller.candles(self.get_instrument(instrument).symbol, start, time.time() if end is None else end, granularity)
+
+    def _warmup(self, instrument, bar_size, n):
+        """Append the `n` most recent complete `bar_size` bars of `instrument`, built from candles, to its bar history."""
+        from . import backfill
+        try:
+            granularity = backfill.best_granularity(bar_size)
+        except ValueError as err:
+            self.log.warning("Can't warm up %s: %s", instrument, err)
+            return
+        end = math.floor(time.time() / bar_size) * bar_size
+        candles = self.backfill(instrument, end - n * bar_size, end, granularity)
+        hist = self._histories[(instrument.id, bar_size)]
+        for bar in backfill.candles_to_bars(candles, granularity, bar_size):
+            hist.append(bar)
+        self.log.info('WARMUP %s with %d %s sec bars', instrument, min(len(hist), n), bar_size)
+
     def get_position(self, instrument):
         """:Return: the number of shares of `instrument` held (negative for short)."""
         pos = self._positions.get(instrument.id)
         if pos is None:
-            self.log.warning('get_position() for unknown instrument {}'.format(instrument))
+            self.log.warning('get_position() for unknown instrument %s', instrument)
             return 0
         return pos[0]
     #
@@ -817,32 +1341,39 @@ class GBroke:
         """:Return: the average cost of currently held shares of `instrument`.  If no shares held, return None."""
         pos = self._positions.get(instrument.id)
         if pos is None:
-            self.log.warning('get_cost() for unknown instrument {}'.format(instrument))
+            self.log.warning('get_cost() for unknown instrument %s', instrument)
             return None
         return pos[1] or None
     #
     def cancel(self, order):
-        """Cancel an `order`."""
+        """Cancel an `order`, or a :class:`~gbroke.triggers.Trigger` from :meth:`order` or :meth:`trailing_stop`."""
+        if isinstance(order, Trigger):
+            self.triggers.cancel(order)
+            return
+        if self._paper is not None:
+            self._paper.cancel(order)
+            return
         self.log.info('CANCEL %s', order)
         if not self.connected:
             self.log.error('Cannot cancel order when disconnected')
         else:
             #self._conn.cancelOrder(order.id)
-            self.auth_client.cancel_order(order.id) #TODO id use gdax server id
+            self._rest('cancel_order', self.auth_client.cancel_order, order.id) #TODO id use gdax server id
 
     def cancel_all(self, instrument=None, hard_global_cancel=False):
-        """Cancel all open orders.  If given, only cancel orders for `instrument`.
+        """Cancel all open orders and local triggers.  If given, only cancel orders for `instrument`.
 
         :param bool hard_global_cancel: If True, issue a global cancel for ALL orders for this ENTIRE account,
           including orders made by other API clients and the TWS GUI.
         """
+        self.triggers.cancel_all(instrument)        # First, so none fire while orders are being cancelled
         # TODO: We might want to request all open orders, since our order status tracking might not be perfect.
         if hard_global_cancel:
             #if instrument is not None:
             #    raise ValueError('instrument must be None for hard_global_cancel')
             self.log.info('GLOBAL CANCEL')
             #self._conn.reqGlobalCancel()
-            self.auth_client.cancel_all(instrument.id)
+            self._rest('cancel_all', self.auth_client.cancel_all, instrument.id)
         else:
             for order in self._orders.values():
                 if order.open and (instrument is None or order.instrument == instrument):
@@ -863,8 +1394,7 @@ class GBroke:
         """:Return: an iterable of all open orders, or only those for `instrument` if given."""
         for order in self._orders.values():
             if order.open and (instrument is None or order.instrument == instrument):
-                print("openorder .......,",order)
-                yield copy(order)
+                yield order.snapshot()
 
     def reconcile(self,fields = ['profile','position','orders']):
         """Refresh the local state of orders and positions with those from the server.
@@ -881,12 +1411,11 @@ class GBroke:
 
 
         if 'profile' in fields:
-            position = self.auth_client.get_position()
-            print(position)
+            position = self._rest('get_position', self.auth_client.get_position)
             self.log.debug('RECONCILE PROFILE')
             self.user_id = position['user_id']
             self.profile_id = position['profile_id']
-            self.log.debug("user_id %s,profile_id:%s" % (self.user_id, self.profile_id))
+            self.log.debug('user_id %s, profile_id %s', self.user_id, self.profile_id)
 
         if 'position' in fields:
             self.log.debug('RECONCILE POSITIONS')
@@ -910,8 +1439,7 @@ class GBroke:
             #latest_trade = self.public_client.get_product_trades("BTC-USD")
             #print(latest_trade)
             #float(latest_trade[0]['price'])
-            position = self.auth_client.get_position()
-            print("-----------pos:",position)
+            position = self._rest('get_position', self.auth_client.get_position)
             if 'BTC' in position['accounts']:
                balance = float(position['accounts']['BTC']['balance'])
             else:
@@ -952,24 +1480,22 @@ class GBroke:
             #     self.log.error('reconcile() timed out waiting for all open orders')
             #
             # self._conn.reqIds(-1)
-            os = self.auth_client.get_orders()
+            os = self._rest('get_orders', self.auth_client.get_orders)
             for product in os:
                 for msg in product:
-                    order = Order(id_=str(msg['id']),
+                    order = _OrderRecord(id_=str(msg['id']),
                               instrument=self._instruments.get(str(msg['product_id'])),
                               price=float(msg['price']),
                               quantity=float(msg['size']) if msg["side"] == "buy" else -float(msg['size']),
                               filled=float(msg['filled_size']),
                               open=True,
                               cancelled=False)
-                    _created_at = ciso8601.parse_datetime(msg['created_at'])
-                    created_at = time.mktime(_created_at.timetuple())
-                    order.open_time = created_at / 1000
+                    order.open_time = _parse_time(msg['created_at'])
                     # o.fill_time =
                     # o.avg_price =
                     # order.avg_price =
                     # o.profit    =
-                    self._orders[order.order_id] = order
+                    self._orders[order.id] = order
 
         self.log.debug('RECONCILE END')
     #
@@ -990,27 +1516,151 @@ class GBroke:
     def disconnect(self):
         """Disconnect from IB, rendering this object mostly useless."""
         self.connected = False
-        self._conn.close()
+        if self._watchdog is not None:
+            self._watchdog.stop()
+        for _, conn in tuple(self._feeds.values()):         # None if all market data is sharded
+            conn.close()
+        for publisher in self._publishers.values():
+            publisher.close()
+        self._publishers.clear()
+        if self._shards is not None:
+            self._shards.close()
 
     def _next_order_id(self):
         """Increment the internal order id counter and return it."""
         self.__next_order_id += 1
         return self.__next_order_id
 
-    def _call_order_handlers(self, order):
-        """Call any order handlers registered for ``order.instrument``."""
-        for handler in self._order_handlers.get(order.instrument.id, ()):
-            handler(copy(order))
+    def _init_metrics(self):
+        """Create the standard feed, book, order and scheduler metrics in :attr:`metrics`.
 
-    def _call_tick_handlers(self, ticker_id, tick):
-        """Call any tick handlers for the given `ticker_id` with the given `tick` tuple."""
-        tick = Bar._make(tick)
-        instrument = self._instruments.get(ticker_id)
-        if instrument is None:
-            self.log.warning('No instrument found for ID %d calling tick handlers', ticker_id)
-        else:
-            for handler in self._tick_handlers.get(ticker_id, ()):      # get() does not insert into the defaultdict
+        Hot path metrics are kept as attributes so updating them is a single method call with no lookups.
+        """
+        m = self.metrics
+        self._metric_messages = m.counter('gbroke_messages_total', 'Feed messages received, by message type and product', ('type', 'product'))
+        self._metric_book_updates = m.counter('gbroke_book_updates_total', 'Top of book changes', ('product',))
+        self._metric_sequence_gaps = m.counter('gbroke_sequence_gaps_total', 'Feed sequence number gaps (missed messages)', ('product',))
+        self._metric_feed_latency = m.histogram('gbroke_feed_latency_seconds', 'Exchange timestamp to local receipt, on the exchange clock', ('product',))
+        self._metric_bar_jitter = m.histogram('gbroke_bar_jitter_seconds', 'Lateness of bar closes relative to schedule', ('product', 'bar_size'))
+        self._metric_rest_latency = m.histogram('gbroke_rest_latency_seconds', 'REST request latency', ('op',))
+        self._metric_rest_errors = m.counter('gbroke_rest_errors_total', 'REST requests that raised or returned an error message', ('op',))
+        self._metric_orders_rejected = m.counter('gbroke_orders_rejected_total', 'Orders rejected by pre-trade checks, by reason', ('product', 'reason'))
+        self._metric_quote_requests = m.counter('gbroke_quote_requests_total', 'Orders and cancels sent by quote managers', ('product', 'op'))
+        m.gauge('gbroke_open_orders', 'Open orders tracked locally', func=lambda: sum(1 for order in tuple(self._orders.values()) if order.open))
+        self._metric_handler_dropped = m.counter('gbroke_handler_dropped_total', 'Events dropped because a handler buffer was full, by buffer', ('queue',))
+        m.gauge('gbroke_handler_queue_depth', 'Events buffered for handlers: in stream() and order_events() streams, and fired triggers not yet sent',
+                func=lambda: sum(len(stream) for stream in self._streams) + self.triggers.queue_depth())
+        m.gauge('gbroke_log_queue_depth', 'Log records waiting for the writer thread', func=logs.queue_depth)
+
+    def exchange_now(self) -> float:
+        """:Return: the current exchange time (Unix seconds), estimated from the local clock and :attr:`clock`."""
+        return self.clock.now()
+
+    def _sync_clock(self):
+        """Take a REST server time sample for :attr:`clock`."""
+        try:
+            sent = time.time()
+            res = self._rest('get_time', self.public_client.get_time)
+            received = time.time()
+            self.clock.add_rest(float(res['epoch']), sent, received)
+        except Exception as err:        # Runs in a RecurringTask; don't let one bad request kill it
+            self.log.warning('Error getting server time: %s', err)
+
+    def _on_feed_time(self, timestr, received, product):
+        """Use an exchange timestamp `timestr` on a feed message received at local time `received` to refine the clock and measure latency."""
+        exchange_time = _parse_time(timestr)
+        clock = self.clock
+        clock.add_feed(exchange_time, received)
+        self._metric_feed_latency.observe(received + clock.offset_at(received) - exchange_time, product)
+
+    def _rest(self, op, func, *args, **kwargs):
+        """Call REST client method `func` with the given arguments, recording its latency and any error under `op`.
+
+        :return: Whatever `func` returns.  Exceptions are re-raised.
+        """
+        start = time.time()
+        try:
+            res = func(*args, **kwargs)
+        except Exception:
+            self._metric_rest_errors.inc(op)
+            raise
+        finally:
+            self._metric_rest_latency.observe(time.time() - start, op)
+        if isinstance(res, dict) and 'message' in res:     # GDAX reports errors as {'message': ...}
+            self._metric_rest_errors.inc(op)
+        return res
+
+    def _call_order_handlers(self, order):
+        """Call any order handlers registered for ``order.instrument`` with a snapshot of live record `order`.
+        :attr:`_order_listeners` get the live record itself."""
+        for listener in self._order_listeners:
+            listener(order)
+        handlers = self._order_handlers.get(order.instrument.id)
+        if handlers:
+            snapshot = order.snapshot()     # One, shared by all handlers
+            for handler in handlers:
+                handler(snapshot)
+
+    def _call_tick_handlers(self, ticker_id, tick=None):
+        """Call any tick handlers for the given `ticker_id` with the given `tick` tuple, or if None its Ticumulator's
+        current values.  :class:`TickView` handlers get views of them; only the others need a :class:`Bar` built."""
+        acc = None
+        views = self._tick_views.get(ticker_id)
+        if views is not None:
+            view, instrument, handlers = views
+            if tick is None:
+                acc = view._src = self._ticumulators[ticker_id]
+                changed = acc.changed
+            else:
+                view._src = tick if isinstance(tick, Bar) else Bar._make(tick)
+                changed = ALL_FIELDS_MASK
+            for mask, handler in handlers:
+                if mask & changed:
+                    handler(instrument, view)
+        indicators = self._indicators.get(('tick', None, ticker_id))
+        handlers = self._tick_handlers.get(ticker_id)       # get() does not insert into the defaultdict
+        if indicators or handlers:
+            if tick is None:
+                acc = self._ticumulators[ticker_id]
+                tick = acc.peek()
+            tick = Bar._make(tick)
+            instrument = self._instruments.get(ticker_id)
+            if instrument is None:
+                self.log.warning('No instrument found for ID %s calling tick handlers', ticker_id)
+                return
+            if indicators:
+                for indicator in indicators.values():
+                    indicator.update(tick)
+            for handler in handlers or ():
                 handler(instrument, tick)
+        if acc is not None:
+            acc.changed = 0
+
+    def _add_tick_view(self, instrument, handler, fields):
+        """Call `handler` with a :class:`TickView` of `instrument` on ticks that change any of `fields` (all if None)."""
+        mask = ALL_FIELDS_MASK
+        if fields is not None:
+            try:
+                mask = 0
+                for field in fields:
+                    mask |= TICK_FIELD_MASKS[field]
+            except KeyError as err:
+                raise ValueError('Unknown tick field {}'.format(err)) from None
+        view, _, handlers = self._tick_views.get(instrument.id, (TickView(), instrument, []))
+        self._tick_views[instrument.id] = (view, instrument, handlers + [(mask, handler)])      # Copy on write, as in unregister()
+
+    def _add_bar_ticumulator(self, ticker_id, bar_size):
+        """Set up the Ticumulator that `ticker_id`'s `bar_size` time bars are taken from.  Taking a bar resets it, so only
+        the first size registered uses the instrument's own; each other size gets a :meth:`~Ticumulator.mirror`."""
+        acc = self._ticumulators[ticker_id]
+        if any(key[0] == ticker_id for key in self._bar_ticumulators):
+            acc = acc.mirror()
+        self._bar_ticumulators[(ticker_id, bar_size)] = acc
+
+    def _schedule_bars(self, bar_size, instrument):
+        """Call `instrument`'s `bar_size` time bar handlers every `bar_size` seconds, from now on."""
+        RecurringTask(lambda: self._call_bar_handlers('time', bar_size, instrument.id), interval_sec=bar_size, init_sec=1, daemon=True,        # This apparently sticks around even without maintaining a reference...
+                      on_jitter=lambda jitter: self._metric_bar_jitter.observe(jitter, instrument.id, bar_size))
 
     def _call_alert_handlers(self, alert, ticker_id=None):
         """Call all alert handlers with the given `alert`, or only those registered for a given `ticker_id` if given."""
@@ -1020,23 +1670,37 @@ class GBroke:
         else:
             instrument = self._instruments.get(ticker_id)
             if instrument is None:
-                self.log.warning('No instrument found for ID %d calling alert handlers', ticker_id)
+                self.log.warning('No instrument found for ID %s calling alert handlers', ticker_id)
             else:
                 for handler in self._alert_hanlders.get(ticker_id, ()):      # get() does not insert into the defaultdict
                     handler(instrument, alert)
 
     def _call_bar_handlers(self, bar_type, bar_size, ticker_id):
         """Generate a bar (of the given `bar_type` and `bar_size`) for `ticker_id` and call any registered bar handlers."""
+        acc = self._bar_ticumulators.get((ticker_id, bar_size))
+        if acc is None:
+            self.log.warning('No ticumulator found for ID %s calling %s %f bar handlers', ticker_id, bar_type, bar_size)
+        else:
+            self._dispatch_bar(bar_type, bar_size, ticker_id, acc.bar())
+
+    def _dispatch_bar(self, bar_type, bar_size, ticker_id, bar):
+        """Record `bar` in history, update indicators, and call the bar handlers for `ticker_id`."""
         instrument = self._instruments.get(ticker_id)
-        acc = self._ticumulators.get(ticker_id)
         handlers = self._bar_handlers.get((bar_type, bar_size, ticker_id))
-        #print("#################################",acc,instrument,handlers)
-        if acc is None or instrument is None or handlers is None:
-            self.log.warning('No instrument, ticumulator, or handlers found for ID %d calling %s %f bar handlers', ticker_id, bar_type, bar_size)
-        else:
-            bar = Bar._make(acc.bar())
-            for handler in handlers:
-                handler(instrument, bar)
+        if instrument is None or handlers is None:
+            self.log.warning('No instrument or handlers found for ID %s dispatching %s %f bar', ticker_id, bar_type, bar_size)
+            return
+        bar = Bar._make(bar)
+        with self._bar_lock:
+            hist = self._histories.get((ticker_id, bar_size))
+            if hist is not None:
+                hist.append(bar)
+            indicators = self._indicators.get((bar_type, bar_size, ticker_id))
+            if indicators:
+                for indicator in indicators.values():
+                    indicator.update(bar)
+        for handler in handlers:
+            handler(instrument, bar)
 
     @staticmethod
     def _instrument_id_from_contract(contract):
@@ -1057,6 +1721,7 @@ class GBroke:
         #name = getattr(msg, 'typeName', None)
         #name = getattr(msg, 'type', None)
         name = msg["type"]
+        self._metric_messages.inc(name, msg.get('product_id'))
         #print("debug msg:",msg)
         if not name or not name.isidentifier():
             self.log.error('Invalid message name %s', name)
@@ -1156,10 +1821,101 @@ class GBroke:
     #         acc.add('open_interest', msg.size)
     #
     #     self._call_tick_handlers(msg.tickerId, acc.peek())
+    def _on_feed_up(self, conn):
+        """First message on feed websocket `conn`."""
+        conn.live = True
+        self.connected = True
+        if self._watchdog is not None:
+            self._watchdog.up(conn._products)
+
+    def _on_feed_close(self, conn):
+        """A feed websocket `conn` closed.  The watchdog notices and reconnects, unless it was replaced or we're disconnecting."""
+        self.log.info('FEED %s closed', conn._products)
+
+    def _heartbeat(self, msg):
+        """Sent every second on each feed; all we need is that it arrived, which the feed client has noted."""
+        pass
+
+    def _reconnect_feed(self, product):
+        """Replace `product`'s feed websocket with a new one at the same level.  The exchange sends a fresh book on subscribe."""
+        feed, old = self._feeds[product]
+        conn = self._feed_client(product, feed)
+        self._feeds[product] = (feed, conn)         # Before closing, so the old client's on_close knows it was replaced
+        try:
+            old.close()
+        except Exception as err:
+            self.log.warning('Error closing %s feed: %s', product, err)
+        conn.start()
+
+    def _ticker(self, msg):
+        """Top of book and last trade, for 'ticker' level feeds."""
+        acc = self._ticumulators.get(msg['product_id'])
+        if acc is None:
+            return
+        for what, key in TICKER_FIELDS:
+            if msg.get(key):
+                acc.add(what, float(msg[key]))
+        if msg.get('best_bid_size'):
+            acc.add('bid_depth', acc.bidsize)
+            acc.add('ask_depth', acc.asksize)
+        if 'last_size' in msg:      # Not in the first message after subscribing, which isn't a trade
+            acc.add('last', float(msg['price']))
+            acc.add('lastsize', float(msg['last_size']))
+            acc.add('lasttime', _parse_time(msg['time']))
+            if self._paper is not None:       # Ticker side is the taker's
+                self._paper.on_trade(msg['product_id'], float(msg['price']), float(msg['last_size']), 'sell' if msg['side'] == 'buy' else 'buy')
+
+    def _snapshot(self, msg):
+        """The whole aggregated book, on subscribing to a 'level2' feed."""
+        book = self._books.get(msg['product_id'])
+        if book is None:
+            book = self._books[msg['product_id']] = Level2Book()
+        book.snapshot(msg['bids'], msg['asks'])
+        self._quote_book(msg['product_id'], book)
+
+    def _l2update(self, msg):
+        """Changed price levels, for 'level2' feeds."""
+        book = self._books.get(msg['product_id'])
+        if book is None:        # Update before snapshot
+            return
+        book.update(msg['changes'])
+        self._quote_book(msg['product_id'], book)
+
+    def _quote_book(self, product, book):
+        """Copy the top and depth of level 2 `book` into `product`'s Ticumulator."""
+        acc = self._ticumulators.get(product)
+        if acc is None:
+            return
+        bid, bidsize, ask, asksize = quote = book.top()
+        if quote == (acc.bid, acc.bidsize, acc.ask, acc.asksize) and self.depth_levels == 1:
+            return
+        self._metric_book_updates.inc(product)
+        for what, value in zip(('bid', 'bidsize', 'ask', 'asksize'), quote):
+            if not math.isnan(value):
+                acc.add(what, value)
+        if self.depth_levels == 1:      # Common case, and as for full feeds: total size at the best price
+            bid_depth, ask_depth = bidsize, asksize
+        else:
+            bid_depth, ask_depth = book.bid_depth(self.depth_levels), book.ask_depth(self.depth_levels)
+        if not math.isnan(bid_depth):
+            acc.add('bid_depth', bid_depth)
+        if not math.isnan(ask_depth):
+            acc.add('ask_depth', ask_depth)
+
+    def _quote_full(self, product, top):
+        """Copy `top`, the (bid, bidsize, bid_depth, ask, asksize, ask_depth) of a 'full' feed's order book, into
+        `product`'s Ticumulator.  Only values that changed are added, so field masks see only those."""
+        acc = self._ticumulators.get(product)
+        if acc is None:
+            return
+        for what, value in zip(FULL_TOP_FIELDS, top):
+            if value != getattr(acc, what):
+                acc.add(what, value)
+
     def _received(self, msg):
         #print("profile_id:",self.profile_id,msg['profile_id'],msg['client_oid'],type(msg['profile_id']),type(self.profile_id))
         if 'profile_id' in msg and msg['profile_id'] == self.profile_id:
-            self.log.info('my order .....%s',msg)
+            self.log.debug('MY ORDER %s', msg)
             if 'client_oid' in msg:
                 oid = msg['client_oid']
             else:
@@ -1171,14 +1927,13 @@ class GBroke:
                 if instrument is None:
                     self.log.error('Open order #%d for unknown instrument %s', msg.orderId,
                                    instrument_tuple_from_contract(msg.contract))
-                    print("return for not instrument...................................")
                     return
                 else:
                     if msg['order_type'] == 'limit':
                         quantity = float(msg['size']) if msg['side'] == 'buy' else -float(msg['size'])
                     else:
                         quantity = 0.0
-                    order = Order(id_=str(msg['order_id']) ,
+                    order = _OrderRecord(id_=str(msg['order_id']) ,
                                   instrument=self._instruments.get(str(msg['product_id'])),
                                   price=float(msg['price']) if msg['order_type'] == 'limit'else 0.0,
                                   quantity = quantity,
@@ -1188,9 +1943,7 @@ class GBroke:
 
             order.id = str(msg['order_id'])
             order.avg_price = 0.0
-            _created_at = ciso8601.parse_datetime(msg['time'])
-            created_at = time.mktime(_created_at.timetuple())
-            order.open_time = created_at / 1000
+            order.open_time = _parse_time(msg['time'])
             self._orders[order.id] = order
             self._call_order_handlers(order)
             #self.reconcile(['position'])
@@ -1202,10 +1955,7 @@ class GBroke:
         pass
     def _match(self, msg):
         #print("_match:",msg)
-        acc = self._ticumulators.get(msg['product_id'])
-        if acc is None:
-            self.log.warning('No Ticumulator found for ticker id %d', msg['tickerId'])
-            return
+        acc = self._ticumulators.get(msg['product_id'])     # None when a shard worker owns the product and only forwards our own fills
         #print(msg) #TODO
         # if msg['side'] == 'buy':
         #     ask = float(msg['price'])
@@ -1219,21 +1969,19 @@ class GBroke:
         #     acc.add('bidsize', bidsize)
         # else:
         #     pass
-        lastprice = float(msg['price'])
-        lastsize  = float(msg['size'])
-        _lasttime  = ciso8601.parse_datetime(msg['time'])
-        lasttime = time.mktime(_lasttime.timetuple())
-        #print(lastprice,lastsize,_lasttime,lasttime)
-        acc.add('last', lastprice)
-        acc.add('lastsize', lastsize)       # Ticumulator likes lastsize to come after last
-        acc.add('lasttime', lasttime / 1000)
+        if acc is not None:
+            lastprice = float(msg['price'])
+            lastsize  = float(msg['size'])
+            acc.add('last', lastprice)
+            acc.add('lastsize', lastsize)       # Ticumulator likes lastsize to come after last
+            acc.add('lasttime', _parse_time(msg['time']))
+        if self._paper is not None:
+            self._paper.on_trade(msg['product_id'], float(msg['price']), float(msg['size']), msg['side'])
 
         ####################################################################################
         if 'profile_id' in msg and msg['profile_id'] == self.profile_id:
-            self.log.debug('my order .....',msg)
+            self.log.debug('MY ORDER %s', msg)
             order = self._orders.get(msg['taker_order_id']) if None != self._orders.get(msg['taker_order_id']) else self._orders.get(msg['maker_order_id']) #TODOOOOOO
-            print(self._orders.get(msg['taker_order_id']),msg['taker_order_id'])
-            print(self._orders.get(msg['maker_order_id']),msg['maker_order_id'])
             if order == None:
                 return
             assert order != None
@@ -1251,13 +1999,10 @@ class GBroke:
                 order.avg_price = (order.filled * order.avg_price + (abs(float(msg['size'])) * float(msg['price']))) /abs(order.filled + abs(float(msg['size'])))
                 order.filled +=  abs(float(msg['size']))
                 if order.filled == abs(order.quantity):
-                    self.log.debug("order.filled,order.quantity:",order.filled,order.quantity)
+                    self.log.debug('FILLED %s of %s', order.filled, order.quantity)
                     order.open = False
                 #order.avg_price = ((abs(order.quantity) - abs(float(msg['size'])) - abs(float(msg['remaining_size']))) * order.avg_price + (abs(float(msg['size'])) * float(msg['price']))) / abs(order.quantity)
-                _created_at = ciso8601.parse_datetime(msg['time'])
-                created_at = time.mktime(_created_at.timetuple())
-                order.fill_time = created_at / 1000
-                print(order.instrument.id,self._positions[order.instrument.id],order.quantity,order.filled,order.avg_price)
+                order.fill_time = _parse_time(msg['time'])
                 self._positions[order.instrument.id] = ( self._positions[order.instrument.id][0] + (abs(order.quantity) - order.filled) ,
                                                          order.avg_price * (abs(order.quantity) - order.filled))
             self._call_order_handlers(order)
@@ -1266,7 +2011,7 @@ class GBroke:
     def _done(self, msg): #sometime msg miss ?
         #print("_done:",msg)
         if 'profile_id' in msg and msg['profile_id'] == self.profile_id:
-            self.log.debug('my order .....',msg)
+            self.log.debug('MY ORDER %s', msg)
             order = self._orders.get(msg['order_id'])
             if order == None:
                 return
@@ -1278,9 +2023,7 @@ class GBroke:
             else:
                 order.cancelled = True if msg['reason'] == 'canceled' else False
                 order.open = False
-                _created_at = ciso8601.parse_datetime(msg['time'])
-                created_at = time.mktime(_created_at.timetuple())
-                order.fill_time = created_at / 1000
+                order.fill_time = _parse_time(msg['time'])
 
                 if order.cancelled == False:
                     self._positions[order.instrument.id] = (
@@ -1539,8 +2282,12 @@ class Ticumulator:
     """
     #: 'what' inputs to `add()`
     INPUT_FIELDS = ('time', 'bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize', 'lasttime', 'volume', 'open_interest', 'bid_depth', 'ask_depth')
+    #: Maps 'what' input to its bit in `changed`
+    FIELD_BITS = {what: 1 << i for i, what in enumerate(INPUT_FIELDS)}
 
-    def __init__(self):
+    def __init__(self, clock: Callable[[], float] = time.time):
+        """:param clock: Returns the current time for `time`; e.g. :meth:`GBroke.exchange_now`."""
+        self._clock = clock
         # Input
         self.time = float('NaN')
         self.bid = float('NaN')
@@ -1562,6 +2309,8 @@ class Ticumulator:
         self.ask_depth = float('Nan')
         self.sum_last = 0.0     # For VWAP
         self.sum_vol = 0.0
+        self.listeners = []     # Functions called as ``func(time, what, value)`` on every add(), e.g. to record raw input
+        self.changed = 0        # FIELD_BITS of inputs added since the owner last cleared it
 
     def add(self, what, value):
         """Update this Ticumulator with an input type ``what`` with the given float ``value``.
@@ -1569,11 +2318,14 @@ class Ticumulator:
         Valid ``what`` values are the :attribute:`INPUT_FIELDS` (except `time`).
         """
         #print(what,value)
-        self.time = time.time()
+        self.time = self._clock()
         if what not in self.INPUT_FIELDS[1:]:
             raise ValueError("Invalid `what` '{}'".format(what))
         if not math.isfinite(value) or value < 0:
             raise ValueError("Invalid value {}".format(value))
+        for listener in self.listeners:
+            listener(self.time, what, value)
+        self.changed |= self.FIELD_BITS[what]
 
         setattr(self, what, value)
         if what == 'last':      # OHLC prices are trade prices
@@ -1588,6 +2340,17 @@ class Ticumulator:
             self.sum_last += self.last * self.lastsize      # self.lastsize == value, having been set above
             self.sum_vol += self.lastsize
 
+    def mirror(self) -> 'Ticumulator':
+        """:Return: a new Ticumulator with this one's current values that gets every input this one gets from now on, but
+        whose bars are its own: e.g. for bars of another size."""
+        twin = Ticumulator(self._clock)
+        for what in ('time', 'bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize', 'lasttime', 'open_interest', 'bid_depth', 'ask_depth'):
+            setattr(twin, what, getattr(self, what))
+        twin.open = twin.close = self.close       # As after bar()
+        twin.high = twin.low = self.last
+        self.listeners.append(lambda _, what, value: twin.add(what, value))
+        return twin
+
     @property
     def vwap(self):
         return (self.sum_last / self.sum_vol) if self.sum_vol else 0.0
@@ -1618,12 +2381,19 @@ class Ticumulator:
 
         .. seealso:: :class:`Bar`
         """
-        return time.time(), self.bid, self.bidsize, self.ask, self.asksize, self.last, self.lastsize, self.lasttime, self.open, self.high, self.low, self.close, self.vwap, self.volume, self.open_interest ,self.bid_depth , self.ask_depth
+        return self._clock(), self.bid, self.bidsize, self.ask, self.asksize, self.last, self.lastsize, self.lasttime, self.open, self.high, self.low, self.close, self.vwap, self.volume, self.open_interest ,self.bid_depth , self.ask_depth
+
+
+#: Maps :class:`Bar` field to the mask of Ticumulator inputs that can change it, for tick view `fields`
+TICK_FIELD_MASKS = dict(Ticumulator.FIELD_BITS, time=sum(Ticumulator.FIELD_BITS.values()),
+                        open=Ticumulator.FIELD_BITS['last'], high=Ticumulator.FIELD_BITS['last'], low=Ticumulator.FIELD_BITS['last'], close=Ticumulator.FIELD_BITS['last'],
+                        vwap=Ticumulator.FIELD_BITS['lastsize'], volume=Ticumulator.FIELD_BITS['lastsize'])
+ALL_FIELDS_MASK = TICK_FIELD_MASKS['time']
 
 
 class RecurringTask(threading.Thread):
     """Calls a function at a sepecified interval."""
-    def __init__(self, func, interval_sec, init_sec=0, *args, **kwargs):
+    def __init__(self, func, interval_sec, init_sec=0, *args, on_jitter=None, **kwargs):
         """Call `func` every `interval_sec` seconds.
 
         Starts the timer. Accounts for the runtime of `func` to make intervals as close to `interval_sec` as possible.
@@ -1632,10 +2402,12 @@ class RecurringTask(threading.Thread):
         :param func func: Function to call
         :param float interval_sec: Call `func` every `interval_sec` seconds
         :param float init_sec: Wait this many seconds initially before the first call
+        :param func on_jitter: If given, called before each call to `func` with how late (in seconds) the call is
         """
         super().__init__(*args, **kwargs)
         assert interval_sec > 0
         self._func = func
+        self._on_jitter = on_jitter
         self.interval_sec = interval_sec
         self.init_sec = init_sec
         self._running = True
@@ -1652,6 +2424,8 @@ class RecurringTask(threading.Thread):
         self._functime = time.time()
         while self._running:
             start = time.time()
+            if self._on_jitter is not None:
+                self._on_jitter(start - self._functime)
             self._func()
             self._functime += self.interval_sec
             if self._functime - start > 0:
@@ -1664,7 +2438,12 @@ class RecurringTask(threading.Thread):
 
 def now() -> datetime:
     """:Return: the current time in UTC, with timezone."""
-    return datetime.utcnow().replace(tzinfo=utc)
+    return datetime.utcnow().replace(tzinfo=pytz.utc)
+
+
+def _parse_time(s: str) -> float:
+    """:Return: ISO 8601 exchange timestamp `s` as Unix seconds."""
+    return ciso8601.parse_datetime(s).timestamp()
 
 
 def make_contract(symbol, sec_type='STK', exchange='GDAX', currency='USD', expiry=None, strike=0.0, opt_type=None):
@@ -1708,7 +2487,7 @@ def obj2dict(obj):
     return {field: val for field, val in vars(obj).items() if val != getattr(default, field, None)}
 
 
-def get_timezone(abbrev: str) -> timezone:
+def get_timezone(abbrev: str) -> tzinfo:
     """:Return: a pytz :class:`timezone` object for a given IB abbreviation."""
     #: Maps timezone abbreviations returned in ContractDetails objects (from Java?) to "standard" tz names
     #: From http://grepcode.com/file/repository.grepcode.com/java/root/jdk/openjdk/8u40-b25/sun/util/calendar/ZoneInfoFile.java/#219
@@ -1739,7 +2518,7 @@ def get_timezone(abbrev: str) -> timezone:
         "SST": "Pacific/Guadalcanal",
         "VST": "Asia/Ho_Chi_Minh",
     }
-    return timezone(TIMEZONE_ABBREVS.get(abbrev, abbrev))
+    return pytz.timezone(TIMEZONE_ABBREVS.get(abbrev, abbrev))
 
 
 def iter_except(func, exception, first=None):
@@ -1758,17 +2537,6 @@ def iter_except(func, exception, first=None):
         pass
 
 
-def create_logger(name, level=logging.WARNING):
-    """:Return: a logger with the given `name` and optional `level`."""
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
-    handler = logging.StreamHandler()
-    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
-    logger.addHandler(handler)
-    logger.propagate = False
-    return logger
-
-
 def pairwise(iterable):
     """s -> (s0,s1), (s1,s2), (s2, s3), ..."""
     a, b = tee(iterable)
@@ -1830,47 +2598,5 @@ def main():
     time.sleep(0.5)
 
 
-class TestIBroke(unittest.TestCase):
-    maxDiff = None
-
-    def test_parse_trading_hours(self) -> None:
-        vecs = (
-            ('20170621:1700-1515,1530-1600;20170622:1700-1515,1530-1600', (
-             (datetime(2017, 6, 21, 17, 00), datetime(2017, 6, 21, 15, 15)),
-             (datetime(2017, 6, 21, 15, 30), datetime(2017, 6, 21, 16, 00)),
-             (datetime(2017, 6, 22, 17, 00), datetime(2017, 6, 22, 15, 15)),
-             (datetime(2017, 6, 22, 15, 30), datetime(2017, 6, 22, 16, 00)),
-            )),
-            ('20090507:0700-1830,1830-2330;20090508:CLOSED', (
-             (datetime(2009, 5, 7, 7, 00), datetime(2009, 5, 7, 18, 30)),
-             (datetime(2009, 5, 7, 18, 30), datetime(2009, 5, 7, 23, 30)),
-            )),
-            ('20170623:1715-1700;20170626:1715-1700', (
-             (datetime(2017, 6, 23, 17, 15), datetime(2017, 6, 23, 17, 00)),
-             (datetime(2017, 6, 26, 17, 15), datetime(2017, 6, 26, 17, 00)),
-            )),
-        )
-        for timestr, dts in vecs:
-            self.assertTupleEqual(tuple(Instrument._parse_trading_hours(timestr)), dts)
-
-    def test_normalize_trading_hours(self) -> None:
-        vecs = (
-            ((
-            (datetime(2017, 6, 21, 17, 00), datetime(2017, 6, 21, 15, 15)),
-            (datetime(2017, 6, 21, 15, 30), datetime(2017, 6, 21, 16, 00)),
-            (datetime(2017, 6, 22, 17, 00), datetime(2017, 6, 22, 15, 15)),
-            (datetime(2017, 6, 22, 15, 30), datetime(2017, 6, 22, 16, 00)),
-            ),
-            (
-            (datetime(2017, 6, 20, 17, 00, tzinfo=utc), datetime(2017, 6, 21, 15, 15, tzinfo=utc)),
-            (datetime(2017, 6, 21, 15, 30, tzinfo=utc), datetime(2017, 6, 21, 16, 00, tzinfo=utc)),
-            (datetime(2017, 6, 21, 17, 00, tzinfo=utc), datetime(2017, 6, 22, 15, 15, tzinfo=utc)),
-            (datetime(2017, 6, 22, 15, 30, tzinfo=utc), datetime(2017, 6, 22, 16, 00, tzinfo=utc)),
-            )),
-        )
-        for indates, outdates in vecs:
-            self.assertTupleEqual(Instrument._normalize_trading_hours(indates, utc), outdates)
-
-
 if __name__ == '__main__':
     main()
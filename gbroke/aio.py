@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio interface to :class:`gbroke.GBroke`.
+
+:class:`AsyncGBroke` has the same surface as the broker, but every handler runs on one event loop, blocking REST calls
+run in a small executor and are awaited, orders can be awaited until they are done, and bars and ticks are available as
+async iterators::
+
+    broker = await AsyncGBroke.connect()
+    async for bar in broker.bars('BTC-USD', bar_size=60):
+        if bar.close > limit:
+            order = await broker.order('BTC-USD', 0.01)
+            order = await broker.wait(order, timeout=30)
+
+The feed itself is still read by the broker's threads; they only hand events to the loop.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Callable, List, Optional
+
+
+class AsyncGBroke:
+    """Runs the handlers of a :class:`gbroke.GBroke` on an asyncio event loop.  Create with :meth:`connect`.
+
+    Handlers passed to :meth:`register` may be plain functions or coroutine functions; either way they are called on
+    the loop, so they never run concurrently with each other or with your other coroutines.
+    """
+    def __init__(self, broker, loop: Optional[asyncio.AbstractEventLoop] = None, workers: int = 4):
+        """Wrap an existing (connected) `broker`, for `loop`: by default the running loop, so then it must be called from
+        a coroutine."""
+        self.broker = broker
+        self._loop = loop or asyncio.get_running_loop()        # Raises RuntimeError if there isn't one
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='AsyncGBroke')
+        self._waiters = dict()      # Maps id() of live order record to list of futures for when it's done
+        broker._order_listeners = broker._order_listeners + [self._on_order_update]      # Copy on write; a broker thread may be iterating it
+
+    @classmethod
+    async def connect(cls, workers: int = 4, **kwargs) -> 'AsyncGBroke':
+        """Connect a new :class:`gbroke.GBroke` created with `kwargs` without blocking the loop, and return it wrapped."""
+        from . import GBroke
+        loop = asyncio.get_running_loop()
+        broker = await loop.run_in_executor(None, partial(GBroke, **kwargs))
+        return cls(broker, loop, workers)
+
+    async def register(self, instrument, on_bar: Callable = None, on_order: Callable = None, on_alert: Callable = None, bar_type: str = 'time', bar_size: float = 1.0, warmup: int = 0, feed: str = 'full'):
+        """As :meth:`gbroke.GBroke.register`, with handlers called on the loop.  :Return: the instrument."""
+        return await self._call(self.broker.register, instrument, *(self._on_loop(func) for func in (on_bar, on_order, on_alert)), bar_type=bar_type, bar_size=bar_size, warmup=warmup, feed=feed)
+
+    async def bars(self, instrument, bar_type: str = 'time', bar_size: float = 1.0, maxsize: int = 1024) -> AsyncIterator:
+        """Async iterator of :class:`gbroke.Bar`\\ s of `instrument`, as would be passed to a `bar_type` handler.
+
+        Up to `maxsize` bars are buffered; if you fall further behind, the oldest are dropped.
+        """
+        queue = asyncio.Queue(maxsize)
+
+        def push(_, bar):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(bar)
+
+        handler = self._on_loop(push)
+        instrument = await self._call(self.broker.register, instrument, handler, bar_type=bar_type, bar_size=bar_size)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self.broker.unregister(instrument, handler, bar_type=bar_type, bar_size=bar_size)
+
+    def ticks(self, instrument, maxsize: int = 1024) -> AsyncIterator:
+        """Async iterator of every tick of `instrument`; see :meth:`bars`."""
+        return self.bars(instrument, 'tick', maxsize=maxsize)
+
+    async def order(self, instrument, quantity: float, limit: float = 0.0, stop: float = 0.0, target: float = 0.0):
+        """Place an order; :Return: the :class:`gbroke.Order` once the exchange accepts it, or None.  See :meth:`wait`."""
+        return await self._call(self.broker.order, self.broker.get_instrument(instrument), quantity, limit=limit, stop=stop, target=target)
+
+    async def order_target(self, instrument, quantity: float, limit: float = 0.0, stop: float = 0.0):
+        """Place orders as necessary to bring position in `instrument` to `quantity`.  :Return: the order, or None."""
+        return await self._call(self.broker.order_target, self.broker.get_instrument(instrument), quantity, limit=limit, stop=stop)
+
+    async def wait(self, order, timeout: Optional[float] = None):
+        """:Return: a snapshot of `order` once it is no longer open (filled or cancelled).
+
+        :raises asyncio.TimeoutError: If that takes more than `timeout` seconds.
+        """
+        live = self.broker._orders.get(order.id)
+        if live is None:
+            raise ValueError('Unknown order {}'.format(order))
+        if not live.open:
+            return live.snapshot()
+        future = self._loop.create_future()
+        self._waiters.setdefault(id(live), []).append(future)
+        if not live.open:       # Closed between the check and the future going in
+            self._resolve(live, live.snapshot())
+        return await asyncio.wait_for(future, timeout)
+
+    async def cancel(self, order) -> None:
+        await self._call(self.broker.cancel, order)
+
+    async def reconcile(self, fields=('profile', 'position', 'orders')) -> None:
+        """Refresh orders and positions from the server."""
+        await self._call(self.broker.reconcile, list(fields))
+
+    def get_positions(self) -> List[tuple]:
+        """:Return: a list of ``(instrument, position, avg_cost)`` for non-zero positions.  Local state, so not a coroutine."""
+        return list(self.broker.get_positions())
+
+    def close(self) -> None:
+        """Stop resolving waits and shut down the executor.  Does not disconnect the broker."""
+        self.broker._order_listeners = [func for func in self.broker._order_listeners if func != self._on_order_update]
+        self._executor.shutdown(wait=False)
+
+    async def _call(self, func, *args, **kwargs):
+        """Run blocking `func` in the executor."""
+        return await self._loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    def _on_loop(self, func):
+        """:Return: a thread safe function that calls `func` (or schedules coroutine function `func`) on the loop; None if `func` is."""
+        if func is None:
+            return None
+        if asyncio.iscoroutinefunction(func):
+            return lambda *args: self._loop.call_soon_threadsafe(lambda: self._loop.create_task(func(*args)))
+        return lambda *args: self._loop.call_soon_threadsafe(func, *args)
+
+    def _on_order_update(self, order):
+        """Order listener, on a broker thread."""
+        if not order.open and id(order) in self._waiters:
+            self._loop.call_soon_threadsafe(self._resolve, order, order.snapshot())
+
+    def _resolve(self, live, snapshot):
+        for future in self._waiters.pop(id(live), ()):
+            if not future.done():
+                future.set_result(snapshot)
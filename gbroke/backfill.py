@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Historical candle backfill through the public REST API, with an on-disk cache.
+
+A request is split into pages of at most :data:`PAGE_CANDLES` candles, which are fetched concurrently but
+no faster than the public rate limit.  Complete UTC days are cached as one columnar ``.npz`` file per
+(product, granularity, day), so repeat requests are served from disk.
+
+Requires NumPy.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Iterator
+
+import numpy as np
+
+from .ratelimit import RateLimiter
+from .tickstore import Time, _epoch
+
+#: Candle sizes (seconds) the exchange supports
+GRANULARITIES = (60, 300, 900, 3600, 21600, 86400)
+#: Maximum candles the exchange returns per request
+PAGE_CANDLES = 200
+#: Public endpoint request rate limit (per second)
+PUBLIC_RATE_LIMIT = 3.0
+#: Candle fields, in the order the exchange sends them
+CANDLE_FIELDS = ('time', 'low', 'high', 'open', 'close', 'volume')
+#: NumPy dtype of candles; `time` is the candle start
+CANDLE_DTYPE = np.dtype([(field, '<f8') for field in CANDLE_FIELDS])
+DAY = 86400
+
+log = logging.getLogger(__name__)
+
+
+class Backfiller:
+    """Fetches and caches historic candles."""
+    def __init__(self, get_rates: Callable, cache_dir: str, workers: int = 4, rate: float = PUBLIC_RATE_LIMIT, retries: int = 5):
+        """
+        :param get_rates: Called like :meth:`gdax.PublicClient.get_product_historic_rates`.
+        :param cache_dir: Directory for cached candles (created if necessary).
+        :param workers: Concurrent page requests.
+        :param rate: Maximum requests per second.
+        :param retries: Attempts per page before giving up.
+        """
+        self._get_rates = get_rates
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.retries = retries
+        self._limiter = RateLimiter(rate)
+
+    def candles(self, product_id: str, start: Time, end: Time, granularity: int = 60) -> np.ndarray:
+        """:Return: a :data:`CANDLE_DTYPE` array of `product_id` candles starting in ``[start, end)``, oldest first.
+
+        Intervals with no trades have no candle.
+        """
+        if granularity not in GRANULARITIES:
+            raise ValueError('granularity must be one of {}'.format(GRANULARITIES))
+        start, end = _epoch(start), _epoch(end)
+        start = math.floor(start / granularity) * granularity
+        parts, missing = [], []
+        complete_before = math.floor((time.time() - granularity) / DAY) * DAY      # Days before this are over and can be cached
+        for day in range(int(start // DAY) * DAY, int(math.ceil(end / DAY)) * DAY, DAY):
+            cached = self._load(product_id, granularity, day) if day + DAY <= complete_before else None
+            if cached is None:
+                missing.append(day)
+            else:
+                parts.append(cached)
+
+        if missing:
+            pages = [(lo, min(lo + PAGE_CANDLES * granularity, day + DAY)) for day in missing
+                     for lo in range(day, day + DAY, PAGE_CANDLES * granularity) if lo < end and lo + PAGE_CANDLES * granularity > start]
+            with ThreadPoolExecutor(self.workers) as pool:
+                fetched = list(pool.map(lambda page: self._fetch_page(product_id, granularity, *page), pages))
+            by_day = {}
+            for (lo, _), page in zip(pages, fetched):
+                by_day.setdefault(lo - lo % DAY, []).append(page)
+            for day, pages in by_day.items():
+                candles = _sort_unique(np.concatenate(pages))
+                if day + DAY <= complete_before and start <= day and day + DAY <= end:       # Only cache days we fetched in full
+                    self._save(product_id, granularity, day, candles)
+                parts.append(candles)
+
+        if not parts:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        candles = _sort_unique(np.concatenate(parts))
+        return candles[(candles['time'] >= start) & (candles['time'] < end)]
+
+    def _fetch_page(self, product_id, granularity, start, end):
+        """:Return: candles for ``[start, end)`` (at most :data:`PAGE_CANDLES`), retrying on errors."""
+        for attempt in range(self.retries):
+            self._limiter.acquire()
+            try:
+                res = self._get_rates(product_id, start=_iso(start), end=_iso(end - granularity), granularity=granularity)
+            except Exception as err:
+                res = {'message': str(err)}
+            if isinstance(res, list):
+                candles = np.array([tuple(row[:len(CANDLE_FIELDS)]) for row in res], dtype=CANDLE_DTYPE) if res else np.empty(0, dtype=CANDLE_DTYPE)
+                return candles[(candles['time'] >= start) & (candles['time'] < end)]
+            log.warning('Candles %s %s-%s attempt %d: %s', product_id, _iso(start), _iso(end), attempt + 1, res)
+            time.sleep(min(2 ** attempt * 0.5, 10))
+        raise RuntimeError('Could not fetch candles for {} {} - {}'.format(product_id, _iso(start), _iso(end)))
+
+    def _path(self, product_id, granularity, day):
+        return os.path.join(self.cache_dir, product_id, str(granularity), '{}.npz'.format(datetime.utcfromtimestamp(day).strftime('%Y%m%d')))
+
+    def _load(self, product_id, granularity, day):
+        path = self._path(product_id, granularity, day)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            candles = np.empty(len(data['time']), dtype=CANDLE_DTYPE)
+            for field in CANDLE_FIELDS:
+                candles[field] = data[field]
+        return candles
+
+    def _save(self, product_id, granularity, day, candles):
+        path = self._path(product_id, granularity, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **{field: candles[field] for field in CANDLE_FIELDS})
+        os.replace(tmp, path)       # Readers never see a half-written file
+
+
+def candles_to_bars(candles: np.ndarray, granularity: int, bar_size: float) -> Iterator[tuple]:
+    """Yield :class:`gbroke.Bar` tuples of `bar_size` seconds made by combining `granularity` second `candles`.
+
+    `bar_size` must be a multiple of `granularity`.  Candles only have trade prices, so quote fields are ``NaN``,
+    `last` is the close, and `vwap` is approximated by the typical price ``(high + low + close) / 3``.
+    Bars with no candles (no trades) repeat the previous close, as live bars do.
+    """
+    per_bar = int(round(bar_size / granularity))
+    if per_bar < 1 or abs(per_bar * granularity - bar_size) > 1e-9:
+        raise ValueError('bar_size {} is not a multiple of granularity {}'.format(bar_size, granularity))
+    nan = float('NaN')
+    close = nan
+    ends = np.floor(candles['time'] / bar_size) * bar_size + bar_size
+    if not len(candles):
+        return
+    for end in np.arange(ends[0], ends[-1] + bar_size / 2, bar_size):
+        group = candles[ends == end]
+        if len(group):
+            volume = float(group['volume'].sum())
+            typical = (group['high'] + group['low'] + group['close']) / 3
+            vwap = float((typical * group['volume']).sum() / volume) if volume else 0.0
+            open_ = close if math.isfinite(close) else float(group['open'][0])
+            high, low = float(group['high'].max()), float(group['low'].min())
+            if math.isfinite(close):
+                high, low = max(high, close), min(low, close)
+            close = float(group['close'][-1])
+        else:
+            open_ = high = low = close
+            volume = vwap = 0.0
+        yield (float(end), nan, nan, nan, nan, close, nan, nan, open_, high, low, close, vwap, volume, 0, nan, nan)
+
+
+def best_granularity(bar_size: float) -> int:
+    """:Return: the largest supported granularity that evenly divides `bar_size`, or raise ValueError."""
+    for granularity in reversed(GRANULARITIES):
+        if bar_size >= granularity and abs(bar_size / granularity - round(bar_size / granularity)) < 1e-9:
+            return granularity
+    raise ValueError('No candle granularity divides bar size {}; the smallest is {} sec'.format(bar_size, GRANULARITIES[0]))
+
+
+def _sort_unique(candles):
+    _, idx = np.unique(candles['time'], return_index=True)
+    return candles[idx]
+
+
+def _iso(t):
+    return datetime.utcfromtimestamp(t).isoformat() + 'Z'
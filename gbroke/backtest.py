@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Backtesting: run a strategy over recorded market data on a virtual clock, as fast as it can go.
+
+A :class:`BacktestBroker` is a :class:`gbroke.GBroke` with nothing connected.  Strategy code uses it exactly as it would
+a live broker (:meth:`~gbroke.GBroke.register` for bar, tick and order handlers, :meth:`~gbroke.GBroke.order`,
+positions, bar history, indicators, stops and brackets); then :meth:`BacktestBroker.run` replays recorded ticks (see
+:mod:`gbroke.recorder`) through the same Ticumulators and handlers the live feed uses.
+
+Time is whatever the data says.  Each record sets the virtual clock before it is added, so tick and bar times are the
+recorded ones, and time bars close on the virtual clock at exact multiples of their size, between records.  Orders
+fill in a :class:`~gbroke.paper.PaperExchange` against the replayed quotes and trades, arriving `latency_sec` of virtual
+time after they are made.  Everything runs on the caller's thread in time order, so a run is deterministic.
+
+Recordings don't mark where one feed message ends and the next begins: records of one product less than
+`tick_gap_sec` apart are taken as one message, and get one round of tick handler calls.  Nor do they say which side of
+a trade was resting: a trade above the mid is taken to lift the offer, and any other to hit the bid.
+
+Quote managers run on their own threads against the real clock, so they don't work in a backtest.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import math
+import os
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+from . import GBroke, LOG_LEVELS, Ticumulator
+from .logs import create_logger
+from .paper import PaperExchange
+from .products import ProductRegistry
+
+#: Records converted from a NumPy array to Python objects at a time
+CHUNK_RECORDS = 65536
+
+
+class VirtualClock:
+    """The backtest's time (Unix seconds), set by the replay.  NaN before the first record."""
+    __slots__ = ('time',)
+
+    def __init__(self, t: float = float('NaN')):
+        self.time = t
+
+    def now(self) -> float:
+        return self.time
+
+
+class BacktestBroker(GBroke):
+    """A :class:`gbroke.GBroke` fed from recordings instead of the exchange, with simulated fills.  See :mod:`gbroke.backtest`."""
+    def __init__(self, balances: Optional[Dict[str, float]] = None, products: Optional[ProductRegistry] = None, latency_sec: float = 0.1,
+                 fee_rate: float = 0.0, tick_gap_sec: float = 0.001, history_size: int = 1024, cache_dir: Optional[str] = None, verbose: int = 3):
+        """
+        :param balances: Starting balances, e.g. ``{'USD': 10000.0}``.
+        :param products: Trading rules for instruments; defaults to those a live broker cached in `cache_dir`, if any.
+          Nothing is fetched.
+        :param latency_sec: Virtual time from making an order or cancel to it reaching the simulated exchange.
+        :param fee_rate: Commission as a fraction of the value filled (e.g. 0.0025).
+        :param tick_gap_sec: Records of one product less than this far apart are one feed message.
+        :param history_size: As for :class:`gbroke.GBroke`.
+        :param cache_dir: As for :class:`gbroke.GBroke`.
+        """
+        self.log = create_logger(__name__, LOG_LEVELS[verbose])
+        self.verbose = verbose
+        self.clock = VirtualClock()                 # exchange_now() is the virtual time
+        self._init_state(0, history_size, cache_dir, 1, threaded=False)     # Triggers send their orders right away, in time order
+        self._watchdog = None
+        self._shards = None
+        if products is None:
+            products = ProductRegistry(_no_products, os.path.join(self.cache_dir, 'products.json'), max_age_sec=math.inf, log=self.log).load()
+        self.products = products
+        self.tick_gap_sec = tick_gap_sec
+        self._sources = []                          # Iterators of (time, product ID, field, value) for the next run()
+        self._events = []                           # Heap of (virtual time, seq, function, args) due, e.g. bar closes and order arrivals
+        self._seq = itertools.count()
+        self._unarmed = []                          # (bar_size, instrument ID) of time bars registered before there was a time
+        self._paper = PaperExchange(self, latency_sec, fee_rate, clock=self.exchange_now, scheduler=self)
+        self._positions.update((currency, (float(balance), 0.0)) for currency, balance in (balances or {}).items())
+        self.user_id = self.profile_id = None
+        self.connected = True
+
+    def replay(self, instrument, records: Iterable[Sequence[float]]) -> None:
+        """Add ticks for `instrument` to the next :meth:`run`.
+
+        :param records: ``(time, field, value)`` records in time order, where `field` indexes
+          :attr:`gbroke.Ticumulator.INPUT_FIELDS`: e.g. an array from :meth:`gbroke.tickstore.TickStore.range` or
+          :func:`gbroke.recorder.read_records`.
+        """
+        instrument = self.get_instrument(instrument)
+        self._subscribe(instrument)
+        self._sources.append(_records(instrument.id, records))
+
+    def replay_recordings(self, instrument, directory: str, start=None, end=None) -> None:
+        """Add the ticks for `instrument` recorded in `directory` (see :meth:`gbroke.GBroke.record`) from `start` to
+        `end` to the next :meth:`run`.  Requires NumPy."""
+        from .tickstore import TickStore
+        instrument = self.get_instrument(instrument)
+        self.replay(instrument, TickStore(directory, instrument.id).range(start, end))
+
+    def run(self, end: Optional[float] = None) -> int:
+        """Replay the ticks added by :meth:`replay`, merged in time order, calling handlers as the live feed would; then
+        anything else due (bar closes, order arrivals) up to `end`, by default the last tick.
+
+        :Return: the number of records replayed.
+        """
+        sources, self._sources = self._sources, []
+        clock, events, paper, ticumulators = self.clock, self._events, self._paper, self._ticumulators
+        fields, gap = Ticumulator.INPUT_FIELDS, self.tick_gap_sec
+        started, first = time.time(), None
+        pending, pending_time = None, 0.0       # Product whose message is in progress, and the time of its last record
+        count = 0
+        for t, product, field, value in heapq.merge(*sources):
+            if pending is not None and (product != pending or t - pending_time >= gap or (events and events[0][0] <= t)):
+                self._call_tick_handlers(pending)
+                pending = None
+            if first is None:
+                first = t
+                self._arm_bars(t)
+            if events and events[0][0] <= t:
+                self._run_events(t)
+            clock.time = t
+            acc = ticumulators[product]
+            what = fields[field]
+            acc.add(what, value)
+            if what == 'lastsize':
+                paper.on_trade(product, acc.last, value, 'sell' if acc.last > (acc.bid + acc.ask) / 2 else 'buy')
+            pending, pending_time = product, t
+            count += 1
+        if pending is not None:
+            self._call_tick_handlers(pending)
+        end = clock.time if end is None else end
+        if end == end:
+            self._arm_bars(end)
+            self._run_events(end)
+            clock.time = end
+        if first is not None:
+            self.log.info('BACKTEST %d records, %.0f sec in %.2f sec', count, clock.time - first, time.time() - started)
+        return count
+
+    def after(self, delay_sec: float, func: Callable, *args) -> None:
+        """Call ``func(*args)`` `delay_sec` of virtual time from now, during :meth:`run`.  Before the first record there
+        is no time yet, so it is called right away."""
+        when = self.clock.time + delay_sec
+        if when != when:
+            func(*args)
+        else:
+            heapq.heappush(self._events, (when, next(self._seq), func, args))
+
+    def _subscribe(self, instrument, feed='full'):
+        """Start accumulating `instrument`'s ticks, which come from :meth:`replay`."""
+        if instrument.id not in self._ticumulators:
+            self._ticumulators[instrument.id] = Ticumulator(clock=self.exchange_now)
+
+    def _schedule_bars(self, bar_size, instrument):
+        """Close `instrument`'s `bar_size` bars on the virtual clock, at multiples of `bar_size`."""
+        self._unarmed.append((bar_size, instrument.id))
+        if self.clock.time == self.clock.time:
+            self._arm_bars(self.clock.time)
+
+    def _arm_bars(self, t):
+        """Schedule the first close of bars registered before virtual time `t`: the next multiple of their size."""
+        for bar_size, product in self._unarmed:
+            heapq.heappush(self._events, ((math.floor(t / bar_size) + 1) * bar_size, next(self._seq), self._close_bar, (bar_size, product)))
+        self._unarmed = []
+
+    def _close_bar(self, bar_size, product):
+        self._call_bar_handlers('time', bar_size, product)
+        self.after(bar_size, self._close_bar, bar_size, product)
+
+    def _run_events(self, until):
+        """Run the events due at or before virtual time `until`, in order, with the clock at each one's time."""
+        events, clock = self._events, self.clock
+        while events and events[0][0] <= until:
+            when, _, func, args = heapq.heappop(events)
+            clock.time = when
+            func(*args)
+
+    def _warmup(self, instrument, bar_size, n):
+        self.log.warning('No warmup for %s in a backtest; history starts with the replay', instrument)
+
+
+def _no_products():
+    raise RuntimeError('Backtests do not fetch products')
+
+
+def _records(product, records) -> Iterator:
+    """Yield ``(time, product, field, value)`` for each of `records`, converting NumPy arrays a chunk at a time."""
+    if hasattr(records, 'tolist'):
+        for start in range(0, len(records), CHUNK_RECORDS):
+            for t, field, value in records[start:start + CHUNK_RECORDS].tolist():
+                yield t, product, field, value
+    else:
+        for t, field, value in records:
+            yield t, product, field, value
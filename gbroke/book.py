@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Aggregated (level 2) order book, built from the exchange's ``level2`` channel.
+
+The channel sends a ``snapshot`` of every price level on subscribe, then ``l2update`` messages giving the new total
+size at changed levels (0 removes the level).  That is all we need for top of book and depth, at a fraction of the
+traffic and memory of the full per-order (level 3) book.
+
+Each side is a dict of price to size plus a sorted list of its prices, stored so the best price is last.  A size
+change at an existing level only touches the dict; adding or removing a level is a binary search and a list insert
+or delete, which only moves the levels between it and the touch, where most activity is.  There is no tree to
+rebalance, however far from the touch the update is, and the top of book is an index lookup.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from bisect import bisect_left
+from itertools import islice
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+NAN = float('NaN')
+
+
+class _Side:
+    """Price levels of one side.  `keys` are prices (bids) or negated prices (asks), ascending, so the best is last."""
+    __slots__ = ('sizes', 'keys', 'sign')
+
+    def __init__(self, sign):
+        self.sizes = dict()     # Maps price to total size
+        self.keys = []
+        self.sign = sign
+
+    def load(self, levels):
+        sizes = self.sizes = dict()
+        for price, size in levels:
+            if float(size):
+                sizes[float(price)] = float(size)
+        self.keys = sorted(self.sign * price for price in sizes)
+
+    def set(self, price, size):
+        sizes = self.sizes
+        if size:
+            if price not in sizes:
+                keys = self.keys
+                key = self.sign * price
+                keys.insert(bisect_left(keys, key), key)
+            sizes[price] = size
+        elif sizes.pop(price, None) is not None:
+            keys = self.keys
+            del keys[bisect_left(keys, self.sign * price)]
+
+    def levels(self, n):
+        sign, sizes = self.sign, self.sizes
+        return [(sign * key, sizes[sign * key]) for key in islice(reversed(self.keys), n)]
+
+    def depth(self, n):
+        sign, sizes = self.sign, self.sizes
+        if n is None or n >= len(self.keys):
+            return sum(sizes.values())
+        return sum(sizes[sign * key] for key in islice(reversed(self.keys), n))
+
+
+class Level2Book:
+    """Total size at each price, per side.  Prices and sizes are floats; the exchange's strings are converted.
+
+    Not thread safe: the feed thread updates it, so read it from tick or bar handlers (on that thread) only.
+    """
+    def __init__(self):
+        self._bids = _Side(1.0)
+        self._asks = _Side(-1.0)
+
+    @property
+    def bids(self) -> dict:
+        """Maps bid price to size.  Don't modify it."""
+        return self._bids.sizes
+
+    @property
+    def asks(self) -> dict:
+        """Maps ask price to size.  Don't modify it."""
+        return self._asks.sizes
+
+    def snapshot(self, bids: Iterable[Sequence], asks: Iterable[Sequence]) -> None:
+        """Replace the book with `bids` and `asks`, each a list of ``[price, size]``."""
+        self._bids.load(bids)
+        self._asks.load(asks)
+
+    def update(self, changes: Iterable[Sequence]) -> None:
+        """Apply ``[side, price, size]`` `changes`, where `side` is ``'buy'`` or ``'sell'`` and `size` is the new total."""
+        for side, price, size in changes:
+            (self._bids if side == 'buy' else self._asks).set(float(price), float(size))
+
+    @property
+    def bid(self) -> float:
+        """Best bid price; NaN if there are no bids."""
+        keys = self._bids.keys
+        return keys[-1] if keys else NAN
+
+    @property
+    def ask(self) -> float:
+        """Best ask price; NaN if there are no asks."""
+        keys = self._asks.keys
+        return -keys[-1] if keys else NAN
+
+    @property
+    def bidsize(self) -> float:
+        keys = self._bids.keys
+        return self._bids.sizes[keys[-1]] if keys else NAN
+
+    @property
+    def asksize(self) -> float:
+        keys = self._asks.keys
+        return self._asks.sizes[-keys[-1]] if keys else NAN
+
+    def top(self) -> Tuple[float, float, float, float]:
+        """:Return: ``(bid, bidsize, ask, asksize)``, NaN for an empty side."""
+        bids, asks = self._bids, self._asks
+        bid = bids.keys[-1] if bids.keys else NAN
+        ask = -asks.keys[-1] if asks.keys else NAN
+        return bid, bids.sizes.get(bid, NAN), ask, asks.sizes.get(ask, NAN)
+
+    def bid_levels(self, n: int = 10) -> List[Tuple[float, float]]:
+        """:Return: up to `n` best ``(price, size)`` bid levels, best first."""
+        return self._bids.levels(n)
+
+    def ask_levels(self, n: int = 10) -> List[Tuple[float, float]]:
+        """:Return: up to `n` best ``(price, size)`` ask levels, best first."""
+        return self._asks.levels(n)
+
+    def bid_depth(self, n: Optional[int] = None) -> float:
+        """:Return: total bid size over the best `n` levels (all if None)."""
+        return self._bids.depth(n)
+
+    def ask_depth(self, n: Optional[int] = None) -> float:
+        """:Return: total ask size over the best `n` levels (all if None)."""
+        return self._asks.depth(n)
+
+    def __len__(self):
+        """Number of price levels on both sides."""
+        return len(self._bids.keys) + len(self._asks.keys)
@@ -0,0 +1,407 @@
+# -*- coding: utf-8 -*-
+"""
+Compressed, chunked, columnar storage for recorded ticks.
+
+Ticks (the ``(time, field, value)`` records of :mod:`gbroke.recorder`) are written in chunks of up to
+:data:`DEFAULT_CHUNK_RECORDS` records.  Within a chunk each column is stored separately:
+
+time
+    Integer microseconds, delta-encoded from the previous record.
+field
+    One byte per record.
+value
+    Integer multiples of the power of ten with as many decimal places as the product's tick size (prices) or size
+    increment (sizes), or of microseconds (times), delta-encoded from the previous value of the same field.  If any
+    value in a chunk is not an exact multiple the chunk falls back to raw doubles, so values always round-trip exactly.
+
+Deltas are zigzag-encoded, narrowed to the smallest unsigned integer type that holds them, and compressed with the
+fastest available codec (zstd or lz4 if installed, otherwise zlib).  Every chunk starts with its own header and
+decompresses independently, and a footer indexes chunk offsets and time ranges, so readers can seek to a time, stream
+chunks, or decompress many in parallel.  If the writer died before writing the footer, the reader rebuilds the index by
+walking the chunk headers.
+
+Requires NumPy.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from . import Ticumulator
+from .pretrade import places
+from .recorder import DTYPES, FIELD_IDS, KIND_NAMES, KIND_TICKS
+from .tickstore import Time, _epoch, resample_ticks
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+#: Records per chunk
+DEFAULT_CHUNK_RECORDS = 65536
+#: File header: magic, version, kind, tick size, size increment
+FILE_HEADER = struct.Struct('<4sHHdd')
+FILE_MAGIC = b'GBCF'
+VERSION = 1
+#: Chunk header: magic, record count, codec, flags, time dtype, value dtype, first time, last time,
+#: first time (usec), compressed lengths of the time, field and value columns
+CHUNK_HEADER = struct.Struct('<4sIBBBBddqIII')
+CHUNK_MAGIC = b'GBCK'
+#: Footer entry per chunk: offset, record count, first time, last time
+FOOTER_ENTRY = struct.Struct('<QIdd')
+#: Footer trailer: number of chunks, magic
+FOOTER_TRAILER = struct.Struct('<I4s')
+FOOTER_MAGIC = b'GBCE'
+#: Chunk flag: values are raw doubles rather than scaled integer deltas
+FLAG_RAW_VALUES = 1
+
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD, CODEC_LZ4 = range(4)
+#: Maps column dtype codes in chunk headers to dtypes
+COLUMN_DTYPES = {1: np.dtype('<u1'), 2: np.dtype('<u2'), 4: np.dtype('<u4'), 8: np.dtype('<u8'), 0: np.dtype('<f8')}
+#: Inputs stored as multiples of the tick size
+PRICE_FIELDS = ('bid', 'ask', 'last')
+#: Inputs stored as multiples of one microsecond
+TIME_FIELDS = ('lasttime',)
+
+ChunkInfo = namedtuple('ChunkInfo', 'offset count first_time last_time')
+
+
+def default_codec() -> int:
+    """:Return: the fastest codec available: zstd, lz4, then zlib."""
+    if zstandard is not None:
+        return CODEC_ZSTD
+    elif lz4 is not None:
+        return CODEC_LZ4
+    return CODEC_ZLIB
+
+
+def _compress(codec, data):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 1)
+    elif codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=1).compress(data)
+    elif codec == CODEC_LZ4:
+        return lz4.frame.compress(data)
+    return bytes(data)
+
+
+def _decompress(codec, data):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    elif codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError('Chunk compressed with zstd; install zstandard to read it')
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif codec == CODEC_LZ4:
+        if lz4 is None:
+            raise ImportError('Chunk compressed with lz4; install lz4 to read it')
+        return lz4.frame.decompress(data)
+    return bytes(data)
+
+
+def _zigzag(deltas):
+    """:Return: signed int64 `deltas` zigzag-encoded and narrowed to the smallest unsigned type that fits, and its dtype code."""
+    encoded = ((deltas << 1) ^ (deltas >> 63)).view('<u8')
+    top = int(encoded.max()) if len(encoded) else 0
+    for code in (1, 2, 4, 8):
+        if top < 2 ** (8 * code):
+            return encoded.astype(COLUMN_DTYPES[code]), code
+
+
+def _unzigzag(encoded):
+    encoded = encoded.astype('<u8')
+    return ((encoded >> 1).view('<i8') ^ -(encoded & 1).view('<i8'))
+
+
+def _field_scales(tick_size, size_increment):
+    """:Return: an array of the divisor used to scale each input field's values to integers, indexed by field id.
+
+    Prices and sizes are scaled by a power of ten covering the increment's decimal places, so any multiple of it
+    (including of an increment of 1 or more, or one like 0.05) is an integer.
+    """
+    scales = np.full(len(Ticumulator.INPUT_FIELDS), 10.0 ** places(size_increment))
+    for what in PRICE_FIELDS:
+        scales[FIELD_IDS[what]] = 10.0 ** places(tick_size)
+    for what in TIME_FIELDS:
+        scales[FIELD_IDS[what]] = 1e6
+    return scales
+
+
+def _per_field(func, fields, values):
+    """Apply `func` to the subsequence of `values` for each distinct field in `fields`, in place."""
+    for field in np.unique(fields):
+        mask = fields == field
+        values[mask] = func(values[mask])
+
+
+def encode_chunk(records: np.ndarray, codec: int, scales: np.ndarray) -> bytes:
+    """:Return: a self-contained compressed chunk holding the ticks `records` (``time, field, value``)."""
+    times_us = np.round(records['time'] * 1e6).astype('<i8')
+    time_col, time_code = _zigzag(np.diff(times_us, prepend=times_us[:1]))
+    fields = records['field'].astype('<u1')
+    values = records['value']
+    flags = 0
+    divisor = scales[fields]
+    scaled = np.round(values * divisor)
+    if np.all(np.isfinite(scaled)) and np.all(np.abs(scaled) < 2**53) and np.array_equal(scaled / divisor, values):
+        deltas = scaled.astype('<i8')
+        _per_field(lambda v: np.diff(v, prepend=0), fields, deltas)
+        value_col, value_code = _zigzag(deltas)
+    else:
+        flags |= FLAG_RAW_VALUES
+        value_col, value_code = np.ascontiguousarray(values, dtype='<f8'), 0
+    blobs = [_compress(codec, col.tobytes()) for col in (time_col, fields, value_col)]
+    header = CHUNK_HEADER.pack(CHUNK_MAGIC, len(records), codec, flags, time_code, value_code,
+                               records['time'][0], records['time'][-1], int(times_us[0]), *map(len, blobs))
+    return header + b''.join(blobs)
+
+
+def decode_chunk(buf, offset: int, scales: np.ndarray) -> np.ndarray:
+    """:Return: the ticks records in the chunk starting at `offset` in `buf`."""
+    magic, count, codec, flags, time_code, value_code, _, _, t0_us, *lengths = CHUNK_HEADER.unpack_from(buf, offset)
+    if magic != CHUNK_MAGIC:
+        raise ValueError('Bad chunk magic at offset {}'.format(offset))
+    pos = offset + CHUNK_HEADER.size
+    cols = []
+    for length, dtype in zip(lengths, (COLUMN_DTYPES[time_code], np.dtype('<u1'), COLUMN_DTYPES[value_code])):
+        cols.append(np.frombuffer(_decompress(codec, buf[pos:pos + length]), dtype=dtype, count=count))
+        pos += length
+    time_col, fields, value_col = cols
+    records = np.empty(count, dtype=DTYPES[KIND_TICKS])
+    records['time'] = (t0_us + np.cumsum(_unzigzag(time_col))) / 1e6
+    records['field'] = fields
+    if flags & FLAG_RAW_VALUES:
+        records['value'] = value_col
+    else:
+        scaled = _unzigzag(value_col)
+        _per_field(np.cumsum, fields, scaled)
+        records['value'] = scaled / scales[fields]
+    return records
+
+
+class ChunkWriter:
+    """Writes ticks to a compressed chunk file.
+
+    :meth:`append` only adds to in-memory buffers; full chunks are encoded, compressed and written by a background thread.
+    Times are stored to the microsecond.
+    """
+    def __init__(self, path: str, tick_size: float, size_increment: float = 1e-8, chunk_records: int = DEFAULT_CHUNK_RECORDS, codec: Optional[int] = None):
+        """
+        :param path: File to create.
+        :param tick_size: The product's price increment (``quote_increment``).
+        :param size_increment: The product's size increment; sizes and depths are stored as multiples of it.
+        :param chunk_records: Records per chunk.
+        :param codec: One of the ``CODEC_*`` constants; default is :func:`default_codec`.
+        """
+        self.path = path
+        self.tick_size = tick_size
+        self.size_increment = size_increment
+        self.chunk_records = chunk_records
+        self.codec = default_codec() if codec is None else codec
+        self.closed = False
+        self.chunks = []                # ChunkInfo for each chunk written
+        self._scales = _field_scales(tick_size, size_increment)
+        self._file = open(path, 'xb')
+        self._file.write(FILE_HEADER.pack(FILE_MAGIC, VERSION, KIND_TICKS, tick_size, size_increment))
+        self._new_buffers()
+        self._queue = Queue()
+        self._writer = threading.Thread(target=self._write_chunks, name='gbroke-chunkwriter', daemon=True)
+        self._writer.start()
+
+    def _new_buffers(self):
+        self._times, self._fields, self._values = array('d'), array('q'), array('d')
+
+    def append(self, time: float, field: int, value: float) -> None:
+        """Append a tick with the given `time`, `field` id and `value`."""
+        self._times.append(time)
+        self._fields.append(field)
+        self._values.append(value)
+        if len(self._times) >= self.chunk_records:
+            self.flush()
+
+    def flush(self) -> None:
+        """Hand any buffered ticks to the background thread to be written as a chunk."""
+        if self._times:
+            self._queue.put((self._times, self._fields, self._values))
+            self._new_buffers()
+
+    def close(self) -> None:
+        """Write any buffered ticks and the footer, and close the file."""
+        if self.closed:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._writer.join()
+        for info in self.chunks:
+            self._file.write(FOOTER_ENTRY.pack(*info))
+        self._file.write(FOOTER_TRAILER.pack(len(self.chunks), FOOTER_MAGIC))
+        self._file.close()
+        self.closed = True
+
+    def _write_chunks(self):
+        for item in iter(self._queue.get, None):
+            records = np.empty(len(item[0]), dtype=DTYPES[KIND_TICKS])
+            for name, buf in zip(('time', 'field', 'value'), item):
+                records[name] = np.frombuffer(buf, dtype=records.dtype[name])
+            chunk = encode_chunk(records, self.codec, self._scales)
+            self.chunks.append(ChunkInfo(self._file.tell(), len(records), records['time'][0], records['time'][-1]))
+            self._file.write(chunk)
+
+
+class CompressedTickRecorder(ChunkWriter):
+    """Like :class:`~gbroke.recorder.TickRecorder`, but writes a compressed chunk file ``name.ticks.first_time_usec.gbc``.
+
+    Add it to :attr:`Ticumulator.listeners`.
+    """
+    def __init__(self, directory, name, tick_size=0.01, **kwargs):
+        os.makedirs(directory, exist_ok=True)
+        self.path_prefix = os.path.join(directory, '{}.{}.'.format(name, KIND_NAMES[KIND_TICKS]))
+        self._directory, self._kwargs = directory, kwargs
+        self._tick_size = tick_size
+        self.closed = False
+        self.on_close = None        #: Called at the start of close(), e.g. to stop whatever feeds this recorder
+        self._started = False
+
+    def __call__(self, time, what, value):
+        if self.closed:
+            return
+        if not self._started:       # Name the file after the first record, like the uncompressed recorders
+            super().__init__('{}{:017d}.gbc'.format(self.path_prefix, int(time * 1e6)), self._tick_size, **self._kwargs)
+            self._started = True
+        self.append(time, FIELD_IDS[what], value)
+
+    def close(self):
+        if self.on_close is not None:
+            self.on_close()
+        if self._started:
+            super().close()
+        self.closed = True
+
+
+class ChunkReader:
+    """Random access to the chunks of a compressed chunk file."""
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._buf = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.kind, self.tick_size, self.size_increment = FILE_HEADER.unpack_from(self._buf, 0)
+        if magic != FILE_MAGIC:
+            raise ValueError('{} is not a GBroke chunk file'.format(path))
+        if version != VERSION:
+            raise ValueError('Unsupported chunk file version {} in {}'.format(version, path))
+        self._scales = _field_scales(self.tick_size, self.size_increment)
+        self.chunks = self._read_footer() or self._scan_chunks()
+        self._first_times = np.array([info.first_time for info in self.chunks])
+
+    def _read_footer(self):
+        size = len(self._buf)
+        if size < FILE_HEADER.size + FOOTER_TRAILER.size:
+            return None
+        count, magic = FOOTER_TRAILER.unpack_from(self._buf, size - FOOTER_TRAILER.size)
+        if magic != FOOTER_MAGIC:
+            return None
+        start = size - FOOTER_TRAILER.size - count * FOOTER_ENTRY.size
+        return [ChunkInfo._make(FOOTER_ENTRY.unpack_from(self._buf, start + i * FOOTER_ENTRY.size)) for i in range(count)]
+
+    def _scan_chunks(self):
+        """Rebuild the chunk index from chunk headers, for files whose writer did not close them."""
+        chunks, offset = [], FILE_HEADER.size
+        while offset + CHUNK_HEADER.size <= len(self._buf):
+            magic, count, _, _, _, _, first, last, _, *lengths = CHUNK_HEADER.unpack_from(self._buf, offset)
+            end = offset + CHUNK_HEADER.size + sum(lengths)
+            if magic != CHUNK_MAGIC or end > len(self._buf):        # Stop at a torn final chunk
+                break
+            chunks.append(ChunkInfo(offset, count, first, last))
+            offset = end
+        return chunks
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def read_chunk(self, i: int) -> np.ndarray:
+        """:Return: the ticks records of chunk `i`."""
+        return decode_chunk(self._buf, self.chunks[i].offset, self._scales)
+
+    def chunk_range(self, start: Optional[Time] = None, end: Optional[Time] = None) -> range:
+        """:Return: the indexes of chunks that may contain ticks with ``start <= time < end``."""
+        lo = 0 if start is None else max(int(np.searchsorted(self._first_times, _epoch(start), 'right')) - 1, 0)
+        hi = len(self.chunks) if end is None else int(np.searchsorted(self._first_times, _epoch(end), 'left'))
+        return range(lo, max(lo, hi))
+
+    def iter_chunks(self, start: Optional[Time] = None, end: Optional[Time] = None) -> Iterator[np.ndarray]:
+        """Yield the records of each chunk overlapping ``[start, end)`` in turn, trimmed to that range."""
+        lo = -math.inf if start is None else _epoch(start)
+        hi = math.inf if end is None else _epoch(end)
+        for i in self.chunk_range(start, end):
+            yield _trim(self.read_chunk(i), lo, hi)
+
+    def range(self, start: Optional[Time] = None, end: Optional[Time] = None, workers: int = 1) -> np.ndarray:
+        """:Return: the records with ``start <= time < end``, decompressing chunks with `workers` threads."""
+        lo = -math.inf if start is None else _epoch(start)
+        hi = math.inf if end is None else _epoch(end)
+        indexes = self.chunk_range(start, end)
+        if workers > 1 and len(indexes) > 1:
+            with ThreadPoolExecutor(workers) as pool:       # zlib, zstd and lz4 release the GIL
+                parts = list(pool.map(self.read_chunk, indexes))
+        else:
+            parts = [self.read_chunk(i) for i in indexes]
+        if not parts:
+            return np.empty(0, dtype=DTYPES[KIND_TICKS])
+        return _trim(np.concatenate(parts), lo, hi)
+
+    def resample(self, bar_size: float, start: Time, end: Time, workers: int = 1) -> np.ndarray:
+        """:Return: bars as :meth:`gbroke.tickstore.TickStore.resample` does, from the ticks in this file."""
+        start, end = _epoch(start), _epoch(end)
+        ends = np.arange(math.floor(start / bar_size) + 1, math.floor(end / bar_size) + 1) * bar_size
+        return resample_ticks(self.range(start, ends[-1] if len(ends) else start, workers), ends)
+
+    def close(self):
+        self._buf.close()
+
+
+def _trim(records, lo, hi):
+    times = records['time']
+    return records[np.searchsorted(times, lo, 'left'):np.searchsorted(times, hi, 'left')]
+
+
+def archive(recordings: Iterable[np.ndarray], path: str, tick_size: float, **kwargs) -> None:
+    """Write the ticks arrays `recordings` (e.g. from :func:`gbroke.recorder.iter_records`) to a new compressed chunk file at `path`.
+
+    `kwargs` are passed to :class:`ChunkWriter`.
+    """
+    writer = ChunkWriter(path, tick_size, **kwargs)
+    try:
+        for records in recordings:
+            for time, field, value in records.tolist():
+                writer.append(time, field, value)
+    finally:
+        writer.close()
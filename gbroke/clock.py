@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Estimate the offset between the local clock and the exchange's, without touching the system clock.
+
+Two kinds of samples go in:
+
+* REST server time, bracketed by local send / receive times.  The server read its clock somewhere in between, so
+  ``server - midpoint`` estimates the offset to within half the round trip.
+* Feed message timestamps against local receive time.  Messages can't arrive before they were sent, so
+  ``exchange_time - received`` is a lower bound on the offset (it is the offset minus the one-way latency).
+
+REST samples are blended into a smoothed offset and drift, weighting quick round trips most; the best feed bound
+over the last `window_sec` keeps the estimate from falling below what the feed proves.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+#: Drift estimates are clamped to this (sec / sec); ordinary crystals are within 1e-4
+MAX_DRIFT = 1e-3
+
+
+class ClockSync:
+    """Smoothed exchange clock offset and drift.  :meth:`add_feed` is cheap enough to call for every message."""
+    def __init__(self, alpha: float = 0.2, window_sec: float = 60.0):
+        """
+        :param alpha: Weight of a REST sample with the best round trip seen so far; slower ones count for less.
+        :param window_sec: How long a feed lower bound stays in force.
+        """
+        self.alpha = alpha
+        self.window_sec = window_sec
+        self.offset = float('NaN')      #: Exchange minus local time (sec) at :attr:`ref_time`, from REST samples
+        self.drift = 0.0                #: Rate of change of the offset (sec / sec)
+        self.ref_time = float('NaN')    #: Local time of the last REST sample
+        self.best_rtt = float('inf')    #: Quickest REST round trip seen
+        self.rest_samples = 0
+        self._bounds = deque()          # (received, bound) with bounds decreasing: the front is the window's max
+        self._lock = threading.Lock()   # Each product's feed thread adds bounds
+
+    def add_rest(self, server_time: float, sent: float, received: float) -> None:
+        """Add a server time read by a REST request sent and answered at local times `sent` and `received`."""
+        rtt = max(received - sent, 1e-6)
+        mid = (sent + received) / 2
+        sample = server_time - mid
+        self.best_rtt = min(self.best_rtt, rtt)
+        if not self.rest_samples:
+            self.offset, self.ref_time = sample, mid
+        else:
+            weight = self.alpha * self.best_rtt / rtt
+            predicted = self.offset + self.drift * (mid - self.ref_time)
+            error = sample - predicted
+            elapsed = mid - self.ref_time
+            if elapsed > 0 and self.rest_samples > 1:
+                self.drift = min(max(self.drift + weight * error / elapsed, -MAX_DRIFT), MAX_DRIFT)
+            self.offset, self.ref_time = predicted + weight * error, mid
+        self.rest_samples += 1
+
+    def add_feed(self, exchange_time: float, received: float) -> None:
+        """Add a feed message stamped `exchange_time` by the exchange and received at local time `received`."""
+        bound = exchange_time - received
+        bounds = self._bounds
+        with self._lock:
+            while bounds and bounds[-1][1] <= bound:
+                bounds.pop()
+            bounds.append((received, bound))
+            while bounds[0][0] < received - self.window_sec:
+                bounds.popleft()
+
+    def offset_at(self, t: Optional[float] = None) -> float:
+        """:Return: the estimated exchange minus local clock offset (sec) at local time `t` (default now); 0 if no samples yet."""
+        t = time.time() if t is None else t
+        estimate = self.offset + self.drift * (t - self.ref_time) if self.rest_samples else float('NaN')
+        try:
+            received, bound = self._bounds[0]       # No lock: a stale bound is fine, and the deque never shrinks to empty
+        except IndexError:
+            received, bound = t, float('NaN')
+        if received < t - self.window_sec:
+            bound = float('NaN')
+        if math.isnan(estimate):
+            return 0.0 if math.isnan(bound) else bound
+        return estimate if math.isnan(bound) else max(estimate, bound)
+
+    def now(self) -> float:
+        """:Return: the estimated exchange time (Unix seconds)."""
+        t = time.time()
+        return t + self.offset_at(t)
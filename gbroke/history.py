@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Fixed-capacity bar history stored as struct-of-arrays, with zero-copy NumPy views of the most recent bars.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import namedtuple
+from typing import Iterable, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#: Bar field names, duplicated from :class:`gbroke.Bar` so this module does not import the broker.
+BAR_FIELDS = ('time', 'bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize', 'lasttime', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'open_interest', 'bid_depth', 'ask_depth')
+
+Bars = namedtuple('Bars', BAR_FIELDS)
+Bars.__doc__ = """A :class:`gbroke.Bar` with a read-only NumPy array of values for each field, oldest first."""
+
+
+def available() -> bool:
+    """:Return: True iff NumPy is installed, so bar history can be kept."""
+    return np is not None
+
+
+class BarHistory:
+    """Ring buffer of the last `capacity` bars.
+
+    Every bar is written twice, at ``i`` and ``i + capacity`` of a ``2 * capacity`` buffer, so the most recent
+    ``n <= capacity`` bars are always contiguous and :meth:`get` can return views instead of copies.
+    The views are only valid until `capacity` more bars have been appended; copy them if you need to keep them longer.
+    """
+    def __init__(self, capacity: int):
+        if np is None:
+            raise ImportError('BarHistory requires numpy')
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self._data = np.full((len(BAR_FIELDS), 2 * capacity), float('NaN'))
+        self._count = 0         # Total bars ever appended
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, bar: Iterable[float]) -> None:
+        """Add a :class:`gbroke.Bar` (or any sequence of values in :data:`BAR_FIELDS` order), overwriting the oldest if full."""
+        i = self._count % self.capacity
+        self._data[:, i] = self._data[:, i + self.capacity] = bar
+        self._count += 1
+
+    def get(self, n: Optional[int] = None) -> Bars:
+        """:Return: :class:`Bars` of read-only views of the last `n` bars (or all bars held, if `n` is None or larger)."""
+        n = len(self) if n is None else min(n, len(self))
+        end = self._count % self.capacity + self.capacity
+        view = self._data[:, end - n:end]
+        view.flags.writeable = False        # Shared between handlers; nobody gets to scribble on it
+        return Bars._make(view)
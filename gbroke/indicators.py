@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming indicators that update in constant time per bar or tick.
+
+Get one with :meth:`gbroke.GBroke.indicator`; it is updated by the broker before your bar handlers are called,
+and shared by everyone who asks for the same indicator and parameters.  Read its :attr:`~Indicator.value`.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+from collections import deque, namedtuple
+
+NaN = float('NaN')
+
+Bands = namedtuple('Bands', 'lower middle upper')
+
+
+class Indicator:
+    """Base class for streaming indicators.
+
+    Subclasses implement :meth:`_update` taking one float input (the bar's `field`) and returning the new value.
+    Non-finite inputs (e.g. ``NaN`` before the first trade) are skipped.
+    """
+    def __init__(self, field='close'):
+        self.field = field
+        self.value = NaN        #: Most recent value; ``NaN`` (or a tuple of them) until :attr:`ready`
+        self.count = 0          #: Number of inputs seen
+
+    @property
+    def ready(self) -> bool:
+        """:Return: True once enough inputs have been seen for :attr:`value` to be meaningful."""
+        return self.count >= self.period
+
+    def update(self, bar) -> None:
+        """Update with a :class:`gbroke.Bar` (or anything with the attribute named by :attr:`field`)."""
+        x = getattr(bar, self.field)
+        if math.isfinite(x):
+            self.count += 1
+            self.value = self._update(x)
+
+    def _update(self, x):
+        raise NotImplementedError()
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join('{}={!r}'.format(k, v) for k, v in vars(self).items() if not k.startswith('_') and k not in ('value', 'count')))
+
+
+class SMA(Indicator):
+    """Simple moving average of the last `period` inputs."""
+    def __init__(self, period, field='close'):
+        super().__init__(field)
+        self.period = period
+        self._window = deque(maxlen=period)
+        self._sum = 0.0
+
+    def _update(self, x):
+        if len(self._window) == self.period:
+            self._sum -= self._window[0]
+        self._window.append(x)
+        self._sum += x
+        return self._sum / len(self._window)
+
+
+class EMA(Indicator):
+    """Exponential moving average with smoothing ``2 / (period + 1)``, seeded with the first input."""
+    def __init__(self, period, field='close'):
+        super().__init__(field)
+        self.period = period
+        self._alpha = 2.0 / (period + 1)
+
+    def _update(self, x):
+        if self.count == 1:
+            return x
+        return self.value + self._alpha * (x - self.value)
+
+
+class Volatility(Indicator):
+    """Sample standard deviation of the last `period` log returns of the input."""
+    def __init__(self, period, field='close'):
+        super().__init__(field)
+        self.period = period
+        self._prev = NaN
+        self._window = deque(maxlen=period)
+        self._sum = self._sumsq = 0.0
+
+    @property
+    def ready(self):
+        return len(self._window) >= self.period
+
+    def _update(self, x):
+        prev, self._prev = self._prev, x
+        if math.isnan(prev) or prev <= 0 or x <= 0:
+            return self.value
+        ret = math.log(x / prev)
+        if len(self._window) == self.period:
+            old = self._window[0]
+            self._sum -= old
+            self._sumsq -= old * old
+        self._window.append(ret)
+        self._sum += ret
+        self._sumsq += ret * ret
+        n = len(self._window)
+        if n < 2:
+            return NaN
+        return math.sqrt(max(self._sumsq - self._sum * self._sum / n, 0.0) / (n - 1))
+
+
+class RSI(Indicator):
+    """Relative strength index (0 - 100) with Wilder smoothing over `period` inputs."""
+    def __init__(self, period=14, field='close'):
+        super().__init__(field)
+        self.period = period
+        self._prev = NaN
+        self._gain = self._loss = 0.0
+
+    @property
+    def ready(self):
+        return self.count > self.period
+
+    def _update(self, x):
+        prev, self._prev = self._prev, x
+        if math.isnan(prev):
+            return NaN
+        change = x - prev
+        n = min(self.count - 1, self.period)      # Plain average until `period` changes seen, then Wilder smoothing
+        self._gain += (max(change, 0.0) - self._gain) / n
+        self._loss += (max(-change, 0.0) - self._loss) / n
+        if not self._loss:
+            return 100.0 if self._gain else 50.0
+        return 100.0 - 100.0 / (1.0 + self._gain / self._loss)
+
+
+class VWAPBands(Indicator):
+    """Rolling volume-weighted average price over the last `period` bars, with bands `k` volume-weighted standard deviations away.
+
+    Uses each bar's `vwap` and `volume`.  :attr:`value` is a :class:`Bands` ``(lower, middle, upper)``.
+    """
+    def __init__(self, period, k=2.0):
+        super().__init__('vwap')
+        self.period = period
+        self.k = k
+        self.value = Bands(NaN, NaN, NaN)
+        self._window = deque(maxlen=period)
+        self._vol = self._pv = self._p2v = 0.0
+
+    def update(self, bar):
+        price, volume = bar.vwap, bar.volume
+        if not (math.isfinite(price) and math.isfinite(volume)):
+            return
+        if not volume:      # No trades: the window still moves forward
+            price = 0.0
+        self.count += 1
+        if len(self._window) == self.period:
+            p, v = self._window[0]
+            self._vol -= v
+            self._pv -= p * v
+            self._p2v -= p * p * v
+        self._window.append((price, volume))
+        self._vol += volume
+        self._pv += price * volume
+        self._p2v += price * price * volume
+        if self._vol <= 0:
+            return
+        mid = self._pv / self._vol
+        std = math.sqrt(max(self._p2v / self._vol - mid * mid, 0.0))
+        self.value = Bands(mid - self.k * std, mid, mid + self.k * std)
+
+
+#: Maps names accepted by :meth:`gbroke.GBroke.indicator` to indicator classes
+INDICATORS = {
+    'sma': SMA,
+    'ema': EMA,
+    'volatility': Volatility,
+    'rsi': RSI,
+    'vwap_bands': VWAPBands,
+}
+
+
+def make_indicator(name: str, **params) -> Indicator:
+    """:Return: a new indicator of type `name` (a key of :data:`INDICATORS`) with the given parameters."""
+    try:
+        cls = INDICATORS[name]
+    except KeyError:
+        raise ValueError("Unknown indicator '{}'; known: {}".format(name, ', '.join(sorted(INDICATORS)))) from None
+    return cls(**params)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Logging that never blocks the feed or order threads.
+
+Loggers made by :func:`create_logger` hand records to a bounded queue; one background thread formats them and
+writes them out.  The calling thread only fills in the message (so later changes to the arguments, like a live
+:class:`gbroke.Order`, can't change what gets logged); timestamps, formatting and I/O all happen on the writer
+thread.  If the writer falls `maxsize` records behind, new records are dropped and counted rather than waiting.
+
+Always pass arguments rather than formatting them yourself (``log.debug('ORDER %s', order)``, not
+``log.debug('ORDER {}'.format(order))``), and guard anything expensive to build with
+``if log.isEnabledFor(logging.DEBUG):``.  A suppressed call then costs a fraction of a microsecond.
+
+With ``structured=True`` each record is written as one JSON object per line, including any ``extra=`` fields.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import atexit
+import logging
+import queue
+import sys
+import threading
+
+#: Records buffered for the writer thread before new ones are dropped
+DEFAULT_MAXSIZE = 65536
+FORMAT = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
+DATEFMT = '%Y-%m-%d %H:%M:%S'
+#: Longest to wait at exit for the writer to take the stop signal, and again for it to write out what's queued
+STOP_TIMEOUT_SEC = 5.0
+
+# Attributes every LogRecord has; anything else came from extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a bounded queue without ever waiting; counts the ones it has to drop."""
+    def __init__(self, q: queue.Queue):
+        super().__init__()
+        self.queue = q
+        self.dropped = 0    #: Records discarded because the queue was full
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        # Render the message now, since arguments may be mutated later, but leave the rest of formatting to the writer
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object with time, level, logger, thread, message and ``extra`` fields."""
+    def format(self, record):
+        import json
+        fields = {'time': record.created, 'level': record.levelname, 'logger': record.name, 'thread': record.threadName, 'message': record.getMessage()}
+        fields.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        if record.exc_text:
+            fields['exception'] = record.exc_text
+        return json.dumps(fields, default=str)
+
+
+class StderrHandler(logging.StreamHandler):
+    """Writes to whatever :data:`sys.stderr` is when each record is written, as :data:`logging.lastResort` does, so
+    replacing or closing it (e.g. in a test runner) doesn't break the writer."""
+    def __init__(self, level=logging.NOTSET):
+        logging.Handler.__init__(self, level)
+
+    @property
+    def stream(self):
+        return sys.stderr
+
+
+def create_logger(name: str, level: int = logging.WARNING, handler: logging.Handler = None, structured: bool = False,
+                  maxsize: int = DEFAULT_MAXSIZE) -> logging.Logger:
+    """:Return: a logger with the given `name` and `level` that writes through the background writer thread.
+
+    :param handler: Where the writer sends records; default a :class:`StderrHandler`.  Only used by the first call, which starts the writer.
+    :param structured: Write JSON lines instead of text.  Only used by the first call.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    if not any(isinstance(h, QueueHandler) for h in logger.handlers):       # Once per logger, no matter how many brokers
+        logger.addHandler(QueueHandler(_start(handler, structured, maxsize).queue))
+    return logger
+
+
+def flush(timeout: float = 5.0) -> None:
+    """Wait up to `timeout` sec for the writer to write out everything logged so far."""
+    writer = _writer
+    if writer is not None:
+        done = threading.Event()
+        writer.queue.put(done)
+        done.wait(timeout)
+
+
+def queue_depth() -> int:
+    """:Return: the number of records (and flushes) waiting for the writer."""
+    writer = _writer
+    return writer.queue.qsize() if writer is not None else 0
+
+
+class _Writer(threading.Thread):
+    """Takes records off `queue` and hands them to `handler`, until it gets None."""
+    def __init__(self, handler, maxsize):
+        super().__init__(name='LogWriter', daemon=True)
+        self.handler = handler
+        self.queue = queue.Queue(maxsize)
+
+    def run(self):
+        handler = self.handler
+        for item in iter(self.queue.get, None):
+            if isinstance(item, threading.Event):      # From flush()
+                self._call(handler.flush)
+                item.set()
+            else:
+                self._call(handler.handle, item)
+        self._call(handler.flush)
+
+    def _call(self, func, record=None):
+        """Call ``func(record)`` (or ``func()``), reporting any error through the handler: one bad record or a closed
+        stream mustn't stop the writer, or the queue would fill and everything after would be lost."""
+        try:
+            func() if record is None else func(record)
+        except Exception:
+            try:
+                self.handler.handleError(record)
+            except Exception:       # Nowhere left to report it
+                pass
+
+
+def _start(handler, structured, maxsize):
+    """Start the writer thread if it isn't running.  :Return: it."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            if handler is None:
+                handler = StderrHandler()
+            if handler.formatter is None:
+                handler.setFormatter(JsonFormatter() if structured else logging.Formatter(FORMAT, datefmt=DATEFMT))
+            _writer = _Writer(handler, maxsize)
+            _writer.start()
+            atexit.register(_stop)
+        return _writer
+
+
+def _stop():
+    """Write out what's queued and stop the writer."""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            try:
+                _writer.queue.put(None, timeout=STOP_TIMEOUT_SEC)       # Waits if full: at exit, better late than lost, but not never
+            except queue.Full:
+                pass
+            else:
+                _writer.join(STOP_TIMEOUT_SEC)
+            _writer = None
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Operational metrics for GBroke: counters, gauges and histograms, served as plain text over local HTTP.
+
+The text format is the Prometheus exposition format, so the endpoint can be scraped directly.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional, Tuple
+
+#: Default histogram bucket upper bounds, in seconds.  Covers sub-millisecond jitter up to multi-second REST calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """Base class for a named metric with an optional tuple of label names.
+
+    Updates take no locks.  Each labelled series is expected to be written from one thread (the feed thread for
+    feed metrics, the bar thread for bar metrics); the GIL keeps each dict operation consistent, and an
+    occasional lost increment from concurrent writers is acceptable for monitoring.
+    """
+    TYPE = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def _label_str(self, values, extra=()):
+        """:Return: the ``{name="value",...}`` label string for the label `values` (plus any `extra` (name, value) pairs)."""
+        pairs = tuple(zip(self.labels, values)) + tuple(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"')) for k, v in pairs) + '}'
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """:Return: an iterable of ``(name, label_str, value)`` samples."""
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        """:Return: this metric in text exposition format."""
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.TYPE)]
+        lines.extend('{}{} {}'.format(name, labels, _format_value(value)) for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """A monotonically increasing count, optionally split by label values."""
+    TYPE = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = dict()       # Maps label value tuple to count
+
+    def inc(self, *labels, n=1):
+        """Add `n` to the series for the given label values."""
+        values = self._values
+        values[labels] = values.get(labels, 0) + n
+
+    def get(self, *labels):
+        """:Return: the current count for the given label values."""
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in tuple(self._values.items()):       # Copy so writers can keep going while we render
+            yield self.name, self._label_str(labels), value
+
+
+class Gauge(Metric):
+    """A value that can go up and down.  If `func` is given, it is called at scrape time to get the (unlabelled) value."""
+    TYPE = 'gauge'
+
+    def __init__(self, name, help, labels=(), func: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self._values = dict()
+        self._func = func
+
+    def set(self, value, *labels):
+        """Set the series for the given label values to `value`."""
+        self._values[labels] = value
+
+    def get(self, *labels):
+        """:Return: the current value for the given label values (calls `func` if there is one)."""
+        if self._func is not None and not labels:
+            return self._func()
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        if self._func is not None:
+            yield self.name, '', self._func()
+        for labels, value in tuple(self._values.items()):
+            yield self.name, self._label_str(labels), value
+
+
+class Histogram(Metric):
+    """Counts observations into cumulative buckets, and tracks their count, sum and maximum.
+
+    The exposition format has no place for a maximum in a histogram, so it is rendered as a separate
+    ``<name>_max`` gauge.
+    """
+    TYPE = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = dict()       # Maps label value tuple to [bucket counts..., +Inf count, sum, max]
+
+    def observe(self, value, *labels):
+        """Record an observation of `value` in the series for the given label values."""
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        if value > series[-1]:
+            series[-1] = value
+
+    def count(self, *labels):
+        """:Return: the number of observations for the given label values."""
+        series = self._series.get(labels)
+        return sum(series[:-2]) if series else 0
+
+    def max(self, *labels):
+        """:Return: the largest observation for the given label values (0 if none)."""
+        series = self._series.get(labels)
+        return series[-1] if series else 0.0
+
+    def samples(self):
+        nbuckets = len(self.buckets) + 1
+        for labels, series in tuple(self._series.items()):
+            series = tuple(series)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:nbuckets]):
+                cumulative += count
+                yield self.name + '_bucket', self._label_str(labels, (('le', _format_value(bound)),)), cumulative
+            yield self.name + '_sum', self._label_str(labels), series[-2]
+            yield self.name + '_count', self._label_str(labels), cumulative
+
+    def render(self):
+        name = self.name + '_max'
+        lines = [super().render(), '# HELP {} Largest observation of {}'.format(name, self.name), '# TYPE {} gauge'.format(name)]
+        lines.extend('{}{} {}'.format(name, self._label_str(labels), _format_value(series[-1])) for labels, series in tuple(self._series.items()))
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """A collection of named metrics that can be rendered together and served over HTTP."""
+    def __init__(self):
+        self._metrics = dict()      # Maps name to Metric, in registration order
+        self._server = None
+
+    def counter(self, name, help, labels=()) -> Counter:
+        """:Return: a new :class:`Counter` registered under `name`."""
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=(), func=None) -> Gauge:
+        """:Return: a new :class:`Gauge` registered under `name`."""
+        return self._add(Gauge(name, help, labels, func))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        """:Return: a new :class:`Histogram` registered under `name`."""
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError('Metric {} already registered'.format(metric.name))
+        self._metrics[metric.name] = metric
+        return metric
+
+    def __getitem__(self, name) -> Metric:
+        return self._metrics[name]
+
+    def __contains__(self, name):
+        return name in self._metrics
+
+    def render(self) -> str:
+        """:Return: all metrics in text exposition format."""
+        return '\n'.join(metric.render() for metric in tuple(self._metrics.values())) + '\n'
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> int:
+        """Serve :meth:`render` output at ``http://host:port/metrics`` from a daemon thread.
+
+        :param port: TCP port to listen on; 0 picks a free port.
+        :return: The port actually bound.
+        """
+        if self._server is not None:
+            raise RuntimeError('Metrics server already running on port {}'.format(self._server.server_address[1]))
+        registry = self
+
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer        # Only needed if serving
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):      # Don't spam stderr on every scrape
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='gbroke-metrics', daemon=True).start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        """Stop the HTTP server, if running."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _format_value(value):
+    """Format a sample value the way the exposition format expects (``+Inf``, integers without a trailing ``.0``)."""
+    if value == float('inf'):
+        return '+Inf'
+    elif isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
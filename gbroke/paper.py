@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Paper trading: orders are filled locally against the live market data instead of being sent to the exchange.
+
+A :class:`gbroke.GBroke` made with ``paper=...`` sends its orders and cancels to a :class:`PaperExchange`, which
+delivers the resulting acknowledgements, fills and cancels the way the exchange would: through the broker's order
+handlers, and into its position ledger.  Each order and cancel reaches the simulated exchange `latency_sec` after it
+is made.
+
+Limit orders are post-only, as real ones are; one that would cross the book when placed is refused.  Resting orders
+join the back of the queue at their price, estimated from the aggregated (level 2) book, or from the top of book for
+other feeds.  Trades at that price use up the queue ahead before filling the order (trades, and shrinking of the level,
+only remove size ahead of it), and a trade through the price fills it completely.  Market orders fill against the
+book on arrival.
+
+Only products with resting paper orders do any work per trade, so a broker that isn't paper trading, or has no paper
+orders, pays one attribute or dict lookup per trade message.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from bisect import insort
+from typing import Callable, Optional
+
+INF = float('inf')
+#: Book levels a market order may walk
+MAX_LEVELS = 100
+
+
+class _PaperOrder:
+    __slots__ = ('record', 'side', 'price', 'ahead', 'key')
+
+    def __init__(self, record, side, price):
+        self.record = record
+        self.side = side            # 1 buy, -1 sell
+        self.price = price          # Limit; 0 for market
+        self.ahead = INF            # Size queued ahead of it at its price
+        self.key = None             # Sort key in its side's list
+
+
+class _Scheduler(threading.Thread):
+    """Calls functions after given delays, in order."""
+    def __init__(self):
+        super().__init__(name='PaperExchange', daemon=True)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def after(self, delay_sec: float, func: Callable, *args) -> None:
+        """Call ``func(*args)`` `delay_sec` from now."""
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay_sec, next(self._seq), func, args))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, func, args = heapq.heappop(self._heap)
+            func(*args)
+
+
+class PaperExchange:
+    """Simulated matching for one broker's orders."""
+    def __init__(self, broker, latency_sec: float = 0.1, fee_rate: float = 0.0, clock: Callable[[], float] = time.time, start: bool = True,
+                 scheduler=None):
+        """
+        :param broker: The :class:`gbroke.GBroke` whose handlers and ledger get the results.
+        :param latency_sec: Delay from making an order or cancel to it reaching the simulated exchange.
+        :param fee_rate: Commission as a fraction of the value filled (e.g. 0.0025); paper orders all pay it.
+        :param clock: Returns the time (epoch sec) for `open_time` and `fill_time`, e.g. :meth:`gbroke.GBroke.exchange_now`.
+        :param start: Deliver arrivals on a background thread after `latency_sec`.  If False, they happen immediately.
+        :param scheduler: Delivers arrivals instead of the background thread: anything with an ``after(delay_sec, func,
+          *args)`` method, e.g. a :class:`~gbroke.backtest.BacktestBroker` on its virtual clock.
+        """
+        self._broker = broker
+        self.latency_sec = latency_sec
+        self.fee_rate = fee_rate
+        self._clock = clock
+        self._books = dict()        # Maps product ID to (resting bids, resting asks): lists of (sort key, seq, _PaperOrder), best last
+        self._orders = dict()       # Maps order ID to _PaperOrder, from making to done
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+        self._scheduler = scheduler
+        if start and scheduler is None:
+            self._scheduler = _Scheduler()
+            self._scheduler.start()
+
+    def order(self, instrument, quantity: float, limit: float = 0.0, order_id: Optional[str] = None) -> Optional:
+        """Make an order.  :Return: its :class:`gbroke.Order`, or None if it was refused (a limit that would cross)."""
+        from . import _OrderRecord
+        import uuid
+        side = 1 if quantity > 0 else -1
+        if limit and self._crosses(instrument.id, side, limit):
+            self._broker.log.warning('PAPER %s post-only %s @ %s would cross; refused', instrument.id, quantity, limit)
+            return None
+        record = _OrderRecord(order_id or str(uuid.uuid4()), instrument, limit or None, abs(quantity), 0, True, False)
+        record.avg_price = 0.0
+        paper = _PaperOrder(record, side, limit)
+        with self._lock:
+            self._orders[record.id] = paper
+        self._broker._orders[record.id] = record
+        self._later(self._arrive, paper)
+        return record.snapshot()
+
+    def cancel(self, order) -> None:
+        """Cancel `order` (an Order or live record), once the request arrives."""
+        paper = self._orders.get(order.id)
+        if paper is not None:
+            self._later(self._cancelled, paper)
+
+    def on_trade(self, product_id: str, price: float, size: float, maker_side: str) -> None:
+        """A trade of `size` at `price` against a resting ``'buy'`` or ``'sell'`` order.  Call on the feed thread."""
+        book = self._books.get(product_id)
+        if book is None:
+            return
+        fills = []
+        with self._lock:
+            resting = book[0] if maker_side == 'buy' else book[1]
+            level, taken = None, 0.0
+            for _, _, paper in reversed(resting):       # Best first; oldest first at a price
+                if paper.price * paper.side < price * paper.side:       # Not reached
+                    break
+                remaining = paper.record.quantity - paper.record.filled
+                if paper.price == price:
+                    if level is None:
+                        level = self._level(product_id, paper.side, price)
+                    ahead = min(paper.ahead, level) if level is not None else paper.ahead
+                    paper.ahead = max(0.0, ahead - size)
+                    fill = min(remaining, size - ahead - taken)     # What the market queue ahead and our earlier orders left
+                    if fill <= 0:
+                        continue
+                    taken += fill
+                else:           # Traded through
+                    fill = remaining
+                fills.append((paper, fill))
+        for paper, fill in fills:
+            self._fill(paper, fill, paper.price)
+
+    def _later(self, func, *args):
+        if self._scheduler is None or not self.latency_sec:
+            func(*args)
+        else:
+            self._scheduler.after(self.latency_sec, func, *args)
+
+    def _arrive(self, paper):
+        """`paper` reaches the exchange: fill it (market) or queue it (limit)."""
+        record, product_id = paper.record, paper.record.instrument.id
+        if not record.open:
+            return          # Cancelled on the way
+        record.open_time = self._clock()
+        self._broker._call_order_handlers(record)
+        if not paper.price:
+            self._take(paper)
+            return
+        with self._lock:
+            paper.ahead = self._ahead(product_id, paper.side, paper.price)
+            paper.key = (paper.price * paper.side, -next(self._seq), paper)
+            book = self._books.get(product_id)
+            if book is None:
+                book = self._books[product_id] = ([], [])
+            insort(book[0] if paper.side > 0 else book[1], paper.key)
+
+    def _take(self, paper):
+        """Fill market order `paper` against the book; cancel what can't be filled."""
+        product_id, side = paper.record.instrument.id, paper.side
+        book = self._broker._books.get(product_id)
+        if book is not None:
+            levels = book.ask_levels(MAX_LEVELS) if side > 0 else book.bid_levels(MAX_LEVELS)
+        else:
+            acc = self._broker._ticumulators.get(product_id)
+            levels = [(acc.ask, acc.asksize) if side > 0 else (acc.bid, acc.bidsize)] if acc is not None else []
+        remaining = paper.record.quantity
+        for price, size in levels:
+            if remaining <= 0 or math.isnan(price):
+                break
+            fill = remaining if size != size else min(remaining, size)      # Unknown size: assume enough
+            remaining -= fill
+            self._fill(paper, fill, price)
+        if paper.record.open:
+            self._cancelled(paper)
+
+    def _fill(self, paper, size, price):
+        record, broker = paper.record, self._broker
+        product_id = record.instrument.id
+        with self._lock:
+            if not record.open or size <= 0:
+                return
+            record.avg_price = (record.filled * record.avg_price + size * price) / (record.filled + size)
+            record.filled += size
+            record.fill_time = self._clock()
+            fee = size * price * self.fee_rate
+            record.commission = (record.commission or 0.0) + fee
+            record.profit = (record.profit or 0.0) + self._book_fill(product_id, paper.side * size, price, fee)
+            if record.filled >= record.quantity - 1e-12:
+                record.open = False
+                self._remove(paper)
+        broker.log.info('PAPER FILL %s %s @ %s', product_id, paper.side * size, price)
+        broker._call_order_handlers(record)
+
+    def _cancelled(self, paper):
+        record = paper.record
+        with self._lock:
+            if not record.open:
+                return
+            record.open, record.cancelled = False, True
+            self._remove(paper)
+        self._broker._call_order_handlers(record)
+
+    def _remove(self, paper):
+        """Forget `paper`, which is done.  Call with the lock held."""
+        self._orders.pop(paper.record.id, None)
+        if paper.key is not None:
+            book = self._books[paper.record.instrument.id]
+            book[0 if paper.side > 0 else 1].remove(paper.key)
+            if not book[0] and not book[1]:
+                del self._books[paper.record.instrument.id]
+
+    def _book_fill(self, product_id, quantity, price, fee):
+        """Apply a fill of signed `quantity` to the position ledger.  :Return: realized profit, net of `fee`."""
+        positions = self._broker._positions
+        pos, cost = positions.get(product_id, (0.0, None))
+        cost = cost or 0.0
+        profit = -fee
+        if pos and (pos > 0) != (quantity > 0):         # Reducing or flipping
+            closed = min(abs(quantity), abs(pos))
+            profit += closed * (price - cost) * (1 if pos > 0 else -1)
+            new = pos + quantity
+            cost = cost if new and (new > 0) == (pos > 0) else price
+        else:
+            new = pos + quantity
+            cost = (pos * cost + quantity * price) / new
+        positions[product_id] = (new, cost if new else None)
+        product = self._broker._instruments[product_id].product
+        if product is not None:
+            cash, _ = positions.get(product.quote_currency, (0.0, None))
+            positions[product.quote_currency] = (cash - quantity * price - fee, 0.0)
+        return profit
+
+    def _crosses(self, product_id, side, price):
+        acc = self._broker._ticumulators.get(product_id)
+        if acc is None:
+            return False
+        return price >= acc.ask if side > 0 else price <= acc.bid       # False if NaN
+
+    def _ahead(self, product_id, side, price):
+        """:Return: estimated size queued at `price` before a new order."""
+        level = self._level(product_id, side, price)
+        if level is not None:
+            return level
+        acc = self._broker._ticumulators.get(product_id)
+        if acc is None:
+            return INF
+        best, size = (acc.bid, acc.bidsize) if side > 0 else (acc.ask, acc.asksize)
+        if price == best:
+            return size if size == size else INF
+        if best != best or price * side > best * side:          # Improves the market (or there is none): first in line
+            return 0.0
+        return INF          # Behind the touch, depth unknown: fills only when traded through
+
+    def _level(self, product_id, side, price):
+        """:Return: the size at `price` in the level 2 book, or None if there is no book."""
+        book = self._broker._books.get(product_id)
+        if book is None:
+            return None
+        return (book.bids if side > 0 else book.asks).get(price, 0.0)
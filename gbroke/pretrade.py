@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Pre-trade checks: make an order valid for the exchange, or reject it before it goes anywhere.
+
+Sizes are rounded down to the product's `base_increment`.  Prices are rounded to its `quote_increment` away from the
+market (buys down, sells up), so rounding never makes an order more aggressive than asked.  The result is then checked
+against the product's status and size limits and, given a balance, against available funds.  Everything needed is
+already in memory (see :mod:`gbroke.products`), so a bad order costs microseconds instead of a REST round trip.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+from typing import List, Optional, Tuple
+
+#: Tolerance (in increments) for float error when rounding, so 0.3 / 0.1 doesn't round down to 2
+EPSILON = 1e-9
+#: Size decimals when the product is unknown
+DEFAULT_SIZE_PLACES = 3
+
+_places = dict()        # Maps increment to number of decimal places
+
+
+class OrderRejected(ValueError):
+    """An order failed pre-trade checks.  `reasons` is a list of ``(code, message)`` pairs; codes are ``'status'``,
+    ``'size'``, ``'price'``, and ``'funds'``."""
+    def __init__(self, product_id: Optional[str], reasons: List[Tuple[str, str]]):
+        super().__init__('{} order rejected: {}'.format(product_id or 'Unknown product', '; '.join(message for _, message in reasons)))
+        self.product_id = product_id
+        self.reasons = reasons
+
+
+def places(increment: float) -> int:
+    """:Return: the number of decimal places in `increment`, e.g. 2 for 0.01."""
+    n = _places.get(increment)
+    if n is None:
+        n = _places[increment] = max(0, -math.floor(math.log10(increment) + EPSILON))
+    return n
+
+
+def quantize(value: float, increment: float, up: bool = False) -> float:
+    """:Return: `value` rounded down (or `up`) to a multiple of `increment`."""
+    steps = value / increment
+    steps = math.ceil(steps - EPSILON) if up else math.floor(steps + EPSILON)
+    return round(steps * increment, places(increment))
+
+
+def check_order(product, quantity: float, limit: float = 0.0, stop: float = 0.0, price: float = float('NaN'),
+                available: Optional[float] = None) -> Tuple[float, float, float]:
+    """Quantize an order and check it against `product`'s rules.
+
+    :param Product product: The :class:`~gbroke.products.Product`, or None to only round the size to
+      :data:`DEFAULT_SIZE_PLACES` and check signs.
+    :param quantity: Positive to buy, negative to sell.
+    :param limit: Limit price, or 0 for none.
+    :param stop: Stop price, or 0 for none.
+    :param price: Expected fill price of a market order (e.g. the ask for a buy), for the funds checks; NaN if unknown.
+    :param available: Funds free for this order: quote currency for a buy, base currency for a sell.  None to skip the check.
+    :Return: ``(quantity, limit, stop)``, quantized.  `quantity` is 0 if it rounds to nothing.
+    :raises OrderRejected: if it can't be valid.
+    """
+    buy = quantity > 0
+    size = abs(quantity)
+    reasons = []
+    if limit < 0 or stop < 0:
+        reasons.append(('price', 'negative price (limit {}, stop {})'.format(limit, stop)))
+    if product is None:
+        size = round(size, DEFAULT_SIZE_PLACES)
+    else:
+        if not product.trading:
+            reasons.append(('status', '{} is {}'.format(product.id, product.status)))
+        size = quantize(size, product.base_increment)
+        if size and size < product.base_min_size:
+            reasons.append(('size', 'size {} below minimum {}'.format(size, product.base_min_size)))
+        elif size > product.base_max_size:
+            reasons.append(('size', 'size {} above maximum {}'.format(size, product.base_max_size)))
+        if limit > 0:
+            limit = quantize(limit, product.quote_increment, up=not buy)
+            if not limit:
+                reasons.append(('price', 'limit rounds to 0 at increment {}'.format(product.quote_increment)))
+        if stop > 0:
+            stop = quantize(stop, product.quote_increment, up=not buy)
+            if not stop:
+                reasons.append(('price', 'stop rounds to 0 at increment {}'.format(product.quote_increment)))
+    if limit > 0 and stop > 0 and (limit < stop if buy else limit > stop):
+        reasons.append(('price', '{} limit {} on the wrong side of stop {}'.format('buy' if buy else 'sell', limit, stop)))
+    price = limit or stop or price
+    if size and not reasons:
+        funds = size * price
+        if product is not None and funds < product.min_market_funds:        # False if either is NaN
+            reasons.append(('funds', 'value {} below minimum {}'.format(funds, product.min_market_funds)))
+        needed = funds if buy else size
+        if available is not None and needed > available:      # False if price is unknown
+            reasons.append(('funds', 'needs {} {}, {} available'.format(needed, 'quote' if buy else 'base', available)))
+    if reasons:
+        raise OrderRejected(product.id if product is not None else None, reasons)
+    return (size if buy else -size), limit, stop
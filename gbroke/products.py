@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""
+Product metadata (price and size increments, limits, trading status) from the exchange's ``/products`` endpoint.
+
+A :class:`ProductRegistry` is loaded once when the broker connects.  The response is cached as JSON on disk, so
+later starts within `max_age_sec` skip the request; if the request fails, a stale cache is better than nothing.
+Lookups by product ID are plain dict lookups, cheap enough for message handlers.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import time
+from collections import namedtuple
+from typing import Callable, Iterator, List, Optional
+
+#: Size increment for products whose metadata doesn't give one
+DEFAULT_BASE_INCREMENT = 1e-8
+#: How long a cached products file is used before fetching again
+DEFAULT_MAX_AGE_SEC = 24 * 60 * 60
+
+
+class Product(namedtuple('Product', 'id base_currency quote_currency quote_increment base_increment base_min_size base_max_size min_market_funds status')):
+    """Trading rules for one product.  Prices are multiples of `quote_increment` and sizes of `base_increment`,
+    between `base_min_size` and `base_max_size`.  `min_market_funds` is NaN if the exchange doesn't say."""
+    __slots__ = ()
+
+    @property
+    def trading(self) -> bool:
+        """:Return: True iff the product is accepting orders."""
+        return self.status == 'online'
+
+    @classmethod
+    def from_json(cls, raw: dict) -> 'Product':
+        """:Return: a Product from one element of the ``/products`` response."""
+        return cls(raw['id'], raw.get('base_currency'), raw.get('quote_currency'), float(raw['quote_increment']),
+                   float(raw.get('base_increment') or DEFAULT_BASE_INCREMENT), float(raw['base_min_size']), float(raw['base_max_size']),
+                   float(raw.get('min_market_funds') or 'nan'), raw.get('status', 'online'))
+
+
+class ProductRegistry:
+    """Maps product ID to :class:`Product`."""
+    def __init__(self, fetch: Callable[[], List[dict]], path: Optional[str] = None, max_age_sec: float = DEFAULT_MAX_AGE_SEC,
+                 log: logging.Logger = None):
+        """
+        :param fetch: Returns the ``/products`` response, e.g. ``gdax.PublicClient.get_products``.
+        :param path: JSON cache file (its directory is created if necessary); None to not cache.
+        :param max_age_sec: Use the cache instead of fetching if it is younger than this.
+        """
+        self._fetch = fetch
+        self.path = path
+        self.max_age_sec = max_age_sec
+        self.log = log or logging.getLogger(__name__)
+        self._products = dict()     # Replaced, never modified, so readers on other threads need no lock
+        self.updated = None         #: Epoch sec the products were fetched, or None if never
+
+    def load(self) -> 'ProductRegistry':
+        """Load from the cache if it is fresh, otherwise fetch (falling back to a stale cache on error).  :Return: self."""
+        cached = self._read()
+        if cached is not None and time.time() - cached[0] < self.max_age_sec:
+            self._set(*cached)
+            return self
+        try:
+            self.refresh()
+        except Exception as e:
+            if cached is None:
+                self.log.warning('Could not fetch products and no cache: %s', e)
+            else:
+                self.log.warning('Could not fetch products (%s); using %.1f hour old cache', e, (time.time() - cached[0]) / 3600)
+                self._set(*cached)
+        return self
+
+    def refresh(self) -> None:
+        """Fetch the products and update the cache.  Raises on error, leaving the current products in place."""
+        raw = self._fetch()
+        if not isinstance(raw, list):       # The REST client returns error responses rather than raising
+            raise RuntimeError('Bad products response: {}'.format(raw))
+        updated = time.time()
+        self._set(updated, raw)
+        if self.path is not None:
+            import json
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'time': updated, 'products': raw}, f)
+            os.replace(tmp, self.path)      # Readers never see a half-written file
+
+    def get(self, product_id: str) -> Optional[Product]:
+        """:Return: the :class:`Product` for `product_id`, or None if unknown."""
+        return self._products.get(product_id)
+
+    def __getitem__(self, product_id: str) -> Product:
+        return self._products[product_id]
+
+    def __contains__(self, product_id) -> bool:
+        return product_id in self._products
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._products)
+
+    def __len__(self):
+        return len(self._products)
+
+    def _set(self, updated, raw):
+        products = dict()
+        for item in raw:
+            try:
+                product = Product.from_json(item)
+            except (KeyError, TypeError, ValueError) as e:
+                self.log.warning('Skipping bad product %s: %r', item, e)
+            else:
+                products[product.id] = product
+        self._products = products
+        self.updated = updated
+
+    def _read(self):
+        """:Return: ``(time, raw products)`` from the cache, or None if there is no usable cache."""
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        import json
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+            return float(cached['time']), list(cached['products'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.log.warning('Ignoring bad products cache %s: %r', self.path, e)
+            return None
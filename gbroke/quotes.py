@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Quote management for market making: say which bids and asks you want resting, and the manager makes it so.
+
+A strategy calls :meth:`QuoteManager.quote` with the levels (price and size) it wants on each side, as often as it
+likes.  The manager's thread compares the latest wish against the orders it has resting and sends only the difference:
+a cancel for each order at a price no longer wanted (or with the wrong size left), and a new order for each price not
+covered, cancels first and the levels nearest the touch next.  It works out the difference again before every request,
+after waiting for the rate limit, so wishes that change faster than requests can go out are coalesced: only the latest
+is acted on, and a level that comes and goes in between costs nothing.  Orders with a request in flight (a new order
+not yet acknowledged, or a cancel not yet done) are left alone, so nothing is requested twice.  Finished orders are
+dropped from the broker's order table.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from typing import Callable, Iterable, List, Sequence
+
+from .pretrade import OrderRejected, check_order
+
+#: Private endpoint request rate limit (per second), shared by all of a broker's quote managers
+PRIVATE_RATE_LIMIT = 5.0
+#: Burst allowed by the private endpoint rate limit
+PRIVATE_RATE_BURST = 10
+#: Wait before resending a quote whose order couldn't be sent (e.g. a network error), doubling on each failure up to the max
+RETRY_MIN_SEC = 0.5
+RETRY_MAX_SEC = 30.0
+
+
+class QuoteManager:
+    """Keeps resting orders for one instrument matching the levels last passed to :meth:`quote`.
+
+    Made by :meth:`gbroke.GBroke.quote_manager`, not by user code.
+    """
+    def __init__(self, broker, instrument, limiter=None, size_tolerance: float = 0.2, start: bool = True, clock: Callable[[], float] = time.monotonic):
+        """
+        :param broker: The :class:`gbroke.GBroke` to send orders through.
+        :param limiter: :class:`~gbroke.ratelimit.RateLimiter` every request waits on; None for no limit.
+        :param size_tolerance: Leave an order resting while its remaining size is within this fraction of the size
+          wanted, so partial fills don't cause a cancel and replace each.
+        :param start: Send requests from a background thread.  If False, call :meth:`step` yourself.
+        :param clock: Returns the time in seconds, for retry backoff.
+        """
+        self._broker = broker
+        self.instrument = instrument
+        self._limiter = limiter
+        self.size_tolerance = size_tolerance
+        self._desired = dict()      # Maps (side, price) to size, side 1 for bids and -1 for asks
+        self._resting = dict()      # Maps (side, price) to live order record, from sending to done
+        self._cancelling = set()    # Records with a cancel sent
+        self._client_ids = dict()   # Maps record to the ID it was sent with, which is also a key in broker._orders
+        self._rejected = dict()     # Maps (side, price) to size that failed pre-trade checks; not retried until the wish changes
+        self._retry = dict()        # Maps (side, price) to (time to retry after, backoff sec) when its order couldn't be sent
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        broker._order_listeners = broker._order_listeners + [self.on_order]        # Copy on write
+        if start:
+            threading.Thread(target=self._run, name='Quotes-{}'.format(instrument.id), daemon=True).start()
+
+    def quote(self, bids: Iterable[Sequence[float]] = (), asks: Iterable[Sequence[float]] = ()) -> None:
+        """Want exactly these ``(price, size)`` `bids` and `asks` resting, and nothing else.
+
+        Prices are rounded away from the market to the product's increment and sizes down to its size increment;
+        levels that round to the same price are combined.  Raises :class:`~gbroke.pretrade.OrderRejected` for a level
+        that can't be valid, leaving the previous wish in place.
+        """
+        product = self.instrument.product
+        desired = dict()
+        for side, levels in ((1, bids), (-1, asks)):
+            for price, size in levels:
+                size, price, _ = check_order(product, side * size, limit=price)
+                if size:
+                    key = (side, price)
+                    desired[key] = desired.get(key, 0.0) + abs(size)
+        with self._lock:
+            self._desired = desired
+        self._wake.set()
+
+    def cancel_all(self) -> None:
+        """Want nothing resting."""
+        self.quote()
+
+    def stop(self) -> None:
+        """Cancel all quotes, then stop the thread once they are sent."""
+        self.cancel_all()
+        self._stopped = True
+        self._wake.set()
+
+    def resting(self) -> List:
+        """:Return: :class:`gbroke.Order` snapshots of the orders resting or on their way, bids then asks, nearest first."""
+        with self._lock:
+            keys = sorted(self._resting, key=lambda key: (-key[0], -key[0] * key[1]))
+            return [self._resting[key].snapshot() for key in keys]
+
+    def step(self) -> int:
+        """Send requests until the resting orders match the wish or are waiting on requests in flight.  :Return: how many were sent."""
+        sent = 0
+        while True:
+            with self._lock:
+                action = self._next_action()
+            if action is None:
+                return sent
+            if self._limiter is not None:
+                self._limiter.acquire()
+                with self._lock:
+                    action = self._next_action()       # The wish may have changed while we waited
+                if action is None:
+                    return sent
+            self._send(*action)
+            sent += 1
+
+    def on_order(self, record) -> None:
+        """Order listener: forget our orders when they are done."""
+        if record.open or record not in self._client_ids:
+            return
+        with self._lock:
+            for key, resting in tuple(self._resting.items()):
+                if resting is record:
+                    del self._resting[key]
+            self._cancelling.discard(record)
+            client_id = self._client_ids.pop(record, None)
+        orders = self._broker._orders
+        orders.pop(client_id, None)
+        if orders.get(record.id) is record:
+            del orders[record.id]
+        self._wake.set()
+
+    def _next_action(self):
+        """:Return: the most urgent ``(op, key, record or size)`` needed, or None.  Call with the lock held."""
+        if not self._broker.connected:
+            return None
+        desired = self._desired
+        for key, record in self._resting.items():
+            if record in self._cancelling or record.open_time is None:      # Cancel in flight, or not acknowledged yet
+                continue
+            want = desired.get(key)
+            if want is None or abs(abs(record.quantity) - abs(record.filled) - want) > want * self.size_tolerance:
+                return 'cancel', key, record
+        retry, now = self._retry, self._clock() if self._retry else 0.0
+        new = [(key, size) for key, size in desired.items() if key not in self._resting and self._rejected.get(key) != size
+               and (key not in retry or retry[key][0] <= now)]
+        if new:
+            key, size = min(new, key=lambda item: -item[0][0] * item[0][1])     # Highest bid or lowest ask first
+            return 'new', key, size
+        return None
+
+    def _send(self, op, key, arg):
+        broker = self._broker
+        broker._metric_quote_requests.inc(self.instrument.id, op)
+        if op == 'cancel':
+            with self._lock:
+                self._cancelling.add(arg)
+            try:
+                broker.cancel(arg)
+            except Exception:
+                broker.log.exception('Error cancelling quote %s', arg)
+                with self._lock:
+                    self._cancelling.discard(arg)       # Try again next step
+        else:
+            side, price = key
+            try:
+                broker.check_order(self.instrument, side * arg, limit=price)
+                order = broker.order(self.instrument, side * arg, limit=price)
+            except OrderRejected as e:
+                broker.log.warning('%s', e)
+                with self._lock:
+                    self._rejected[key] = arg
+                return
+            except Exception:
+                broker.log.exception('Error sending %s quote %s @ %s', self.instrument.id, side * arg, price)
+                order = None
+            record = broker._orders.get(order.id) if order is not None else None
+            with self._lock:
+                if record is None:      # Not sent, or refused by the exchange: back off, then try again
+                    backoff = min(self._retry[key][1] * 2, RETRY_MAX_SEC) if key in self._retry else RETRY_MIN_SEC
+                    self._retry[key] = (self._clock() + backoff, backoff)
+                else:
+                    self._rejected.pop(key, None)
+                    self._retry.pop(key, None)
+                    self._client_ids[record] = order.id
+                    if record.open:
+                        self._resting[key] = record
+            if record is not None and not record.open:      # Done before we got here (e.g. a post-only cross)
+                self.on_order(record)
+
+    def _run(self):
+        while True:
+            self._wake.wait(1.0)        # Also retry periodically, e.g. after a reconnect
+            self._wake.clear()
+            try:
+                self.step()
+            except Exception:
+                self._broker.log.exception('Error managing %s quotes', self.instrument.id)
+            if self._stopped and not self._resting:
+                return
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Binary market data recording.
+
+Records are fixed-width little-endian structs appended to memory-mapped files that are preallocated to a fixed
+size and rotated when full.  Each file starts with a :data:`HEADER_SIZE` byte header giving the record kind and
+the number of valid records; the header is only updated when the file is flushed, so readers never see a partially
+written record.  Files are named ``name.kind.first_time_usec.gbr`` so they sort in time order.
+
+Reading requires NumPy: :func:`read_records` maps a file and returns a structured array over it without copying.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import glob
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from typing import Iterator, List, Optional
+
+try:
+    import numpy as np
+except ImportError:     # Only needed for reading
+    np = None
+
+from . import Bar, RecurringTask, Ticumulator
+
+#: File magic number
+MAGIC = b'GBRK'
+#: File format version
+VERSION = 1
+#: Bytes reserved at the start of each file for the header
+HEADER_SIZE = 64
+#: Header layout: magic, version, kind, record size, record count, first record time, last record time
+HEADER = struct.Struct('<4sHHIQdd')
+#: Default size files are preallocated to (and rotated at)
+DEFAULT_FILE_SIZE = 64 * 2**20
+#: Kind of file holding one ``(time, field, value)`` record per :meth:`Ticumulator.add` call.
+#: `field` is the index of the input in :attr:`Ticumulator.INPUT_FIELDS`.
+KIND_TICKS = 1
+#: Kind of file holding one top-of-book row (:data:`QUOTE_FIELDS`) per quote change.
+KIND_QUOTES = 2
+#: Bar fields recorded in each row of a quotes file
+QUOTE_FIELDS = ('time', 'bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize', 'lasttime', 'bid_depth', 'ask_depth')
+#: Maps kind to name used in filenames
+KIND_NAMES = {KIND_TICKS: 'ticks', KIND_QUOTES: 'quotes'}
+#: Maps kind to struct format of one record
+RECORD_FORMATS = {KIND_TICKS: '<dqd', KIND_QUOTES: '<' + 'd' * len(QUOTE_FIELDS)}
+#: Maps kind to NumPy dtype of one record (when NumPy is available)
+DTYPES = {
+    KIND_TICKS: [('time', '<f8'), ('field', '<i8'), ('value', '<f8')],
+    KIND_QUOTES: [(field, '<f8') for field in QUOTE_FIELDS],
+}
+#: Maps Ticumulator input names to their field ids in ticks files
+FIELD_IDS = {what: i for i, what in enumerate(Ticumulator.INPUT_FIELDS)}
+
+Header = namedtuple('Header', 'magic version kind record_size count first_time last_time')
+
+
+class RecordWriter:
+    """Appends fixed-width records to memory-mapped, size-rotated files, with a periodic background flush.
+
+    :meth:`append` takes no locks and must only be called from one thread.
+    """
+    def __init__(self, directory: str, name: str, kind: int, file_size: int = DEFAULT_FILE_SIZE, flush_sec: float = 1.0):
+        """
+        :param directory: Directory to write files to (created if it does not exist).
+        :param name: Prefix for filenames, typically the instrument id.
+        :param kind: :data:`KIND_TICKS` or :data:`KIND_QUOTES`.
+        :param file_size: Preallocated size of each file in bytes; a new file is started when one fills up.
+        :param flush_sec: Interval at which the header is updated and dirty pages are written to disk.
+        """
+        if kind not in RECORD_FORMATS:
+            raise ValueError('Invalid record kind {}'.format(kind))
+        self._struct = struct.Struct(RECORD_FORMATS[kind])
+        if file_size < HEADER_SIZE + self._struct.size:
+            raise ValueError('file_size {} too small for even one record'.format(file_size))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.name = name
+        self.kind = kind
+        self.file_size = file_size
+        self.path = None                # Path of the current file
+        self.closed = False
+        self.on_close = None            #: Called at the start of close(), e.g. to stop whatever feeds this writer
+        self._capacity = (file_size - HEADER_SIZE) // self._struct.size
+        self._file = None
+        self._mm = None
+        self._count = 0                 # Records written to the current file
+        self._first_time = float('NaN')
+        self._last_time = float('NaN')
+        self._lock = threading.Lock()   # Protects the mmap against rotation/close while flushing
+        self._flusher = RecurringTask(self.flush, interval_sec=flush_sec, init_sec=flush_sec, daemon=True)
+
+    @property
+    def path_prefix(self):
+        """:Return: the path prefix shared by all files written by this writer."""
+        return os.path.join(self.directory, '{}.{}.'.format(self.name, KIND_NAMES[self.kind]))
+
+    def append(self, time: float, *values) -> None:
+        """Append a record with the given `time` and remaining `values`."""
+        if self._count >= self._capacity or self._mm is None:
+            self._rotate(time)
+        self._struct.pack_into(self._mm, HEADER_SIZE + self._count * self._struct.size, time, *values)
+        if not self._count:
+            self._first_time = time
+        self._last_time = time
+        self._count += 1
+
+    def flush(self) -> None:
+        """Write the header and flush dirty pages of the current file to disk."""
+        with self._lock:
+            if self._mm is not None:
+                self._write_header()
+                self._mm.flush()
+
+    def close(self) -> None:
+        """Flush and close the current file, truncating it to the records written, and stop the background flush."""
+        if self.on_close is not None:
+            self.on_close()
+        self.closed = True              # Recorders ignore any later input
+        self._flusher.stop()
+        with self._lock:
+            self._close_file()
+
+    def _rotate(self, time):
+        with self._lock:
+            if self.closed:
+                raise ValueError('Write to closed {}'.format(self.__class__.__name__))
+            self._close_file()
+            self.path = '{}{:017d}.gbr'.format(self.path_prefix, int(time * 1e6))
+            self._file = open(self.path, 'x+b')         # Fail rather than clobber an existing recording
+            self._file.truncate(self.file_size)
+            self._mm = mmap.mmap(self._file.fileno(), self.file_size)
+            self._count = 0
+            self._first_time = self._last_time = float('NaN')
+            self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self._mm, 0, MAGIC, VERSION, self.kind, self._struct.size, self._count, self._first_time, self._last_time)
+
+    def _close_file(self):
+        if self._mm is None:
+            return
+        self._write_header()
+        self._mm.flush()
+        self._mm.close()
+        self._file.truncate(HEADER_SIZE + self._count * self._struct.size)
+        self._file.close()
+        self._mm = self._file = None
+
+
+class TickRecorder(RecordWriter):
+    """Records every input to a :class:`~gbroke.Ticumulator` as a ``(time, field, value)`` record.
+
+    Add it to :attr:`Ticumulator.listeners`.  Replaying the records through a fresh :class:`~gbroke.Ticumulator`
+    reproduces its state exactly.
+    """
+    def __init__(self, directory, name, **kwargs):
+        super().__init__(directory, name, KIND_TICKS, **kwargs)
+
+    def __call__(self, time, what, value):
+        if not self.closed:
+            try:
+                self.append(time, FIELD_IDS[what], value)
+            except ValueError:
+                if not self.closed:
+                    raise           # Otherwise closed while we were writing: the record is just too late
+
+
+class QuoteRecorder(RecordWriter):
+    """Tick handler (``register(..., bar_type='tick')``) that records one top-of-book row (:data:`QUOTE_FIELDS`) per tick."""
+    _INDEXES = tuple(Bar._fields.index(field) for field in QUOTE_FIELDS)
+
+    def __init__(self, directory, name, **kwargs):
+        super().__init__(directory, name, KIND_QUOTES, **kwargs)
+
+    def __call__(self, instrument, bar):
+        if not self.closed:
+            try:
+                self.append(*(bar[i] for i in self._INDEXES))
+            except ValueError:
+                if not self.closed:
+                    raise
+
+
+def read_header(path: str) -> Header:
+    """:Return: the :class:`Header` of the recording at `path`."""
+    with open(path, 'rb') as file:
+        header = Header._make(HEADER.unpack(file.read(HEADER.size)))
+    if header.magic != MAGIC:
+        raise ValueError('{} is not a GBroke recording'.format(path))
+    if header.version != VERSION:
+        raise ValueError('Unsupported recording version {} in {}'.format(header.version, path))
+    return header
+
+
+def read_records(path: str) -> 'np.ndarray':
+    """:Return: a read-only NumPy structured array of the flushed records in `path`, memory-mapped without copying.
+
+    The field names are ``time, field, value`` for ticks files, or :data:`QUOTE_FIELDS` for quotes files.
+    """
+    if np is None:
+        raise ImportError('Reading recordings requires numpy')
+    header = read_header(path)
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size <= HEADER_SIZE:
+            return np.empty(0, dtype=DTYPES[header.kind])
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)      # Stays open as long as the array references it
+    return np.frombuffer(mm, dtype=DTYPES[header.kind], count=header.count, offset=HEADER_SIZE)
+
+
+def list_recordings(directory: str, name: str = '*', kind: Optional[int] = None) -> List[str]:
+    """:Return: the paths of recordings in `directory` for instrument `name` (a glob pattern), in time order."""
+    kinds = (KIND_NAMES[kind],) if kind else tuple(KIND_NAMES.values())
+    paths = [path for kind_name in kinds for path in glob.glob(os.path.join(directory, '{}.{}.*.gbr'.format(name, kind_name)))]
+    return sorted(paths, key=lambda path: (os.path.basename(path).rsplit('.', 3)[0], int(path.rsplit('.', 2)[1])))
+
+
+def iter_records(directory: str, name: str = '*', kind: int = KIND_TICKS) -> Iterator['np.ndarray']:
+    """Yield a :func:`read_records` array for each recording of `kind` for instrument `name` in `directory`, in time order."""
+    for path in list_recordings(directory, name, kind):
+        yield read_records(path)
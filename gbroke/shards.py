@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Shard market data handling for many products across worker processes.
+
+Each worker is a :class:`gbroke.GBroke` in its own process that owns the feed connections, books and
+:class:`gbroke.Ticumulator`\\ s of the products assigned to it, and publishes their ticks and bars through a
+:mod:`gbroke.sharedfeed` ring.  The :class:`ShardSupervisor`, in the main broker process, assigns products to
+the least loaded worker, reads every worker's ring into the main broker's bar and tick handlers, forwards the
+account's own order messages to the main broker (which keeps all orders and positions), and restarts workers
+that die.
+
+Enable it with ``GBroke(shards=n)``; :meth:`gbroke.GBroke.register` is then used as usual.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import multiprocessing
+import os
+import threading
+import time
+from queue import Empty
+
+from .sharedfeed import FeedSubscriber
+
+#: Seconds to wait for a new worker to connect and start publishing
+STARTUP_TIMEOUT_SEC = 60
+
+
+class _Shard:
+    """One worker process and what it has been asked to publish."""
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name                # Shared memory ring name
+        self.products = set()
+        self.subscriptions = []         # (product, bar_type, bar_size) in the order requested, replayed on restart
+        self.feeds = dict()             # Maps product to feed level (see gbroke.FEED_LEVELS)
+        self.process = None
+        self.control = None             # Queue of subscriptions for the worker; None to stop
+        self.subscriber = None
+
+
+class ShardSupervisor:
+    """Runs market data for the main `broker`'s products in `workers` processes (default one per CPU)."""
+    def __init__(self, broker, workers=None, check_sec=1.0, idle_sec=0.001):
+        from . import RecurringTask
+        self._broker = broker
+        self._ctx = multiprocessing.get_context('spawn')        # Forking a process with live feed threads is asking for trouble
+        self._events = self._ctx.Queue()                        # Order messages from all workers
+        self._shards = [_Shard(i, 'gbroke-{}-{}'.format(os.getpid(), i)) for i in range(workers or os.cpu_count() or 1)]
+        self._subscribers = ()          # Copy on write tuple of FeedSubscribers, read by the pump thread
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._idle_sec = idle_sec
+        self._metric_restarts = broker.metrics.counter('gbroke_shard_restarts_total', 'Worker processes restarted after dying', ('shard',))
+        self._metric_products = broker.metrics.gauge('gbroke_shard_products', 'Products assigned to each worker', ('shard',))
+        self._pump = threading.Thread(target=self._run, name='ShardPump', daemon=True)
+        self._pump.start()
+        self._monitor = RecurringTask(self._check, interval_sec=check_sec, init_sec=check_sec, daemon=True)
+
+    @property
+    def workers(self) -> int:
+        return len(self._shards)
+
+    def shard_of(self, product: str):
+        """:Return: the index of the worker handling `product`, or None if it's not assigned."""
+        for shard in self._shards:
+            if product in shard.products:
+                return shard.index
+        return None
+
+    def subscribe(self, instrument, bar_type: str, bar_size: float, feed: str = 'full') -> None:
+        """Have a worker publish `instrument`'s `bar_type` bars (of `bar_size`, for time bars) to the main broker's handlers,
+        from a feed of at least level `feed`."""
+        from . import FEED_LEVELS
+        product = instrument.symbol
+        bar_size = bar_size if bar_type == 'time' else 0.0
+        sub = (product, bar_type, bar_size)
+        with self._lock:
+            index = self.shard_of(product)
+            shard = self._shards[index] if index is not None else min(self._shards, key=lambda shard: len(shard.products))
+            new = sub not in shard.subscriptions
+            upgrade = product not in shard.feeds or FEED_LEVELS.index(feed) > FEED_LEVELS.index(shard.feeds[product])
+            if not new and not upgrade:
+                return
+            shard.products.add(product)
+            self._metric_products.set(len(shard.products), str(shard.index))
+            if upgrade:
+                shard.feeds[product] = feed
+            if new:
+                shard.subscriptions.append(sub)
+            if shard.process is None:
+                self._start(shard)
+            else:
+                shard.control.put(sub + (shard.feeds[product],))
+                if new:
+                    self._route(shard.subscriber, *sub)
+        self._broker.log.info('SHARD %s %s %s %s feed on worker %d', product, bar_type, bar_size or '', shard.feeds[product], shard.index)
+
+    def close(self) -> None:
+        """Stop all workers."""
+        self._stopped.set()
+        self._monitor.stop()
+        with self._lock:
+            for shard in self._shards:
+                if shard.process is not None:
+                    shard.control.put(None)
+                    shard.process.join(timeout=5)
+                    if shard.process.is_alive():
+                        shard.process.terminate()
+                    shard.process = None
+                if shard.subscriber is not None:
+                    shard.subscriber.close()
+                    shard.subscriber = None
+            self._subscribers = ()
+
+    def _start(self, shard):
+        """Start `shard`'s worker, have it publish all its subscriptions, and attach to its ring.  Call with the lock held."""
+        broker = self._broker
+        shard.control = self._ctx.Queue()
+        for sub in shard.subscriptions:
+            shard.control.put(sub + (shard.feeds[sub[0]],))
+        shard.process = self._ctx.Process(target=_worker_main, name='GBrokeShard{}'.format(shard.index), daemon=True,
+                                          args=(shard.name, broker.wsurl, broker.posturl, broker.verbose, shard.control, self._events))
+        shard.process.start()
+        shard.subscriber = FeedSubscriber(shard.name, timeout_sec=STARTUP_TIMEOUT_SEC, untrack=False)      # The worker shares our resource tracker
+        for sub in shard.subscriptions:
+            self._route(shard.subscriber, *sub)
+        self._subscribers = tuple(shard.subscriber for shard in self._shards if shard.subscriber is not None)
+
+    def _route(self, subscriber, product, bar_type, bar_size):
+        """Send `subscriber`'s `product` bars to the main broker."""
+        broker = self._broker
+        if bar_type == 'tick':
+            subscriber.register(product, lambda _, tick: broker._call_tick_handlers(product, tick), bar_type='tick')
+        else:
+            subscriber.register(product, lambda _, bar: broker._dispatch_bar(bar_type, bar_size, product, bar), bar_type=bar_type, bar_size=bar_size)
+
+    def _run(self):
+        """Pump thread: read every worker's ring and forwarded order messages into the main broker."""
+        broker = self._broker
+        while not self._stopped.is_set():
+            count = 0
+            for subscriber in self._subscribers:
+                try:
+                    count += subscriber.poll()
+                except Exception:
+                    broker.log.exception('Error handling bars from %s', subscriber.name)
+            try:
+                while True:
+                    msg = self._events.get_nowait()
+                    count += 1
+                    broker._handle_message(msg)
+            except Empty:
+                pass
+            except Exception:
+                broker.log.exception('Error handling forwarded order message')
+            if not count:
+                time.sleep(self._idle_sec)
+
+    def _check(self):
+        """Restart any workers that have died."""
+        for shard in self._shards:
+            if self._stopped.is_set() or shard.process is None or shard.process.is_alive():
+                continue
+            self._broker.log.error('Shard worker %d (%s) died with exit code %s; restarting', shard.index, ', '.join(sorted(shard.products)), shard.process.exitcode)
+            for product in shard.products:
+                self._broker._call_alert_handlers('Disconnect', product)
+            with self._lock:
+                if shard.subscriber is not None:
+                    self._subscribers = tuple(sub for sub in self._subscribers if sub is not shard.subscriber)
+                    shard.subscriber.close()
+                    shard.subscriber = None
+                self._metric_restarts.inc(str(shard.index))
+                self._start(shard)
+            for product in shard.products:
+                self._broker._call_alert_handlers('Reconnect', product)
+
+
+def _worker_main(name, wsurl, posturl, verbose, control, events):
+    """Worker process: run a broker that publishes each subscription read from `control` into ring `name`,
+    and forwards the account's order messages to `events` instead of handling them.  A subscription repeated
+    with a higher feed level only upgrades the feed."""
+    from . import GBroke
+    broker = GBroke(wsurl=wsurl, posturl=posturl, verbose=verbose, history_size=0)
+    handle = broker._handle_message
+
+    def forward(msg):
+        if 'profile_id' in msg:     # Only present on our own orders; the main broker owns those
+            events.put(msg)
+        else:
+            handle(msg)
+
+    broker._handle_message = forward
+    published = set()
+    for product, bar_type, bar_size, feed in iter(control.get, None):
+        if (product, bar_type, bar_size) in published:
+            broker._subscribe(broker.get_instrument(product), feed)
+        elif bar_type == 'tick':
+            broker.publish(product, name, bar_type='tick', feed=feed)
+        else:
+            broker.publish(product, name, bar_type=bar_type, bar_size=bar_size, feed=feed)
+        published.add((product, bar_type, bar_size))
+    broker.disconnect()
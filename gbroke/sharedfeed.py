@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Fan out ticks and bars from one broker process to any number of strategy processes on the same host.
+
+The publisher (:meth:`gbroke.GBroke.publish`) owns the feed, book and accumulators and writes every tick / bar into
+a ring buffer in shared memory.  Each slot carries a sequence number, written last, so a :class:`FeedSubscriber`
+can read slots in place and detect ones overwritten while it was reading (seqlock).  A subscriber that falls more
+than a ring behind skips ahead and counts what it lost in :attr:`FeedSubscriber.dropped`.
+
+Requires NumPy and Python 3.8+.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import defaultdict
+from multiprocessing import shared_memory
+from typing import Callable
+
+import numpy as np
+
+from .history import BAR_FIELDS
+
+MAGIC = b'GBSF'
+VERSION = 1
+KIND_TICK = 1
+KIND_BAR = 2
+#: Default ring size in slots; at ~200 bytes a slot this is 13 MiB
+DEFAULT_SLOTS = 65536
+#: Product IDs longer than this are truncated
+PRODUCT_LEN = 16
+
+HEADER_DTYPE = np.dtype([('magic', 'S4'), ('version', '<u4'), ('slots', '<u8'), ('write_seq', '<u8'), ('pad', 'V40')])
+SLOT_DTYPE = np.dtype([('seq', '<u8'), ('kind', '<u4'), ('pad', '<u4'), ('product', 'S{}'.format(PRODUCT_LEN)), ('bar_size', '<f8'), ('values', '<f8', len(BAR_FIELDS))])
+
+_published = set()      # Names of segments created by this process, whose resource tracker registration we must keep
+
+
+def _views(shm, slots):
+    """:Return: (header record, slots array) viewing the buffer of `shm`."""
+    header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+    ring = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=HEADER_DTYPE.itemsize)
+    return header, ring
+
+
+class FeedPublisher:
+    """Writes ticks and bars into the shared memory segment `name`, creating it (and replacing any stale one).
+
+    Thread safe; all methods may be called from the feed and bar threads.
+    """
+    def __init__(self, name: str, slots: int = DEFAULT_SLOTS):
+        self.name = name
+        self.slots = slots
+        size = HEADER_DTYPE.itemsize + slots * SLOT_DTYPE.itemsize
+        try:
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:     # Left behind by a crashed publisher
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+        _published.add(name)
+        self._header, self._ring = _views(self._shm, slots)
+        self._ring['seq'] = 0
+        self._header['slots'] = slots
+        self._header['version'] = VERSION
+        self._header['write_seq'] = 0
+        self._header['magic'] = MAGIC       # Last, so subscribers never attach to a half-initialized ring
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def publish(self, kind: int, product: str, bar_size: float, bar) -> None:
+        """Append a :class:`gbroke.Bar` `bar` of `kind` (:data:`KIND_TICK` or :data:`KIND_BAR`) for `product`."""
+        with self._lock:
+            seq = self._seq + 1
+            slot = self._ring[seq % self.slots]
+            slot['seq'] = 0             # Readers of this slot now see it as torn until it's complete
+            slot['kind'] = kind
+            slot['product'] = product.encode()
+            slot['bar_size'] = bar_size
+            slot['values'] = bar
+            slot['seq'] = seq
+            self._header['write_seq'] = self._seq = seq
+
+    def on_tick(self, instrument, tick) -> None:
+        """Tick handler that publishes `tick`."""
+        self.publish(KIND_TICK, instrument.symbol, 0.0, tick)
+
+    def bar_handler(self, bar_size: float) -> Callable:
+        """:Return: a bar handler that publishes `bar_size` bars."""
+        return lambda instrument, bar: self.publish(KIND_BAR, instrument.symbol, bar_size, bar)
+
+    def close(self) -> None:
+        """Remove the shared memory segment.  Attached subscribers keep their mapping but see no new data."""
+        self._header = self._ring = None
+        self._shm.close()
+        self._shm.unlink()
+        _published.discard(self.name)
+
+
+class FeedSubscriber:
+    """Reads ticks and bars published by another process into shared memory segment `name`, and calls handlers.
+
+    Handlers get ``(instrument, bar)`` as from :meth:`gbroke.GBroke.register`, with `instrument` an
+    :class:`gbroke.Instrument` that is not attached to any broker.
+    """
+    def __init__(self, name: str, timeout_sec: float = 5.0, untrack: bool = True):
+        """
+        :param timeout_sec: How long to wait for the publisher to create the feed.
+        :param untrack: Stop this process's resource tracker from removing the segment on exit.  Pass False if the
+          publisher is a :mod:`multiprocessing` child of this process, since they share a tracker.
+        """
+        self.name = name
+        deadline = time.monotonic() + timeout_sec
+        while True:
+            try:
+                self._shm = _attach(name, untrack)
+                header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._shm.buf)
+                if header['magic'] == MAGIC:
+                    break
+                self._shm.close()
+            except FileNotFoundError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError('No feed published as {!r}'.format(name))
+            time.sleep(0.05)
+        if header['version'] != VERSION:
+            raise ValueError('Feed {!r} has version {}, expected {}'.format(name, header['version'], VERSION))
+        self.slots = int(header['slots'])
+        self._header, self._ring = _views(self._shm, self.slots)
+        self._next = int(self._header['write_seq']) + 1     # Only new data
+        self._handlers = defaultdict(list)      # Maps (kind, bar_size, product bytes) to list of handlers
+        self._instruments = dict()              # Maps product bytes to Instrument
+        self.dropped = 0                        #: Number of records overwritten before we could read them
+        self._stop = threading.Event()
+
+    def register(self, instrument, on_bar: Callable, bar_type: str = 'time', bar_size: float = 1.0) -> None:
+        """Call ``on_bar(instrument, bar)`` for each published `bar_type` (``'time'`` or ``'tick'``) bar of `instrument` (symbol or :class:`gbroke.Instrument`)."""
+        symbol = getattr(instrument, 'symbol', instrument)
+        if bar_type == 'tick':
+            key = (KIND_TICK, 0.0, symbol.encode())
+        elif bar_type == 'time':
+            key = (KIND_BAR, float(bar_size), symbol.encode())
+        else:
+            raise ValueError("bar_type must be 'time' or 'tick'")
+        self._handlers[key].append(on_bar)
+
+    def poll(self) -> int:
+        """Call handlers for everything published since the last poll.  :Return: the number of records read."""
+        from . import Bar
+        head = int(self._header['write_seq'])
+        if head - self._next >= self.slots:
+            self.dropped += head - self.slots + 1 - self._next
+            self._next = head - self.slots + 1
+        count = 0
+        while self._next <= head:
+            slot = self._ring[self._next % self.slots]
+            kind, bar_size, product = int(slot['kind']), float(slot['bar_size']), bytes(slot['product'])
+            values = slot['values'].tolist()
+            if slot['seq'] != self._next:       # Overwritten while we read it: the writer lapped us
+                self.dropped += 1
+                self._next += 1
+                continue
+            self._next += 1
+            count += 1
+            handlers = self._handlers.get((kind, bar_size, product))
+            if handlers:
+                instrument = self._instrument(product)
+                bar = Bar._make(values)
+                for handler in handlers:
+                    handler(instrument, bar)
+        return count
+
+    def run(self, idle_sec: float = 0.001) -> None:
+        """Poll until :meth:`stop` is called, sleeping `idle_sec` when there is nothing new."""
+        while not self._stop.is_set():
+            if not self.poll():
+                time.sleep(idle_sec)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def close(self) -> None:
+        self._header = self._ring = None
+        self._shm.close()
+
+    def _instrument(self, product):
+        inst = self._instruments.get(product)
+        if inst is None:
+            from . import Instrument, make_contract
+            contract = make_contract(product.decode())
+            contract.m_conId = contract.m_symbol
+            contract.m_multiplier = '1'
+            inst = self._instruments[product] = Instrument(None, contract)
+        return inst
+
+
+def _attach(name, untrack=True):
+    """:Return: existing SharedMemory `name`, without the resource tracker unlinking it when this process exits."""
+    if not untrack:
+        return shared_memory.SharedMemory(name)
+    try:
+        return shared_memory.SharedMemory(name, track=False)        # Python 3.13+
+    except TypeError:
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name)
+        if name not in _published:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Pull-based streams of bars, ticks and order events.
+
+:meth:`gbroke.GBroke.stream` and :meth:`gbroke.GBroke.order_events` return a :class:`Stream`: a bounded buffer filled
+by the broker's threads.  Iterate over it one event at a time, or call :meth:`Stream.batch` to get everything since
+your last call in one list (or :meth:`Stream.batch_arrays` for NumPy arrays), paying the Python overhead once per burst.
+If you fall more than `maxsize` events behind, the oldest are dropped and counted in :attr:`Stream.dropped`.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from . import history
+
+
+class Stream:
+    """Bounded, thread-safe buffer of events, read by one consumer.  Iterating blocks until the stream is closed.
+
+    `on_close` is called once when it is closed, and `on_drop` each time an event is dropped.
+    """
+    def __init__(self, maxsize: int = 4096, on_close: Optional[Callable[[], None]] = None, on_drop: Optional[Callable[[], None]] = None):
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self.maxsize = maxsize
+        self.dropped = 0            #: Events discarded because the buffer was full
+        self.closed = False
+        self._items = deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._on_close = on_close
+        self._on_drop = on_drop
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item) -> None:
+        """Add `item`, dropping the oldest if full.  Called by the producer."""
+        with self._cond:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                if self._on_drop is not None:
+                    self._on_drop()
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None):
+        """:Return: the oldest event, waiting up to `timeout` sec (forever if None) for one.
+
+        :raises TimeoutError: If none arrived in time.
+        :raises EOFError: If the stream is closed and empty.
+        """
+        with self._cond:
+            if not self._wait(timeout):
+                raise EOFError('Stream closed') if self.closed else TimeoutError()
+            return self._items.popleft()
+
+    def batch(self, timeout: Optional[float] = 0.0, max_items: Optional[int] = None) -> List:
+        """:Return: a list of all buffered events (at most `max_items`), oldest first, waiting up to `timeout` sec
+        (forever if None) for at least one.  Empty if none arrived in time or the stream is closed."""
+        with self._cond:
+            if not self._wait(timeout):
+                return []
+            items = self._items
+            if max_items is None or max_items >= len(items):
+                self._items = deque()
+                return list(items)
+            return [items.popleft() for _ in range(max_items)]
+
+    def batch_arrays(self, timeout: Optional[float] = 0.0, max_items: Optional[int] = None) -> history.Bars:
+        """:Return: :meth:`batch` of :class:`gbroke.Bar`\\ s as :class:`~gbroke.history.Bars` of NumPy arrays, one element per bar."""
+        import numpy as np
+        bars = self.batch(timeout, max_items)
+        data = np.array(bars, dtype=float).reshape(len(bars), len(history.BAR_FIELDS)).T
+        return history.Bars._make(data)
+
+    def close(self) -> None:
+        """Stop the producer and wake the consumer.  Events already buffered can still be read."""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+        if self._on_close is not None:
+            self._on_close()
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except EOFError:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _wait(self, timeout):
+        """Wait for an event; call with the lock held.  :Return: True iff there is one."""
+        if timeout is None:
+            while not self._items and not self.closed:
+                self._cond.wait()
+        elif not self._items and timeout > 0:
+            deadline = time.monotonic() + timeout
+            while not self._items and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return bool(self._items)
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Time-indexed access to recorded ticks: range queries and resampling to bars.
+
+Built on the files written by :mod:`gbroke.recorder`.  Each file gets a sparse index of every
+:data:`INDEX_STRIDE`-th record time, so a range lookup binary searches the small index and then a single
+stride-sized slice of the memory-mapped records, instead of touching the whole file.
+
+Requires NumPy.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import math
+from datetime import datetime
+from typing import Optional, Union
+
+import numpy as np
+
+from . import Bar
+from .recorder import DTYPES, FIELD_IDS, KIND_TICKS, list_recordings, read_header, read_records
+
+#: Number of records between entries in each file's sparse time index
+INDEX_STRIDE = 4096
+#: NumPy dtype of resampled bars; one field per :class:`~gbroke.Bar` field, so ``Bar._make(row)`` works.
+BAR_DTYPE = np.dtype([(field, '<f8') for field in Bar._fields])
+
+Time = Union[float, datetime]
+
+
+class _FileIndex:
+    """Records and sparse time index for one recording file."""
+    def __init__(self, path):
+        self.path = path
+        self.header = read_header(path)
+        self.records = read_records(path)
+        self.times = self.records['time']
+        self.sparse = np.array(self.times[::INDEX_STRIDE])     # Small copy; the records stay mapped
+
+    @property
+    def first_time(self):
+        return self.times[0] if len(self.times) else math.inf
+
+    @property
+    def last_time(self):
+        return self.times[-1] if len(self.times) else -math.inf
+
+    def search(self, t: float, side: str = 'left') -> int:
+        """:Return: the insertion index of time `t` in this file's records, like :func:`numpy.searchsorted`."""
+        k = int(np.searchsorted(self.sparse, t, side))
+        lo = max(k - 1, 0) * INDEX_STRIDE
+        hi = min(k * INDEX_STRIDE, len(self.times))
+        return lo + int(np.searchsorted(self.times[lo:hi], t, side))
+
+
+class TickStore:
+    """Range queries and bar resampling over the recordings of one instrument in a directory.
+
+    Files are indexed lazily and the index is reused until :meth:`refresh` notices a file has grown.
+    """
+    def __init__(self, directory: str, name: str, kind: int = KIND_TICKS):
+        """
+        :param directory: Directory containing recordings.
+        :param name: Instrument id the recordings were made for (the filename prefix).
+        :param kind: :data:`~gbroke.recorder.KIND_TICKS` or :data:`~gbroke.recorder.KIND_QUOTES`.
+        """
+        self.directory = directory
+        self.name = name
+        self.kind = kind
+        self._files = []            # _FileIndex objects in time order
+        self.refresh()
+
+    def refresh(self) -> None:
+        """Pick up new recordings, and re-index any that have been flushed since they were last indexed."""
+        old = {index.path: index for index in self._files}
+        files = []
+        for path in list_recordings(self.directory, self.name, self.kind):
+            index = old.get(path)
+            if index is None or read_header(path).count != index.header.count:
+                index = _FileIndex(path)
+            files.append(index)
+        self._files = files
+
+    @property
+    def start_time(self) -> float:
+        """:Return: the time of the first recorded record, or NaN if there are none."""
+        return next((index.first_time for index in self._files if len(index.times)), float('NaN'))
+
+    @property
+    def end_time(self) -> float:
+        """:Return: the time of the last recorded record, or NaN if there are none."""
+        return next((index.last_time for index in reversed(self._files) if len(index.times)), float('NaN'))
+
+    def range(self, start: Optional[Time] = None, end: Optional[Time] = None) -> np.ndarray:
+        """:Return: a structured array of the records with ``start <= time < end``.
+
+        If the records all come from one file the result is a view of the mapped file; otherwise it is a copy.
+        """
+        start = -math.inf if start is None else _epoch(start)
+        end = math.inf if end is None else _epoch(end)
+        parts = []
+        for index in self._files:
+            if index.last_time < start or index.first_time >= end:
+                continue
+            parts.append(index.records[index.search(start, 'left'):index.search(end, 'left')])
+        if not parts:
+            return np.empty(0, dtype=DTYPES[self.kind])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def resample(self, bar_size: float, start: Optional[Time] = None, end: Optional[Time] = None) -> np.ndarray:
+        """:Return: a :data:`BAR_DTYPE` array of bars of `bar_size` seconds between `start` and `end`.
+
+        Bars end on multiples of `bar_size` since the epoch, and include ticks with ``bar_end - bar_size <= time < bar_end``.
+        Values are exactly what a fresh :class:`~gbroke.Ticumulator` would give if it were fed the ticks
+        from `start` onward and had :meth:`~gbroke.Ticumulator.bar` called at each bar end (with `time` set to the bar end).
+        Only ticks recordings can be resampled.
+        """
+        if self.kind != KIND_TICKS:
+            raise ValueError('Can only resample ticks recordings')
+        start = self.start_time if start is None else _epoch(start)
+        end = self.end_time + bar_size if end is None else _epoch(end)
+        if not (math.isfinite(start) and math.isfinite(end)):
+            return np.empty(0, dtype=BAR_DTYPE)
+        ends = np.arange(math.floor(start / bar_size) + 1, math.floor(end / bar_size) + 1) * bar_size
+        return resample_ticks(self.range(start, ends[-1] if len(ends) else start), ends)
+
+
+def resample_ticks(ticks: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """:Return: a :data:`BAR_DTYPE` array with one bar for each bar end time in `ends`, made from time-ordered `ticks` records.
+
+    Each bar includes the ticks before its end time and not in an earlier bar.
+    This is the vectorized equivalent of feeding `ticks` to a fresh :class:`~gbroke.Ticumulator` and calling
+    :meth:`~gbroke.Ticumulator.bar` at each time in `ends`.
+    """
+    ends = np.asarray(ends, dtype='f8')
+    nbars = len(ends)
+    bars = np.empty(nbars, dtype=BAR_DTYPE)
+    bars['time'] = ends
+    field, value = ticks['field'], ticks['value']
+    stops = np.searchsorted(ticks['time'], ends, 'left')       # Ticks [stops[i-1], stops[i]) go in bar i
+
+    def state(what, initial=float('NaN')):
+        """:Return: the value of input `what` as of the end of each bar."""
+        pos = np.flatnonzero(field == FIELD_IDS[what])
+        latest = np.searchsorted(pos, stops, 'left') - 1
+        return np.where(latest >= 0, value[pos[np.maximum(latest, 0)]] if len(pos) else initial, initial)
+
+    for what in ('bid', 'bidsize', 'ask', 'asksize', 'last', 'lastsize', 'lasttime', 'bid_depth', 'ask_depth'):
+        bars[what] = state(what)
+    bars['open_interest'] = state('open_interest', 0.0)
+    bars['close'] = bars['last']
+
+    # Trades: OHLC over 'last' inputs
+    last_pos = np.flatnonzero(field == FIELD_IDS['last'])
+    prices = value[last_pos]
+    trade_bar = np.searchsorted(stops, last_pos, 'right')     # Bar each trade falls in (== nbars if after the last bar)
+    in_range = trade_bar < nbars
+    prev_close = np.concatenate(([float('NaN')], bars['close'][:-1]))
+    first_trade = np.full(nbars, float('NaN'))
+    traded_bars, first_idx = np.unique(trade_bar[in_range], return_index=True)      # trade_bar is sorted, so these are the earliest
+    first_trade[traded_bars] = prices[in_range][first_idx]
+    bars['open'] = np.where(np.isnan(prev_close), first_trade, prev_close)
+    high, low = prev_close.copy(), prev_close.copy()
+    np.fmax.at(high, trade_bar[in_range], prices[in_range])
+    np.fmin.at(low, trade_bar[in_range], prices[in_range])
+    bars['high'], bars['low'] = high, low
+
+    # Volume and VWAP over 'lastsize' inputs, each priced at the 'last' in effect when it arrived
+    size_pos = np.flatnonzero(field == FIELD_IDS['lastsize'])
+    sizes = value[size_pos]
+    size_bar = np.searchsorted(stops, size_pos, 'right')
+    price_idx = np.searchsorted(last_pos, size_pos, 'left') - 1
+    size_prices = np.where(price_idx >= 0, prices[np.maximum(price_idx, 0)] if len(prices) else float('NaN'), float('NaN'))
+    in_range = size_bar < nbars
+    volume = np.bincount(size_bar[in_range], weights=sizes[in_range], minlength=nbars)[:nbars]
+    notional = np.bincount(size_bar[in_range], weights=(size_prices * sizes)[in_range], minlength=nbars)[:nbars]
+    bars['volume'] = volume
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bars['vwap'] = np.where(volume != 0, notional / np.where(volume != 0, volume, 1), 0.0)
+    return bars
+
+
+def _epoch(t: Time) -> float:
+    """:Return: `t` as Unix time (float seconds since epoch), converting from :class:`datetime` if necessary."""
+    return t.timestamp() if isinstance(t, datetime) else float(t)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Stop, stop-limit, trailing stop and bracket orders, triggered locally from the trade stream.
+
+A :class:`Trigger` rests here, not at the exchange, until the last trade price reaches it; then its child order (market,
+or limit if it has a `limit`) goes out through :meth:`gbroke.GBroke.order`.  A bracket sends its entry order right
+away and arms a take-profit target and a stop for the filled quantity once the entry is done; the two are one-cancels-
+other.
+
+Each instrument keeps its triggers in two sorted lists, one for triggers that fire when the price rises to them and one
+for those that fire when it falls, each ordered so the nearest trigger is last.  A trade only compares against those
+two, so a tick costs the same with thousands of triggers resting as with one; firing or cancelling is a binary search
+and a list delete.  Trailing stops are also sorted by their high (or low) water mark, so a trade moves only the trailing
+stops whose mark it actually passes.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+import logging
+import math
+import threading
+from bisect import bisect_left, insort
+from queue import Queue
+from typing import Callable, List, Tuple
+
+#: Trigger kinds
+KINDS = ('stop', 'trailing', 'target')
+
+
+class Trigger:
+    """A local stop, trailing stop, or bracket target.  Not created by user code directly.
+
+    `quantity` is positive for buy, negative for sell.  `price` is the trigger price (for a trailing stop, its current
+    value, `trail` from the best price since it was armed).  `limit` is the child order's limit price, 0 for market.
+    `order` is the child :class:`gbroke.Order` once fired (None if it was rejected or hasn't gone out yet).
+    """
+    __slots__ = ('id', 'instrument', 'kind', 'quantity', 'price', 'limit', 'trail', 'mark', 'rising', 'oco', 'active', 'fired', 'order')
+
+    def __init__(self, id_, instrument, kind, quantity, price, limit=0.0, trail=0.0):
+        self.id = id_
+        self.instrument = instrument
+        self.kind = kind
+        self.quantity = quantity
+        self.price = price
+        self.limit = limit
+        self.trail = trail
+        self.mark = price + trail if quantity < 0 else price - trail      # Trailing stops: best price seen
+        self.rising = (quantity > 0) != (kind == 'target')       # Fires when the price rises to `price` (buy stops, sell targets)
+        self.oco = ()           # Triggers cancelled when this one fires
+        self.active = False     # In the indexes
+        self.fired = False
+        self.order = None
+
+    def __repr__(self):
+        return str(self)
+
+    def __str__(self):
+        return 'Trigger<{} {} {} {} @ {}{}{} #{}>'.format(self.instrument.id if self.instrument is not None else None, self.kind, self.quantity,
+            'rising' if self.rising else 'falling', self.price, ' limit {}'.format(self.limit) if self.limit else '',
+            ' fired' if self.fired else '' if self.active else ' inactive', self.id)
+
+
+class _Index:
+    """Resting triggers for one instrument.  Keys are ``(sort price, trigger id)``, ascending, nearest last."""
+    __slots__ = ('rising', 'falling', 'peaks', 'troughs', 'triggers')
+
+    def __init__(self):
+        self.rising = []        # (-price, id): lowest price last
+        self.falling = []       # (price, id): highest price last
+        self.peaks = []         # Trailing sells (-mark, id): lowest high water mark last
+        self.troughs = []       # Trailing buys (mark, id): highest low water mark last
+        self.triggers = dict()  # Maps id to Trigger
+
+    def add(self, trigger):
+        self.triggers[trigger.id] = trigger
+        insort(*self._key(trigger))
+        if trigger.kind == 'trailing':
+            insort(*self._mark_key(trigger))
+
+    def remove(self, trigger):
+        del self.triggers[trigger.id]
+        _remove(*self._key(trigger))
+        if trigger.kind == 'trailing':
+            _remove(*self._mark_key(trigger))
+
+    def _key(self, trigger):
+        return (self.rising, (-trigger.price, trigger.id)) if trigger.rising else (self.falling, (trigger.price, trigger.id))
+
+    def _mark_key(self, trigger):
+        return (self.troughs, (trigger.mark, trigger.id)) if trigger.rising else (self.peaks, (-trigger.mark, trigger.id))
+
+    def trail(self, price):
+        """Move the trailing stops whose water mark `price` passes."""
+        peaks, troughs, triggers = self.peaks, self.troughs, self.triggers
+        if peaks and -peaks[-1][0] < price:
+            moved = []
+            while peaks and -peaks[-1][0] < price:
+                moved.append(triggers[peaks.pop()[1]])
+            for trigger in moved:       # After the loop, since their new marks are the lowest
+                _remove(*self._key(trigger))
+                trigger.mark, trigger.price = price, price - trigger.trail
+                insort(*self._key(trigger))
+                insort(*self._mark_key(trigger))
+        if troughs and troughs[-1][0] > price:
+            moved = []
+            while troughs and troughs[-1][0] > price:
+                moved.append(triggers[troughs.pop()[1]])
+            for trigger in moved:
+                _remove(*self._key(trigger))
+                trigger.mark, trigger.price = price, price + trigger.trail
+                insort(*self._key(trigger))
+                insort(*self._mark_key(trigger))
+
+    def due(self, price):
+        """:Return: the triggers `price` reaches, nearest first.  Does not remove them."""
+        rising, falling, triggers = self.rising, self.falling, self.triggers
+        if rising and -rising[-1][0] <= price:
+            due = [triggers[key[1]] for key in itertools.takewhile(lambda key: -key[0] <= price, reversed(rising))]
+        else:
+            due = []
+        if falling and falling[-1][0] >= price:
+            due.extend(triggers[key[1]] for key in itertools.takewhile(lambda key: key[0] >= price, reversed(falling)))
+        return due
+
+
+def _remove(keys, key):
+    del keys[bisect_left(keys, key)]
+
+
+class TriggerEngine:
+    """Holds :class:`Trigger`\\ s and fires them on trade prices passed to :meth:`on_price`."""
+    def __init__(self, order: Callable, log: logging.Logger = None, threaded: bool = True):
+        """
+        :param order: Sends a child order: ``order(instrument, quantity, limit=limit)``, returning an Order or None.
+        :param threaded: Send child orders from a background thread, so a REST round trip never holds up the feed.
+          If False, :meth:`on_price` sends them itself.
+        """
+        self._order = order
+        self.log = log or logging.getLogger(__name__)
+        self._indexes = dict()      # Maps instrument ID to _Index
+        self._pending = dict()      # Maps live entry order record to the (target, stop) it arms when done
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._queue = None
+        if threaded:
+            self._queue = Queue()
+            threading.Thread(target=self._run, name='Triggers', daemon=True).start()
+
+    def stop(self, instrument, quantity: float, price: float, limit: float = 0.0) -> Trigger:
+        """:Return: an armed stop (or with `limit`, stop-limit) trigger: buys fire at or above `price`, sells at or below."""
+        return self.add(self._new(instrument, 'stop', quantity, price, limit))
+
+    def trailing_stop(self, instrument, quantity: float, trail: float, price: float) -> Trigger:
+        """:Return: an armed trailing stop that fires on a move of `trail` against the best price since `price`
+        (the current price): a sell when the price falls `trail` from its high, a buy when it rises `trail` from its low."""
+        return self.add(self._new(instrument, 'trailing', quantity, price - trail if quantity < 0 else price + trail, trail=trail))
+
+    def bracket(self, entry, quantity: float, target: float, stop: float, stop_limit: float = 0.0) -> Tuple[Trigger, Trigger]:
+        """Arm a one-cancels-other take-profit limit order at `target` and a stop at `stop`, closing whatever `entry`
+        (the live record of an order for `quantity`) fills, once it is done.
+
+        :Return: ``(target trigger, stop trigger)``, inactive until then.
+        """
+        quantity = -quantity
+        children = (self._new(entry.instrument, 'target', quantity, target, target), self._new(entry.instrument, 'stop', quantity, stop, stop_limit))
+        children[0].oco, children[1].oco = (children[1],), (children[0],)
+        with self._lock:
+            self._pending[entry] = children
+        return children
+
+    def add(self, trigger: Trigger) -> Trigger:
+        """Arm `trigger`.  :Return: it."""
+        with self._lock:
+            index = self._indexes.get(trigger.instrument.id)
+            if index is None:
+                index = self._indexes[trigger.instrument.id] = _Index()
+            index.add(trigger)
+            trigger.active = True
+        self.log.info('TRIGGER %s', trigger)
+        return trigger
+
+    def cancel(self, trigger: Trigger) -> bool:
+        """Disarm `trigger` (and any bracket it is waiting on).  :Return: True if it hadn't fired or been cancelled."""
+        with self._lock:
+            for entry, children in tuple(self._pending.items()):
+                if trigger in children:
+                    del self._pending[entry]
+                    return True
+            if not trigger.active:
+                return False
+            self._indexes[trigger.instrument.id].remove(trigger)
+            trigger.active = False
+        self.log.info('TRIGGER CANCEL %s', trigger)
+        return True
+
+    def cancel_all(self, instrument=None) -> int:
+        """Disarm all triggers, or those for `instrument`.  :Return: how many."""
+        with self._lock:
+            pending = [child for children in self._pending.values() for child in children[:1] if instrument is None or child.instrument.id == instrument.id]
+            armed = [trigger for inst_id, index in self._indexes.items() if instrument is None or inst_id == instrument.id for trigger in index.triggers.values()]
+        return sum(self.cancel(trigger) for trigger in pending + armed)
+
+    def triggers(self, instrument=None) -> List[Trigger]:
+        """:Return: the armed triggers, or those for `instrument`."""
+        with self._lock:
+            return [trigger for inst_id, index in self._indexes.items() if instrument is None or inst_id == instrument.id for trigger in index.triggers.values()]
+
+    def queue_depth(self) -> int:
+        """:Return: the number of fired triggers waiting for the background thread to send their orders."""
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def on_price(self, instrument_id, price: float) -> None:
+        """A trade at `price`: move trailing stops and fire the triggers it reaches."""
+        index = self._indexes.get(instrument_id)
+        if index is None or price != price:         # NaN
+            return
+        with self._lock:
+            if index.peaks or index.troughs:
+                index.trail(price)
+            due = index.due(price)
+            for trigger in due:
+                if trigger.active:      # Not cancelled by an earlier one's OCO
+                    self._fire(trigger)
+        for trigger in due:
+            if trigger.fired:
+                if self._queue is not None:
+                    self._queue.put(trigger)
+                else:
+                    self._send(trigger)
+
+    def on_tick(self, instrument, view) -> None:
+        """Tick handler (for ticks with a new last price) that calls :meth:`on_price`."""
+        self.on_price(instrument.id, view.last)
+
+    def on_order(self, record) -> None:
+        """Order listener: arm bracket children when their entry order is done."""
+        if record not in self._pending or record.open:
+            return
+        with self._lock:
+            children = self._pending.pop(record, None)
+        if children is not None and record.filled:
+            for child in children:
+                child.quantity = math.copysign(abs(record.filled), child.quantity)
+                self.add(child)
+
+    def _new(self, instrument, kind, quantity, price, limit=0.0, trail=0.0):
+        return Trigger(next(self._ids), instrument, kind, quantity, price, limit, trail)
+
+    def _fire(self, trigger):
+        """Take `trigger` and its OCO siblings out of the indexes.  Call with the lock held."""
+        index = self._indexes[trigger.instrument.id]
+        index.remove(trigger)
+        trigger.active, trigger.fired = False, True
+        for other in trigger.oco:
+            if other.active:
+                index.remove(other)
+                other.active = False
+
+    def _send(self, trigger):
+        self.log.info('TRIGGER FIRED %s', trigger)
+        try:
+            trigger.order = self._order(trigger.instrument, trigger.quantity, limit=trigger.limit)
+        except Exception:
+            self.log.exception('Error sending order for %s', trigger)
+
+    def _run(self):
+        for trigger in iter(self._queue.get, None):
+            self._send(trigger)
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Detect stalled or dropped market data feeds and reconnect them.
+
+Every feed subscribes to the exchange's ``heartbeat`` channel, so even a product that isn't trading gets a message
+every second.  The :class:`FeedWatchdog` checks each product's feed client a few times a second; one that has had
+no message for `stall_sec`, or whose socket closed, is declared down: handlers get a ``'Disconnect'`` alert, and the
+watchdog replaces the client with a new one, which resubscribes and so gets a fresh book (a level 3 snapshot or a
+level 2 ``snapshot`` message).  If that doesn't come up either, it tries again after an exponentially growing,
+jittered delay, so many brokers (or products) that lost the exchange at once don't all hammer it in lock step.
+When the first message arrives, handlers get a ``'Reconnect'`` alert and the outage duration goes into the
+``gbroke_feed_recovery_seconds`` histogram.
+"""
+
+# Copyright (C) 2016  Doctor J
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import threading
+import time
+
+
+class _Outage:
+    __slots__ = ('start', 'attempts', 'next_try')
+
+    def __init__(self, start):
+        self.start = start          # When it was detected (monotonic sec)
+        self.attempts = 0           # Reconnects tried
+        self.next_try = start       # Earliest time for the next reconnect
+
+
+class FeedWatchdog:
+    """Reconnects the feeds of `broker` (a :class:`gbroke.GBroke`) that stall or drop."""
+    def __init__(self, broker, stall_sec: float = 5.0, check_sec: float = 0.25, backoff_sec: float = 0.5,
+                 max_backoff_sec: float = 30.0, start: bool = True):
+        """
+        :param stall_sec: A feed with no messages for this long is down; also how long a new connection gets to produce one.
+        :param check_sec: How often to check.
+        :param backoff_sec: Delay before the second reconnect attempt (the first is immediate); doubles with each attempt.
+        :param max_backoff_sec: Longest delay between attempts.
+        :param start: Start checking in a background thread.  If False, call :meth:`check` yourself.
+        """
+        self._broker = broker
+        self.stall_sec = stall_sec
+        self.backoff_sec = backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self._outages = dict()      # Maps product to _Outage
+        self._lock = threading.Lock()
+        self._metric_recovery = broker.metrics.histogram('gbroke_feed_recovery_seconds', 'Time from detecting a feed outage to the first message after reconnecting', ('product',),
+                                                         buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+        self._metric_reconnects = broker.metrics.counter('gbroke_feed_reconnects_total', 'Feed reconnect attempts', ('product',))
+        self._task = None
+        if start:
+            from . import RecurringTask
+            self._task = RecurringTask(self.check, interval_sec=check_sec, init_sec=check_sec, daemon=True)
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.stop()
+
+    def backoff(self, attempts: int) -> float:
+        """:Return: the jittered delay (sec) after reconnect attempt number `attempts` before the next."""
+        return min(self.max_backoff_sec, self.backoff_sec * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+    def check(self, now: float = None) -> None:
+        """Declare stalled or closed feeds down, and reconnect down ones that are due for another try."""
+        now = time.monotonic() if now is None else now
+        broker = self._broker
+        for product, (_, conn) in tuple(broker._feeds.items()):
+            with self._lock:
+                outage = self._outages.get(product)
+                if outage is None:
+                    if conn.live and not conn.closed and now - conn.last_message < self.stall_sec:
+                        continue
+                    if not conn.live and not conn.closed and now - conn.started < self.stall_sec:
+                        continue        # Still connecting
+                    outage = self._outages[product] = _Outage(now)
+                    reason = 'closed' if conn.closed else 'stalled for {:.1f} sec'.format(now - conn.last_message)
+                elif now < outage.next_try or (not conn.closed and now - conn.started < self.stall_sec):
+                    continue        # Waiting out the backoff, or the last attempt is still connecting
+                else:
+                    reason = None
+                outage.attempts += 1
+                outage.next_try = now + self.backoff(outage.attempts)
+            if reason is not None:
+                broker.log.warning('FEED %s down: %s', product, reason)
+                broker.connected = False
+                broker._call_alert_handlers('Disconnect', product)
+            broker.log.info('FEED %s reconnect attempt %d', product, outage.attempts)
+            self._metric_reconnects.inc(product)
+            try:
+                broker._reconnect_feed(product)
+            except Exception:
+                broker.log.exception('Error reconnecting %s feed', product)
+
+    def up(self, product: str, now: float = None) -> None:
+        """The feed for `product` got its first message since connecting.  Called on the feed thread."""
+        with self._lock:
+            outage = self._outages.pop(product, None)
+        if outage is not None:
+            recovery = (time.monotonic() if now is None else now) - outage.start
+            self._metric_recovery.observe(recovery, product)
+            self._broker.log.info('FEED %s recovered after %.1f sec, %d attempts', product, recovery, outage.attempts)
+            self._broker._call_alert_handlers('Reconnect', product)
@@ -27,7 +27,7 @@ def find_version(*file_paths):
 
 setup(
     name='GBroke',
-    version=find_version('gbroke.py'),
+    version=find_version('gbroke', '__init__.py'),
     description='Interactive Brokers for Humans',
     long_description=long_description,
     url='https://github.com/kanghua309/gdaxbroke',
@@ -43,7 +43,7 @@ setup(
         'Programming Language :: Python :: 3.5',
     ],
     keywords='interactive brokers tws api finance trading',
-    py_modules=['gbroke'],
+    packages=['gbroke'],
     install_requires=['pytz', 'ciso8601'],
     dependency_links=[
         'git+git://github.com/kanghua309/gdax-python/archive/master.zip#egg=private-gdax',
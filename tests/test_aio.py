@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+
+from gbroke.aio import AsyncGBroke
+
+
+class TestAsyncGBroke(unittest.TestCase):
+    class Broker:
+        """Just enough broker to drive AsyncGBroke from a background thread."""
+        def __init__(self):
+            self._orders = {}
+            self._order_listeners = []
+            self.handlers = []
+
+        def get_instrument(self, instrument):
+            return instrument
+
+        def register(self, instrument, on_bar=None, on_order=None, on_alert=None, bar_type='time', bar_size=1.0, warmup=0, feed='full'):
+            self.handlers.append(on_bar)
+            return instrument
+
+        def unregister(self, instrument, on_bar=None, bar_type='time', bar_size=1.0):
+            self.handlers.remove(on_bar)
+
+        def order(self, instrument, quantity, limit=0.0, stop=0.0, target=0.0):
+            from gbroke import _OrderRecord
+            order = self._orders['1'] = _OrderRecord('1', instrument, limit, quantity, 0, True, False)
+            return order.snapshot()
+
+    def test_needs_a_loop(self):
+        with self.assertRaises(RuntimeError):
+            AsyncGBroke(self.Broker())      # No running loop, and none given
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertIs(AsyncGBroke(self.Broker(), loop)._loop, loop)
+
+    def test_bars_and_wait(self):
+        async def main():
+            broker = self.Broker()
+            abroker = AsyncGBroke(broker)
+
+            def feed():
+                for i in range(5):
+                    for handler in tuple(broker.handlers):
+                        handler('BTC-USD', i)
+                live = broker._orders['1']
+                live.filled, live.open = 2, False
+                for listener in broker._order_listeners:
+                    listener(live)
+
+            order = await abroker.order('BTC-USD', 2)
+            waiter = asyncio.ensure_future(abroker.wait(order, timeout=5))
+            stream = abroker.bars('BTC-USD', maxsize=3)
+            first = asyncio.ensure_future(stream.__anext__())
+            while not broker.handlers:
+                await asyncio.sleep(0.001)
+            feed()      # Handlers hop onto the loop, so all five land before the pending read runs
+            got = [await first, await stream.__anext__(), await stream.__anext__()]
+            self.assertEqual(got, [2, 3, 4])        # Oldest dropped when the buffer filled
+            await stream.aclose()
+            self.assertEqual(broker.handlers, [])
+            done = await waiter
+            self.assertEqual(done.filled, 2)
+            self.assertFalse(done.open)
+            abroker.close()
+
+        asyncio.run(main())
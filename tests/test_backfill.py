@@ -0,0 +1,51 @@
+import calendar
+import os
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+from gbroke.backfill import Backfiller, best_granularity, CANDLE_DTYPE, candles_to_bars, DAY, PAGE_CANDLES
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.requests = []
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def get_rates(self, product_id, start, end, granularity):
+        """Fake endpoint: a candle every `granularity` from start to end inclusive, newest first."""
+        self.requests.append((start, end))
+        lo, hi = (calendar.timegm(datetime.strptime(t, '%Y-%m-%dT%H:%M:%SZ').timetuple()) for t in (start, end))
+        assert (hi - lo) / granularity < PAGE_CANDLES
+        return [[t, 1.0, 3.0, 2.0, 2.5, 1.0] for t in np.arange(hi, lo - 1, -granularity).tolist()]
+
+    def test_candles_and_cache(self):
+        bf = Backfiller(self.get_rates, self._tmp.name, rate=1000)
+        start = 1500000000 - 1500000000 % DAY
+        candles = bf.candles('BTC-USD', start + 3600, start + DAY + 7200, 300)
+        self.assertEqual(len(candles), (DAY + 3600) // 300)
+        self.assertTrue((np.diff(candles['time']) == 300).all())
+        self.assertEqual(candles['time'][0], start + 3600)
+        self.assertFalse(os.path.exists(bf._path('BTC-USD', 300, start)))      # Neither day fetched in full
+        bf.candles('BTC-USD', start, start + DAY, 300)
+        self.assertTrue(os.path.exists(bf._path('BTC-USD', 300, start)))
+        nreq = len(self.requests)
+        again = bf.candles('BTC-USD', start + 600, start + 1200, 300)
+        self.assertEqual(len(self.requests), nreq)      # Served from disk
+        self.assertEqual(again['time'].tolist(), [start + 600, start + 900])
+
+    def test_candles_to_bars(self):
+        candles = np.array([(0, 1, 4, 2, 3, 1), (60, 2, 5, 3, 4, 1), (180, 3, 3, 3, 3, 2)], dtype=CANDLE_DTYPE)
+        bars = list(candles_to_bars(candles, 60, 120))
+        self.assertEqual([b[0] for b in bars], [120.0, 240.0])
+        self.assertEqual(bars[0][8:12], (2.0, 5.0, 1.0, 4.0))
+        self.assertEqual(bars[1][8:12], (4.0, 4.0, 3.0, 3.0))     # Opens at previous close, high includes it
+        self.assertEqual(bars[1][13], 2.0)
+        self.assertEqual(best_granularity(600), 300)
+        with self.assertRaises(ValueError):
+            best_granularity(1)
@@ -0,0 +1,103 @@
+import unittest
+
+from gbroke import Ticumulator
+from gbroke.backtest import BacktestBroker
+from gbroke.products import ProductRegistry
+from tests.test_products import PRODUCTS
+
+FIELDS = {what: i for i, what in enumerate(Ticumulator.INPUT_FIELDS)}
+
+
+def quote(t, bid, ask, size=1.0):
+    return [(t, FIELDS['bid'], bid), (t, FIELDS['bidsize'], size), (t, FIELDS['ask'], ask), (t, FIELDS['asksize'], size)]
+
+
+def trade(t, price, size):
+    return [(t, FIELDS['last'], price), (t, FIELDS['lastsize'], size), (t, FIELDS['lasttime'], t)]
+
+
+class TestBacktest(unittest.TestCase):
+    def setUp(self):
+        self.broker = BacktestBroker({'USD': 1000.0}, products=ProductRegistry(lambda: PRODUCTS).load(), latency_sec=0.5, history_size=0)
+        self.broker.log.disabled = True
+
+    def test_bars_on_virtual_clock(self):
+        bars, ticks = [], []
+        inst = self.broker.register('BTC-USD', lambda inst, bar: bars.append(bar), bar_size=60)
+        self.broker.register(inst, lambda inst, bar: ticks.append(bar), bar_type='tick')
+        records = []
+        for i in range(130):
+            records += quote(1000.0 + i, 99.0 + i, 101.0 + i) + trade(1000.0 + i + 0.5, 100.0 + i, 0.1)
+        self.broker.replay(inst, records)
+        self.assertEqual(self.broker.run(end=1200.0), 130 * 7)
+        self.assertEqual([bar.time for bar in bars], [1020.0, 1080.0, 1140.0, 1200.0])
+        self.assertEqual((bars[0].open, bars[0].close, bars[1].open, bars[1].close), (100.0, 119.0, 119.0, 179.0))
+        self.assertEqual(len(ticks), 260)       # One per message
+        self.assertEqual((ticks[0].time, ticks[0].bid, ticks[1].last), (1000.0, 99.0, 100.0))
+
+    def test_bar_sizes(self):
+        tens, sixties = [], []
+        inst = self.broker.register('BTC-USD', lambda inst, bar: tens.append(bar), bar_size=10)
+        self.broker.register(inst, lambda inst, bar: tens.append(bar), bar_size=10)
+        self.broker.register(inst, lambda inst, bar: sixties.append(bar), bar_size=60)
+        records = []
+        for i in range(120):
+            records += trade(1000.0 + i + 0.5, 100.0 + i, 1.0)
+        self.broker.replay(inst, records)
+        self.broker.run(end=1120.0)
+        self.assertEqual([bar.time for bar in tens[::2]], [1010.0 + 10 * i for i in range(12)])
+        self.assertEqual(tens[::2], tens[1::2])         # Each bar once, to both handlers
+        self.assertEqual([(bar.open, bar.close, bar.volume) for bar in tens[2:4:2]], [(109.0, 119.0, 10.0)])
+        self.assertEqual([(bar.time, bar.open, bar.close, bar.volume) for bar in sixties], [(1020.0, 100.0, 119.0, 20.0), (1080.0, 119.0, 179.0, 60.0)])
+
+    def test_strategy_orders(self):
+        updates = []
+        inst = self.broker.get_instrument('BTC-USD')
+
+        def on_bar(instrument, bar):
+            if not updates:
+                self.broker.order(instrument, 1.0, limit=bar.bid)
+
+        self.broker.register(inst, on_bar, on_order=updates.append, bar_size=10)
+        records = quote(1005.0, 100.0, 100.5, 2.0) + trade(1011.0, 100.0, 1.5) + trade(1012.0, 100.25, 5.0) + trade(1013.0, 100.0, 1.0)
+        self.broker.replay(inst, records)
+        self.broker.run()
+        self.assertEqual([(update.open_time, update.fill_time, update.filled) for update in updates], [(1010.5, None, 0), (1010.5, 1013.0, 0.5)])
+        self.broker.replay(inst, trade(1014.0, 99.99, 0.1))       # Through the price
+        self.broker.run()
+        self.assertEqual((updates[-1].filled, updates[-1].open, updates[-1].fill_time), (1.0, False, 1014.0))
+        self.assertEqual(self.broker.get_position(inst), 1.0)
+        self.assertEqual(self.broker._positions['USD'], (900.0, 0.0))
+
+    def test_stop_and_merge(self):
+        eth = self.broker.get_instrument('ETH-USD')
+        btc = self.broker.get_instrument('BTC-USD')
+        self.broker._positions['BTC-USD'] = (1.0, 100.0)
+        self.broker.replay(btc, quote(1.0, 100.0, 100.1) + trade(2.0, 100.0, 1.0))
+        self.broker.run()
+        stop = self.broker.order(btc, -1.0, stop=99.0)
+        self.broker.replay(btc, quote(3.0, 98.5, 98.6) + trade(4.0, 98.5, 1.0) + trade(5.0, 98.4, 1.0))
+        self.broker.replay(eth, quote(3.5, 10.0, 10.1))
+        self.assertEqual(self.broker.run(), 4 + 6 + 4)
+        self.assertTrue(stop.fired)
+        order = self.broker._orders[stop.order.id]
+        self.assertEqual((order.open_time, order.filled, order.avg_price), (4.5, 1.0, 98.5))       # Market order at the bid after latency
+        self.assertEqual(self.broker.get_position(btc), 0)
+
+    def test_recordings(self):
+        import tempfile
+        from gbroke.recorder import TickRecorder
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = TickRecorder(directory, 'BTC-USD', flush_sec=60)
+            for t, field, value in quote(1.0, 100.0, 100.1) + trade(2.0, 100.1, 0.5) + trade(3.0, 100.0, 0.5):
+                recorder(t, Ticumulator.INPUT_FIELDS[field], value)
+            recorder.close()
+            self.broker.replay_recordings('BTC-USD', directory, start=2.0)
+            self.assertEqual(self.broker.run(), 6)
+        acc = self.broker._ticumulators['BTC-USD']
+        self.assertEqual((acc.time, acc.last, acc.volume), (3.0, 100.0, 1.0))
+        self.assertNotEqual(acc.bid, acc.bid)       # Quotes were before `start`
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import math
+import random
+import unittest
+
+from gbroke import Ticumulator
+from gbroke.book import Level2Book
+from tests.util import make_broker
+
+
+class TestLevel2Book(unittest.TestCase):
+    def test_snapshot_update(self):
+        book = Level2Book()
+        self.assertTrue(math.isnan(book.bid))
+        book.snapshot([['100.0', '1.5'], ['99.5', '2']], [['100.5', '0.25'], ['101', '3']])
+        self.assertEqual((book.bid, book.bidsize, book.ask, book.asksize), (100.0, 1.5, 100.5, 0.25))
+        book.update([['buy', '100.25', '0.5'], ['sell', '100.5', '0']])
+        self.assertEqual((book.bid, book.bidsize, book.ask, book.asksize), (100.25, 0.5, 101.0, 3.0))
+        self.assertEqual(book.bid_levels(2), [(100.25, 0.5), (100.0, 1.5)])
+        self.assertEqual(book.ask_levels(5), [(101.0, 3.0)])
+        self.assertEqual((book.bid_depth(2), book.bid_depth(), book.ask_depth()), (2.0, 4.0, 3.0))
+        self.assertEqual(len(book), 4)
+
+    def test_random_updates(self):
+        """Matches a plain dict book over many random adds, changes and removes, near and far from the touch."""
+        rand = random.Random(42)
+        book = Level2Book()
+        book.snapshot([], [])
+        ref = {'buy': {}, 'sell': {}}
+        for _ in range(5000):
+            side = rand.choice(('buy', 'sell'))
+            price = rand.randrange(1, 200) / 4 + (0 if side == 'buy' else 50)
+            size = rand.choice((0, 0, rand.randrange(1, 100) / 8))
+            book.update([[side, str(price), str(size)]])
+            if size:
+                ref[side][price] = size
+            else:
+                ref[side].pop(price, None)
+            bids = sorted(ref['buy'].items(), reverse=True)
+            asks = sorted(ref['sell'].items())
+            self.assertEqual(book.bid_levels(3), bids[:3])
+            self.assertEqual(book.ask_levels(3), asks[:3])
+        self.assertEqual(book.bids, ref['buy'])
+        self.assertAlmostEqual(book.ask_depth(), sum(ref['sell'].values()))
+
+
+class TestFeedLevels(unittest.TestCase):
+    def setUp(self):
+        self.broker = make_broker('test.book', _ticumulators={'BTC-USD': Ticumulator()})
+        self.acc = self.broker._ticumulators['BTC-USD']
+
+    def test_ticker(self):
+        msg = {'type': 'ticker', 'product_id': 'BTC-USD', 'price': '100.2', 'best_bid': '100.1', 'best_ask': '100.3', 'time': '2018-01-01T00:00:00.000000Z'}
+        self.broker._ticker(msg)        # First message after subscribing: no trade yet
+        self.assertEqual((self.acc.bid, self.acc.ask), (100.1, 100.3))
+        self.assertTrue(math.isnan(self.acc.last))
+        self.broker._ticker(dict(msg, last_size='0.5', best_bid_size='2', best_ask_size='3'))
+        self.assertEqual((self.acc.last, self.acc.lastsize, self.acc.lasttime), (100.2, 0.5, 1514764800.0))
+        self.assertEqual((self.acc.bidsize, self.acc.bid_depth, self.acc.asksize, self.acc.ask_depth), (2.0, 2.0, 3.0, 3.0))
+
+    def test_level2(self):
+        self.broker._l2update({'type': 'l2update', 'product_id': 'BTC-USD', 'changes': [['buy', '1', '1']]})       # Before snapshot: ignored
+        self.assertTrue(math.isnan(self.acc.bid))
+        self.broker._snapshot({'type': 'snapshot', 'product_id': 'BTC-USD', 'bids': [['100', '2']], 'asks': [['101', '1']]})
+        self.broker._l2update({'type': 'l2update', 'product_id': 'BTC-USD', 'changes': [['sell', '100.5', '4']]})
+        self.assertEqual((self.acc.bid, self.acc.bidsize, self.acc.ask, self.acc.asksize, self.acc.ask_depth), (100.0, 2.0, 100.5, 4.0, 4.0))
+        self.assertEqual(self.broker._metric_book_updates.get('BTC-USD'), 2)
+
+    def test_depth_levels(self):
+        self.broker.depth_levels = 2
+        self.broker._snapshot({'type': 'snapshot', 'product_id': 'BTC-USD', 'bids': [['100', '2'], ['99', '1'], ['98', '5']], 'asks': [['101', '1']]})
+        self.assertEqual((self.acc.bidsize, self.acc.bid_depth, self.acc.ask_depth), (2.0, 3.0, 1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import math
+import os
+import unittest
+
+import numpy as np
+
+from gbroke.chunkstore import CHUNK_HEADER, ChunkReader, ChunkWriter, CODEC_ZLIB, FLAG_RAW_VALUES, FOOTER_ENTRY, FOOTER_TRAILER, PRICE_FIELDS
+from gbroke.recorder import DTYPES, FIELD_IDS, KIND_TICKS
+
+
+class TestChunkStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp.name, 'BTC-USD.gbc')
+        rng = np.random.RandomState(7)
+        n = 10000
+        self.records = np.empty(n, dtype=DTYPES[KIND_TICKS])
+        self.records['time'] = np.round(1.5e9 + np.cumsum(rng.exponential(0.01, n)), 6)
+        self.records['field'] = rng.choice([FIELD_IDS[w] for w in ('bid', 'ask', 'last', 'bidsize', 'lastsize')], n)
+        prices = np.round(5000 + np.cumsum(rng.randint(-3, 4, n)) * 0.01, 2)
+        sizes = np.round(rng.exponential(1, n), 8)
+        is_price = np.isin(self.records['field'], [FIELD_IDS[w] for w in PRICE_FIELDS])
+        self.records['value'] = np.where(is_price, prices, sizes)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write(self, tick_size=0.01, **kwargs):
+        writer = ChunkWriter(self.path, tick_size, chunk_records=1000, **kwargs)
+        for rec in self.records.tolist():
+            writer.append(*rec)
+        writer.close()
+        return writer
+
+    def test_roundtrip(self):
+        self.write()
+        reader = ChunkReader(self.path)
+        self.assertEqual(len(reader), 10)
+        got = reader.range(workers=4)
+        np.testing.assert_array_equal(got['field'], self.records['field'])
+        np.testing.assert_array_equal(got['value'], self.records['value'])
+        np.testing.assert_allclose(got['time'], self.records['time'], rtol=0, atol=1e-6)
+        self.assertLess(os.path.getsize(self.path), self.records.nbytes / 3)
+
+    def test_increments_of_one_or_more(self):
+        self.records['value'] = np.round(self.records['value'] * 100) * 5        # e.g. a coin priced in whole units of another
+        self.write(tick_size=5.0, size_increment=1.0)
+        reader = ChunkReader(self.path)
+        np.testing.assert_array_equal(reader.range()['value'], self.records['value'])
+        flags = [CHUNK_HEADER.unpack_from(reader._buf, info.offset)[3] for info in reader.chunks]
+        self.assertFalse(any(flag & FLAG_RAW_VALUES for flag in flags))     # Stored as integers
+
+    def test_raw_fallback(self):
+        self.records['value'][5] = math.pi         # Not a multiple of anything
+        self.write(codec=CODEC_ZLIB)
+        got = ChunkReader(self.path).read_chunk(0)
+        np.testing.assert_array_equal(got['value'], self.records['value'][:1000])
+
+    def test_range_and_recovery(self):
+        self.write()
+        times = self.records['time']
+        start, end = times[2500], times[7321]
+        reader = ChunkReader(self.path)
+        got = reader.range(start, end)
+        self.assertEqual(len(got), 7321 - 2500)
+        self.assertEqual(len(reader.chunk_range(start, end)), 6)
+        self.assertEqual(sum(map(len, reader.iter_chunks(start, end))), len(got))
+        reader.close()
+        with open(self.path, 'r+b') as file:        # Chop off the footer and part of the last chunk
+            file.truncate(os.path.getsize(self.path) - FOOTER_TRAILER.size - 10 * FOOTER_ENTRY.size - 5)
+        self.assertEqual(len(ChunkReader(self.path)), 9)
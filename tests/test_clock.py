@@ -0,0 +1,39 @@
+import unittest
+
+from gbroke.clock import ClockSync
+
+
+class TestClockSync(unittest.TestCase):
+    def test_no_samples(self):
+        self.assertEqual(ClockSync().offset_at(100.0), 0.0)
+
+    def test_rest_converges(self):
+        clock = ClockSync(alpha=0.5)
+        for i in range(40):
+            t = 1000.0 + 10 * i
+            clock.add_rest(t + 0.05 + 2.5, t, t + 0.1)      # Server 2.5 sec ahead, read at the midpoint
+        self.assertAlmostEqual(clock.offset_at(1400.05), 2.5, places=3)
+        self.assertAlmostEqual(clock.drift, 0.0, places=6)
+        self.assertAlmostEqual(clock.best_rtt, 0.1)
+
+    def test_drift(self):
+        clock = ClockSync(alpha=0.5)
+        for i in range(200):
+            t = 1000.0 + 10 * i
+            clock.add_rest(t + 1.0 + 1e-4 * (t - 1000.0), t, t)
+        self.assertAlmostEqual(clock.drift, 1e-4, places=6)
+        self.assertAlmostEqual(clock.offset_at(3000.0), 1.2, places=3)
+
+    def test_feed_bound(self):
+        clock = ClockSync(window_sec=60.0)
+        clock.add_rest(101.0, 100.0, 100.0)
+        clock.add_feed(201.5, 200.0)        # Arrived 1.5 sec "before" it was sent: offset must be at least that
+        clock.add_feed(210.2, 209.0)
+        self.assertAlmostEqual(clock.offset_at(210.0), 1.5)
+        clock.add_feed(265.5, 265.0)
+        self.assertAlmostEqual(clock.offset_at(265.0), 1.2)        # First bound expired
+        self.assertAlmostEqual(clock.offset_at(400.0), 1.0)        # All expired
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import unittest
+from datetime import datetime
+
+from pytz import utc
+
+from gbroke import Bar, Instrument, Order, OrderRejected, Ticumulator, _OrderRecord
+from tests.util import make_broker
+
+
+class TestIBroke(unittest.TestCase):
+    maxDiff = None
+
+    def test_parse_trading_hours(self) -> None:
+        vecs = (
+            ('20170621:1700-1515,1530-1600;20170622:1700-1515,1530-1600', (
+             (datetime(2017, 6, 21, 17, 00), datetime(2017, 6, 21, 15, 15)),
+             (datetime(2017, 6, 21, 15, 30), datetime(2017, 6, 21, 16, 00)),
+             (datetime(2017, 6, 22, 17, 00), datetime(2017, 6, 22, 15, 15)),
+             (datetime(2017, 6, 22, 15, 30), datetime(2017, 6, 22, 16, 00)),
+            )),
+            ('20090507:0700-1830,1830-2330;20090508:CLOSED', (
+             (datetime(2009, 5, 7, 7, 00), datetime(2009, 5, 7, 18, 30)),
+             (datetime(2009, 5, 7, 18, 30), datetime(2009, 5, 7, 23, 30)),
+            )),
+            ('20170623:1715-1700;20170626:1715-1700', (
+             (datetime(2017, 6, 23, 17, 15), datetime(2017, 6, 23, 17, 00)),
+             (datetime(2017, 6, 26, 17, 15), datetime(2017, 6, 26, 17, 00)),
+            )),
+        )
+        for timestr, dts in vecs:
+            self.assertTupleEqual(tuple(Instrument._parse_trading_hours(timestr)), dts)
+
+    def test_normalize_trading_hours(self) -> None:
+        vecs = (
+            ((
+            (datetime(2017, 6, 21, 17, 00), datetime(2017, 6, 21, 15, 15)),
+            (datetime(2017, 6, 21, 15, 30), datetime(2017, 6, 21, 16, 00)),
+            (datetime(2017, 6, 22, 17, 00), datetime(2017, 6, 22, 15, 15)),
+            (datetime(2017, 6, 22, 15, 30), datetime(2017, 6, 22, 16, 00)),
+            ),
+            (
+            (datetime(2017, 6, 20, 17, 00, tzinfo=utc), datetime(2017, 6, 21, 15, 15, tzinfo=utc)),
+            (datetime(2017, 6, 21, 15, 30, tzinfo=utc), datetime(2017, 6, 21, 16, 00, tzinfo=utc)),
+            (datetime(2017, 6, 21, 17, 00, tzinfo=utc), datetime(2017, 6, 22, 15, 15, tzinfo=utc)),
+            (datetime(2017, 6, 22, 15, 30, tzinfo=utc), datetime(2017, 6, 22, 16, 00, tzinfo=utc)),
+            )),
+        )
+        for indates, outdates in vecs:
+            self.assertTupleEqual(Instrument._normalize_trading_hours(indates, utc), outdates)
+
+
+class TestOrderSnapshots(unittest.TestCase):
+    def test_shared_until_changed(self):
+        live = _OrderRecord('1', None, 100.0, 2, 0, True, False)
+        snap = live.snapshot()
+        self.assertIsInstance(snap, Order)
+        self.assertIs(live.snapshot(), snap)
+        with self.assertRaises(AttributeError):
+            snap.filled = 1
+        live.filled = 2
+        live.open = False
+        done = live.snapshot()
+        self.assertIsNot(done, snap)
+        self.assertEqual((snap.filled, snap.open, done.filled, done.open, done.complete), (0, True, 2, False, True))
+
+    def test_handlers_share_snapshot(self):
+        got = []
+        broker = make_broker(_order_listeners=[got.append], _order_handlers={'BTC-USD': [got.append, got.append]})
+        live = _OrderRecord('1', type('Inst', (), {'id': 'BTC-USD'})(), 100.0, 2, 0, True, False)
+        broker._call_order_handlers(live)
+        self.assertIs(got[0], live)
+        self.assertIs(got[1], got[2])
+        self.assertEqual(got[1].price, 100.0)
+
+
+class TestInstruments(unittest.TestCase):
+    def setUp(self):
+        self.broker = make_broker('test.instruments')
+
+    def test_interned(self):
+        inst = self.broker.get_instrument('BTC-USD')
+        self.assertIs(self.broker.get_instrument('BTC-USD'), inst)
+        self.assertIs(self.broker.get_instrument(('BTC-USD', 'STK', 'GDAX', 'USD')), inst)
+        self.assertEqual((inst.id, hash(inst), inst.product.quote_increment), ('BTC-USD', hash('BTC-USD'), 0.01))
+        self.assertEqual({inst: 1}[self.broker.get_instrument('BTC-USD')], 1)
+        with self.assertRaises(ValueError):
+            self.broker.get_instrument(['BTC-USD'])
+
+    def test_order_rejected_locally(self):
+        self.broker.auth_client = None      # Never reached
+        inst = self.broker.get_instrument('BTC-USD')
+        self.assertIsNone(self.broker.order(inst, 0.001, limit=100.0))
+        self.assertEqual(self.broker._metric_orders_rejected.get('BTC-USD', 'size'), 1)
+        with self.assertRaises(OrderRejected):
+            self.broker.check_order(inst, -0.1, limit=100.0)      # Ledger shows none to sell
+        self.broker._positions['BTC-USD'] = (1.0, 90.0)
+        self.assertEqual(self.broker.check_order(inst, -0.0123456789, limit=100.001), (-0.01234567, 100.01, 0.0))
+
+
+class TestBars(unittest.TestCase):
+    def setUp(self):
+        self.broker = broker = make_broker('test.bars')
+        self.scheduled = []
+        broker._subscribe = lambda instrument, feed: broker._ticumulators.setdefault(instrument.id, Ticumulator(clock=lambda: 0.0))
+        broker._schedule_bars = lambda bar_size, instrument: self.scheduled.append((instrument.id, bar_size))
+
+    def test_one_timer_per_size(self):
+        for bar_size in (10, 10, 60, 10):
+            self.broker.register('BTC-USD', lambda inst, bar: None, bar_size=bar_size)
+        self.broker.register('ETH-BTC', lambda inst, bar: None, bar_size=10)
+        self.assertEqual(self.scheduled, [('BTC-USD', 10), ('BTC-USD', 60), ('ETH-BTC', 10)])
+        self.assertEqual(len(self.broker._bar_handlers[('time', 10, 'BTC-USD')]), 3)
+
+    def test_bar_sizes_accumulate_separately(self):
+        small, large = [], []
+        inst = self.broker.register('BTC-USD', lambda inst, bar: small.append(bar), bar_size=10)
+        self.broker.register(inst, lambda inst, bar: large.append(bar), bar_size=60)
+        self.broker.register(inst, lambda inst, bar: small.append(bar), bar_size=10)
+        acc = self.broker._ticumulators['BTC-USD']
+        for i in range(6):
+            acc.add('last', 101.0 + i)
+            acc.add('lastsize', 1.0)
+            self.broker._call_bar_handlers('time', 10, 'BTC-USD')
+        self.broker._call_bar_handlers('time', 60, 'BTC-USD')
+        self.assertEqual([(bar.open, bar.close, bar.volume) for bar in small[-2:]], [(105.0, 106.0, 1.0)] * 2)     # Both handlers, one bar
+        self.assertEqual((large[0].open, large[0].high, large[0].low, large[0].close, large[0].volume), (101.0, 106.0, 101.0, 106.0, 6.0))
+
+    def test_handler_queue_metrics(self):
+        bars = self.broker.stream('BTC-USD', bar_size=10, maxsize=1)
+        events = self.broker.order_events(maxsize=2)
+        for i in range(3):
+            self.broker._call_bar_handlers('time', 10, 'BTC-USD')
+            events.put(i)
+        metrics = self.broker.metrics
+        self.assertEqual(metrics['gbroke_handler_queue_depth'].get(), 3)
+        self.assertEqual((metrics['gbroke_handler_dropped_total'].get('stream'), metrics['gbroke_handler_dropped_total'].get('order_events')), (2, 1))
+        bars.close()
+        events.close()
+        self.assertEqual((self.broker._streams, metrics['gbroke_handler_queue_depth'].get()), ([], 0))
+        self.assertEqual(self.broker._bar_handlers[('time', 10, 'BTC-USD')], [])
+
+    def test_indicator_catch_up_is_atomic(self):
+        import threading
+        self.broker.history_size = 10
+        inst = self.broker.register('BTC-USD', lambda inst, bar: None, bar_size=10)
+        bar = lambda close: Bar._make((0.0,) * 11 + (close,) + (0.0,) * 5)
+        for close in (1.0, 2.0):
+            self.broker._dispatch_bar('time', 10, 'BTC-USD', bar(close))
+        hist = self.broker._histories[('BTC-USD', 10)]
+        get, racers = hist.get, []
+
+        def get_and_race(*args):        # The bar thread dispatches a bar in the middle of the catch-up
+            rows = get(*args)
+            racers.append(threading.Thread(target=self.broker._dispatch_bar, args=('time', 10, 'BTC-USD', bar(3.0))))
+            racers[0].start()
+            racers[0].join(0.1)
+            return rows
+        hist.get = get_and_race
+        sma = self.broker.indicator(inst, 'sma', period=3)
+        racers[0].join()
+        self.assertEqual((sma.count, sma.value), (3, 2.0))      # Each bar exactly once
+
+
+class TestRecord(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.broker = broker = make_broker('test.record')
+        self.feeds = []
+        broker._subscribe = lambda instrument, feed: self.feeds.append(feed) or broker._ticumulators.setdefault(instrument.id, Ticumulator(clock=lambda: 1.0))
+
+    def test_compressed_uses_product_increments(self):
+        from gbroke.chunkstore import ChunkReader
+        recorder = self.broker.record('ETH-BTC', self.dir, compress=True)
+        self.broker._ticumulators['ETH-BTC'].add('bid', 0.03412)
+        recorder.close()
+        self.assertEqual((recorder.tick_size, recorder.size_increment), (0.00001, 0.001))
+        self.assertEqual(ChunkReader(recorder.path).tick_size, 0.00001)
+
+    def test_close_stops_feeding(self):
+        ticks = self.broker.record('BTC-USD', self.dir)
+        handlers = self.broker._tick_handlers['BTC-USD']        # As the feed thread may be iterating it
+        rows = self.broker.record('BTC-USD', self.dir, rows=True, feed='ticker')
+        self.assertEqual((handlers, self.feeds), ([], ['full', 'ticker']))
+        acc = self.broker._ticumulators['BTC-USD']
+        self.assertEqual((acc.listeners, self.broker._tick_handlers['BTC-USD']), ([ticks], [rows]))
+        ticks.close()
+        rows.close()
+        self.assertEqual((acc.listeners, self.broker._tick_handlers['BTC-USD']), ([], []))
+        ticks(2.0, 'bid', 100.0)        # A straggler from the feed thread is ignored
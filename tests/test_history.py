@@ -0,0 +1,27 @@
+import unittest
+
+from gbroke.history import BAR_FIELDS, BarHistory
+
+
+class TestBarHistory(unittest.TestCase):
+    def bar(self, i):
+        return tuple(float(i * 100 + j) for j in range(len(BAR_FIELDS)))
+
+    def test_wraparound(self):
+        hist = BarHistory(4)
+        self.assertEqual(len(hist.get().close), 0)
+        for i in range(10):
+            hist.append(self.bar(i))
+            bars = hist.get()
+            self.assertEqual(len(bars.time), min(i + 1, 4))
+            self.assertEqual(bars.time.tolist(), [k * 100.0 for k in range(max(0, i - 3), i + 1)])
+        self.assertEqual(hist.get(2).close.tolist(), [811.0, 911.0])
+        self.assertEqual(len(hist.get(100).close), 4)
+
+    def test_zero_copy(self):
+        hist = BarHistory(8)
+        hist.append(self.bar(1))
+        bars = hist.get(1)
+        self.assertIs(bars.close.base, hist._data)
+        with self.assertRaises(ValueError):
+            bars.close[0] = 0.0
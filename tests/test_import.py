@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+import unittest
+
+#: Cold ``import gbroke`` budget; it was ~185 ms before the feed, REST client, NumPy and timezones became lazy
+IMPORT_BUDGET_SEC = 0.06
+#: Modules that must not be loaded until something uses them
+LAZY_MODULES = ('gdax', 'requests', 'numpy', 'pytz', 'ciso8601', 'unittest', 'json', 'http.server')
+
+
+class TestImport(unittest.TestCase):
+    def import_gbroke(self, code=''):
+        """:Return: (stderr, stdout) of a fresh interpreter importing gbroke with -X importtime and running `code`."""
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import gbroke\n' + code], env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        return proc.stderr, proc.stdout
+
+    def test_import_time(self):
+        times = []
+        for _ in range(3):      # The first run may compile bytecode
+            stderr, _ = self.import_gbroke()
+            line = next(line for line in stderr.splitlines() if line.endswith('| gbroke'))
+            times.append(int(line.split('|')[1]) / 1e6)      # Cumulative microseconds
+        self.assertLess(min(times), IMPORT_BUDGET_SEC, 'import gbroke took {:.0f} ms'.format(min(times) * 1000))
+
+    def test_lazy_modules(self):
+        _, stdout = self.import_gbroke('print(" ".join(sorted(set({!r}) & set(sys.modules))))'.format(LAZY_MODULES).replace('sys.modules', '__import__("sys").modules'))
+        self.assertEqual(stdout.strip(), '')
@@ -0,0 +1,54 @@
+import math
+import unittest
+from collections import namedtuple
+
+from gbroke.indicators import EMA, make_indicator, NaN, RSI, SMA, Volatility, VWAPBands
+
+
+class TestIndicators(unittest.TestCase):
+    Row = namedtuple('Row', 'close vwap volume')
+
+    def feed(self, ind, closes):
+        for x in closes:
+            ind.update(self.Row(x, x, 1.0))
+        return ind
+
+    def test_sma_ema(self):
+        closes = [1.0, 2.0, NaN, 3.0, 4.0, 5.0]
+        sma = self.feed(SMA(3), closes)
+        self.assertEqual(sma.value, 4.0)
+        self.assertEqual(sma.count, 5)
+        ema = self.feed(EMA(3), closes)
+        expected = 1.0
+        for x in (2.0, 3.0, 4.0, 5.0):
+            expected += 0.5 * (x - expected)
+        self.assertAlmostEqual(ema.value, expected)
+
+    def test_volatility(self):
+        import statistics
+        closes = [100, 101, 99, 102, 103, 101, 100]
+        vol = self.feed(Volatility(4), closes)
+        rets = [math.log(b / a) for a, b in zip(closes, closes[1:])][-4:]
+        self.assertAlmostEqual(vol.value, statistics.stdev(rets))
+        self.assertTrue(vol.ready)
+
+    def test_rsi(self):
+        rsi = self.feed(RSI(3), [1, 2, 3, 4])
+        self.assertEqual(rsi.value, 100.0)
+        self.feed(rsi, [3])
+        self.assertTrue(0 < rsi.value < 100)
+
+    def test_vwap_bands(self):
+        bands = VWAPBands(2, k=1.0)
+        bands.update(self.Row(NaN, 10.0, 1.0))
+        bands.update(self.Row(NaN, 20.0, 3.0))
+        self.assertAlmostEqual(bands.value.middle, 17.5)
+        std = math.sqrt((100 * 1 + 400 * 3) / 4 - 17.5 ** 2)
+        self.assertAlmostEqual(bands.value.upper, 17.5 + std)
+        bands.update(self.Row(NaN, 30.0, 1.0))      # Drops the first bar
+        self.assertAlmostEqual(bands.value.middle, 22.5)
+
+    def test_make(self):
+        self.assertIsInstance(make_indicator('ema', period=5), EMA)
+        with self.assertRaises(ValueError):
+            make_indicator('nope')
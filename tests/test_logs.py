@@ -0,0 +1,125 @@
+import json
+import logging
+import queue
+import timeit
+import unittest
+
+from gbroke.logs import JsonFormatter, QueueHandler, StderrHandler, _Writer, create_logger
+
+#: Budget for a debug() call on a logger at INFO
+SUPPRESSED_CALL_SEC = 1e-6
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+class TestLogs(unittest.TestCase):
+    def make_logger(self, name, formatter=None, maxsize=100):
+        target = ListHandler()
+        target.setFormatter(formatter or logging.Formatter('%(levelname)s %(message)s'))
+        writer = _Writer(target, maxsize)
+        logger = logging.getLogger(name)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = QueueHandler(writer.queue)
+        logger.addHandler(handler)
+        self.addCleanup(logger.removeHandler, handler)
+        return logger, handler, writer, target
+
+    def stop(self, writer):
+        writer.queue.put(None)
+        writer.join(5)
+
+    def test_message_captured_when_logged(self):
+        logger, _, writer, target = self.make_logger('gbroke.test.capture')
+        writer.start()
+        order = [1]
+        logger.info('ORDER %s', order)
+        order.append(2)         # Mutated before the writer gets to it
+        logger.debug('hidden %s', order)
+        self.stop(writer)
+        self.assertEqual(target.lines, ['INFO ORDER [1]'])
+
+    def test_drops_when_full(self):
+        logger, handler, writer, target = self.make_logger('gbroke.test.full', maxsize=2)
+        for i in range(5):      # Writer not started, so nothing drains
+            logger.warning('%d', i)
+        self.assertEqual(handler.dropped, 3)
+        writer.start()
+        self.stop(writer)
+        self.assertEqual(target.lines, ['WARNING 0', 'WARNING 1'])
+
+    def test_structured(self):
+        logger, _, writer, target = self.make_logger('gbroke.test.json', JsonFormatter())
+        writer.start()
+        logger.info('FILL %s', 'BTC-USD', extra={'price': 100.5})
+        self.stop(writer)
+        fields = json.loads(target.lines[0])
+        self.assertEqual((fields['level'], fields['message'], fields['price']), ('INFO', 'FILL BTC-USD', 100.5))
+
+    def test_survives_handler_errors(self):
+        logger, _, writer, target = self.make_logger('gbroke.test.errors')
+        errors = []
+
+        def emit(record):
+            if record.msg == 'bad':
+                raise ValueError('I/O operation on closed file')
+            target.lines.append(record.msg)
+
+        def flush():
+            raise ValueError('I/O operation on closed file')
+
+        target.emit, target.flush, target.handleError = emit, flush, errors.append
+        writer.start()
+        logger.warning('bad')
+        logger.warning('good')
+        self.stop(writer)
+        self.assertEqual(target.lines, ['good'])
+        self.assertEqual(len(errors), 2)        # The bad record, and the final flush
+        self.assertFalse(writer.is_alive())
+
+    def test_stderr_resolved_when_written(self):
+        import io
+        import sys
+        handler = StderrHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        out, stderr = io.StringIO(), sys.stderr
+        sys.stderr = out
+        try:
+            handler.handle(logging.makeLogRecord({'msg': 'hello'}))
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(out.getvalue(), 'hello\n')
+
+    def test_queue_depth(self):
+        from gbroke import logs
+        writer = _Writer(ListHandler(), 10)
+        writer.queue.put(logging.makeLogRecord({'msg': 'queued'}))
+        real, logs._writer = logs._writer, writer
+        try:
+            self.assertEqual(logs.queue_depth(), 1)
+        finally:
+            logs._writer = real
+
+    def test_create_logger_once(self):
+        logger = create_logger('gbroke.test.once', logging.INFO)
+        create_logger('gbroke.test.once', logging.INFO)
+        self.assertEqual(sum(isinstance(h, QueueHandler) for h in logger.handlers), 1)
+        self.assertIsInstance(logger.handlers[0].queue, queue.Queue)
+
+    def test_suppressed_call_cost(self):
+        logger, _, _, _ = self.make_logger('gbroke.test.cost')
+        order = object()
+        n = 100000
+        sec = min(timeit.repeat(lambda: logger.debug('ORDER %s %s', order, 1.5), number=n, repeat=5)) / n
+        self.assertLess(sec, SUPPRESSED_CALL_SEC, 'suppressed debug() took {:.0f} ns'.format(sec * 1e9))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from gbroke.metrics import Histogram, MetricsRegistry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counter(self):
+        reg = MetricsRegistry()
+        msgs = reg.counter('messages_total', 'Messages', ('type', 'product'))
+        msgs.inc('match', 'BTC-USD')
+        msgs.inc('match', 'BTC-USD', n=2)
+        msgs.inc('open', 'BTC-USD')
+        self.assertEqual(msgs.get('match', 'BTC-USD'), 3)
+        text = reg.render()
+        self.assertIn('# TYPE messages_total counter', text)
+        self.assertIn('messages_total{type="match",product="BTC-USD"} 3', text)
+        self.assertIn('messages_total{type="open",product="BTC-USD"} 1', text)
+        with self.assertRaises(ValueError):
+            reg.counter('messages_total', 'Dupe')
+
+    def test_gauge_func(self):
+        reg = MetricsRegistry()
+        items = [1, 2, 3]
+        reg.gauge('items', 'Items', func=lambda: len(items))
+        self.assertIn('items 3', reg.render())
+        items.pop()
+        self.assertEqual(reg['items'].get(), 2)
+
+    def test_histogram(self):
+        hist = Histogram('latency_seconds', 'Latency', ('op',), buckets=(0.1, 1.0))
+        for val in (0.05, 0.5, 0.5, 2.0):
+            hist.observe(val, 'buy')
+        self.assertEqual(hist.count('buy'), 4)
+        samples = {(name, labels): value for name, labels, value in hist.samples()}
+        self.assertEqual(samples[('latency_seconds_bucket', '{op="buy",le="0.1"}')], 1)
+        self.assertEqual(samples[('latency_seconds_bucket', '{op="buy",le="1"}')], 3)
+        self.assertEqual(samples[('latency_seconds_bucket', '{op="buy",le="+Inf"}')], 4)
+        self.assertAlmostEqual(samples[('latency_seconds_sum', '{op="buy"}')], 3.05)
+        self.assertNotIn(('latency_seconds_max', '{op="buy"}'), samples)
+        self.assertEqual(hist.max('buy'), 2.0)
+        text = hist.render()
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('# TYPE latency_seconds_max gauge\nlatency_seconds_max{op="buy"} 2', text)
+
+    def test_serve(self):
+        from urllib.request import urlopen
+        reg = MetricsRegistry()
+        reg.counter('hits_total', 'Hits').inc()
+        port = reg.serve(0)
+        try:
+            with urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=5) as resp:
+                self.assertIn('hits_total 1', resp.read().decode('utf-8'))
+        finally:
+            reg.shutdown()
@@ -0,0 +1,90 @@
+import unittest
+
+from gbroke import Ticumulator
+from gbroke.book import Level2Book
+from gbroke.paper import PaperExchange
+from gbroke.products import Product
+from tests.test_products import PRODUCTS
+from tests.util import make_broker
+
+
+class Inst:
+    id = 'BTC-USD'
+    product = Product.from_json(PRODUCTS[0])
+
+
+class TestPaperExchange(unittest.TestCase):
+    def setUp(self):
+        self.inst = Inst()
+        self.updates = []
+        self.broker = broker = make_broker('test.paper', _instruments={'BTC-USD': self.inst}, _positions={'USD': (1000.0, 0.0)},
+                                           _order_listeners=[lambda record: self.updates.append(record.snapshot())])
+        broker._paper = self.paper = PaperExchange(broker, latency_sec=0, clock=lambda: 1.0, start=False)
+        self.acc = broker._ticumulators['BTC-USD'] = Ticumulator()
+
+    def level2(self, bids, asks):
+        book = self.broker._books['BTC-USD'] = Level2Book()
+        book.snapshot(bids, asks)
+        return book
+
+    def test_queue_position(self):
+        self.level2([['100.00', '5'], ['99.99', '1']], [['100.01', '2']])
+        order = self.paper.order(self.inst, 1.0, limit=100.0)
+        self.assertEqual(self.updates[-1].open_time, 1.0)
+        self.paper.on_trade('BTC-USD', 100.0, 3.0, 'buy')
+        self.paper.on_trade('BTC-USD', 100.01, 3.0, 'sell')        # Other side
+        self.assertEqual(self.updates[-1].filled, 0)
+        self.paper.on_trade('BTC-USD', 100.0, 2.5, 'buy')          # 2 ahead, then 0.5 for us
+        self.assertEqual(self.updates[-1].filled, 0.5)
+        self.paper.on_trade('BTC-USD', 99.99, 0.1, 'buy')          # Through our price
+        done = self.updates[-1]
+        self.assertEqual((done.id, done.filled, done.avg_price, done.open), (order.id, 1.0, 100.0, False))
+        self.assertEqual(self.broker._positions['BTC-USD'], (1.0, 100.0))
+        self.assertEqual(self.broker._positions['USD'], (900.0, 0.0))
+        self.assertEqual(self.paper._books, {})
+
+    def test_level_shrinks(self):
+        book = self.level2([['100.00', '5']], [])
+        self.paper.order(self.inst, 1.0, limit=100.0)
+        book.update([['buy', '100.00', '1']])       # 4 cancelled; some of it was ahead of us
+        self.paper.on_trade('BTC-USD', 100.0, 1.5, 'buy')
+        self.assertEqual(self.updates[-1].filled, 0.5)
+
+    def test_top_of_book(self):
+        for what, value in (('bid', 100.0), ('bidsize', 3.0), ('ask', 100.05), ('asksize', 2.0)):
+            self.acc.add(what, value)
+        self.assertIsNone(self.paper.order(self.inst, 1.0, limit=100.05))      # Post-only would cross
+        self.paper.order(self.inst, -1.0, limit=100.03)                        # Improves the ask: first in line
+        self.paper.order(self.inst, 1.0, limit=99.5)                           # Behind the touch: only when traded through
+        self.paper.on_trade('BTC-USD', 100.03, 0.4, 'sell')
+        self.assertEqual((self.updates[-1].filled, self.broker._positions['BTC-USD']), (0.4, (-0.4, 100.03)))
+        count = len(self.updates)
+        self.paper.on_trade('BTC-USD', 99.5, 10.0, 'buy')
+        self.assertEqual(len(self.updates), count)
+        self.paper.on_trade('BTC-USD', 99.49, 0.01, 'buy')
+        self.assertEqual(self.updates[-1].filled, 1.0)
+        self.assertAlmostEqual(self.updates[-1].profit, 0.4 * (100.03 - 99.5))
+
+    def test_market_and_cancel(self):
+        self.level2([], [['100.01', '1'], ['100.02', '2']])
+        order = self.paper.order(self.inst, 2.0)
+        self.assertEqual((self.updates[-1].filled, self.updates[-1].avg_price, self.updates[-1].open), (2.0, 100.015, False))
+        self.paper.order(self.inst, 1.0, limit=99.0)
+        self.paper.cancel(self.updates[-1])
+        self.assertTrue(self.updates[-1].cancelled)
+        self.paper.cancel(order)        # Done already; nothing happens
+        self.assertEqual(len(self.updates), 5)
+
+    def test_broker_order(self):
+        broker = self.broker
+        broker.auth_client = None       # Never reached
+        self.level2([['100.00', '1']], [['100.01', '1']])
+        order = broker.order(self.inst, 0.5, limit=100.0)
+        self.assertIs(broker._orders[order.id], self.updates[-1] and broker._orders[order.id])
+        self.assertIsNone(broker.order(self.inst, 20.0, limit=100.0))      # Only 1000 USD
+        broker.cancel(order)
+        self.assertTrue(self.updates[-1].cancelled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import timeit
+import unittest
+
+from gbroke.pretrade import OrderRejected, check_order, quantize
+from gbroke.products import Product
+from tests.test_products import PRODUCTS
+
+BTC, ETH = (Product.from_json(raw) for raw in PRODUCTS)
+#: Budget for checking one order
+CHECK_SEC = 20e-6
+
+
+class TestPretrade(unittest.TestCase):
+    def reasons(self, *args, **kwargs):
+        with self.assertRaises(OrderRejected) as cm:
+            check_order(*args, **kwargs)
+        return [code for code, _ in cm.exception.reasons]
+
+    def test_quantize(self):
+        self.assertEqual(quantize(0.3, 0.1), 0.3)
+        self.assertEqual(quantize(100.019, 0.01), 100.01)
+        self.assertEqual(quantize(100.011, 0.01, up=True), 100.02)
+        self.assertEqual(quantize(0.123456789, 1e-8), 0.12345678)
+        self.assertEqual(quantize(1234.5, 1.0), 1234.0)
+
+    def test_quantized(self):
+        self.assertEqual(check_order(BTC, 0.12345, limit=100.019), (0.12345, 100.01, 0.0))      # Buys round down
+        self.assertEqual(check_order(BTC, -0.5, limit=100.011), (-0.5, 100.02, 0.0))           # Sells up
+        self.assertEqual(check_order(None, 0.12345), (0.123, 0.0, 0.0))
+        self.assertEqual(check_order(BTC, 0.5, limit=100.0, available=50.0), (0.5, 100.0, 0.0))
+        self.assertEqual(check_order(BTC, -0.5, available=0.5), (-0.5, 0.0, 0.0))
+
+    def test_rejected(self):
+        self.assertEqual(self.reasons(BTC, 0.005, limit=100.0), ['size'])
+        self.assertEqual(self.reasons(BTC, 20000, limit=100.0), ['size'])
+        self.assertEqual(self.reasons(ETH, 1.0, limit=0.05), ['status'])
+        self.assertEqual(self.reasons(BTC, 1.0, limit=0.001), ['price'])
+        self.assertEqual(self.reasons(BTC, 1.0, limit=99.0, stop=100.0), ['price'])
+        self.assertEqual(self.reasons(None, 1.0, limit=-1.0), ['price'])
+        self.assertEqual(self.reasons(BTC, 1.0, limit=100.0, available=99.99), ['funds'])
+        self.assertEqual(self.reasons(BTC, -1.0, price=100.0, available=0.5), ['funds'])
+        self.assertEqual(self.reasons(BTC._replace(min_market_funds=10.0), 0.05, price=100.0), ['funds'])
+
+    def test_fast(self):
+        n = 10000
+        sec = min(timeit.repeat(lambda: check_order(BTC, 0.12345, limit=100.019, available=1e6), number=n, repeat=3)) / n
+        self.assertLess(sec, CHECK_SEC, 'check_order() took {:.1f} us'.format(sec * 1e6))
+
+
+if __name__ == '__main__':
+    unittest.main()
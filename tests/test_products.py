@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import tempfile
+import time
+import unittest
+
+from gbroke.products import Product, ProductRegistry
+
+PRODUCTS = [
+    {'id': 'BTC-USD', 'base_currency': 'BTC', 'quote_currency': 'USD', 'base_min_size': '0.01', 'base_max_size': '10000.00',
+     'quote_increment': '0.01', 'display_name': 'BTC/USD', 'status': 'online'},
+    {'id': 'ETH-BTC', 'base_currency': 'ETH', 'quote_currency': 'BTC', 'base_min_size': '0.01', 'base_max_size': '1000000.00',
+     'quote_increment': '0.00001', 'base_increment': '0.001', 'min_market_funds': '0.001', 'status': 'offline'},
+]
+
+
+class TestProductRegistry(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'cache', 'products.json')
+        self.fetches = 0
+        self.log = logging.getLogger('gbroke.test.products')
+        self.log.disabled = True
+
+    def fetch(self):
+        self.fetches += 1
+        return PRODUCTS
+
+    def fail(self):
+        self.fetches += 1
+        return {'message': 'Service unavailable'}
+
+    def registry(self, fetch, **kwargs):
+        return ProductRegistry(fetch, self.path, log=self.log, **kwargs).load()
+
+    def test_parse(self):
+        products = self.registry(self.fetch)
+        self.assertEqual(sorted(products), ['BTC-USD', 'ETH-BTC'])
+        btc, eth = products['BTC-USD'], products.get('ETH-BTC')
+        self.assertEqual((btc.quote_increment, btc.base_min_size, btc.base_increment, btc.trading), (0.01, 0.01, 1e-8, True))
+        self.assertEqual((eth.quote_increment, eth.base_increment, eth.min_market_funds, eth.trading), (1e-5, 0.001, 0.001, False))
+        self.assertIsNone(products.get('XRP-USD'))
+        self.assertIsInstance(btc, Product)
+
+    def test_cache(self):
+        self.registry(self.fetch)
+        cached = self.registry(self.fail)
+        self.assertEqual(self.fetches, 1)       # Fresh cache; no request
+        self.assertIn('BTC-USD', cached)
+
+    def test_stale_cache(self):
+        with open(self.registry(self.fetch).path) as f:
+            self.assertEqual(json.load(f)['products'], PRODUCTS)
+        os.utime(self.path)
+        stale = self.registry(self.fetch, max_age_sec=0)
+        self.assertEqual(self.fetches, 2)
+        fallback = self.registry(self.fail, max_age_sec=0)
+        self.assertEqual(self.fetches, 3)
+        self.assertEqual(len(fallback), 2)
+        self.assertLess(fallback.updated, time.time())
+        self.assertEqual(stale.updated, fallback.updated)
+
+    def test_no_products(self):
+        products = ProductRegistry(self.fail, None, log=self.log).load()
+        self.assertEqual(len(products), 0)
+        with self.assertRaises(RuntimeError):
+            products.refresh()
+
+
+if __name__ == '__main__':
+    unittest.main()
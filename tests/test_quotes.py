@@ -0,0 +1,139 @@
+import logging
+import unittest
+
+from gbroke import _OrderRecord
+from gbroke.metrics import MetricsRegistry
+from gbroke.pretrade import OrderRejected
+from gbroke.products import Product
+from gbroke.quotes import QuoteManager
+from tests.test_products import PRODUCTS
+
+
+class Inst:
+    id = 'BTC-USD'
+    product = Product.from_json(PRODUCTS[0])
+
+
+class Broker:
+    """Records orders and cancels; the test acknowledges and finishes them."""
+    def __init__(self):
+        self.metrics = MetricsRegistry()
+        self._metric_quote_requests = self.metrics.counter('requests', '', ('product', 'op'))
+        self.log = logging.getLogger('gbroke.test.quotes')
+        self.connected = True
+        self._orders = {}
+        self._order_listeners = []
+        self.sent = []
+        self.ids = 0
+        self.unfunded = set()       # Prices check_order() rejects
+        self.failures = 0           # Number of order() calls to fail first, like network errors
+
+    def check_order(self, instrument, quantity, limit=0.0, stop=0.0):
+        if limit in self.unfunded:
+            raise OrderRejected(instrument.id, [('funds', 'Insufficient funds')])
+        return quantity, limit, stop
+
+    def order(self, instrument, quantity, limit=0.0):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('Network down')
+        self.ids += 1
+        record = self._orders[str(self.ids)] = _OrderRecord(str(self.ids), instrument, limit, quantity, 0, True, False)
+        self.sent.append(('new', quantity, limit))
+        return record.snapshot()
+
+    def cancel(self, record):
+        self.sent.append(('cancel', record.quantity, record.price))
+
+    def ack(self):
+        for record in self._orders.values():
+            record.open_time = 1.0
+
+    def done(self, price, filled=0.0):
+        record = next(r for r in self._orders.values() if r.price == price)
+        record.open, record.filled = False, filled
+        for listener in self._order_listeners:
+            listener(record)
+
+
+class TestQuoteManager(unittest.TestCase):
+    def setUp(self):
+        self.broker = Broker()
+        self.broker.log.disabled = True
+        self.time = 0.0
+        self.quotes = QuoteManager(self.broker, Inst(), start=False, clock=lambda: self.time)
+
+    def test_diff(self):
+        self.quotes.quote(bids=[(100.004, 1.0), (99.5, 2.0)], asks=[(101.001, 1.0)])
+        self.assertEqual(self.quotes.step(), 3)
+        self.assertEqual(self.broker.sent, [('new', 1.0, 100.0), ('new', 2.0, 99.5), ('new', -1.0, 101.01)])
+        self.quotes.quote(bids=[(100.0, 1.0), (99.5, 2.0)], asks=[(101.01, 1.0)])
+        self.assertEqual(self.quotes.step(), 0)         # Nothing changed
+        self.quotes.quote(bids=[(100.0, 0.9), (99.0, 2.0)], asks=[(101.01, 1.0)])
+        del self.broker.sent[:]
+        self.assertEqual(self.quotes.step(), 1)         # 99.0 is new; nothing is acknowledged yet, so nothing to cancel
+        self.broker.ack()
+        self.assertEqual(self.quotes.step(), 1)         # 99.5 cancelled; 100 is within size tolerance
+        self.assertEqual(self.broker.sent, [('new', 2.0, 99.0), ('cancel', 2.0, 99.5)])
+        self.assertEqual(self.quotes.step(), 0)         # The cancel is in flight
+        self.broker.done(99.5)
+        self.assertEqual([o.price for o in self.quotes.resting()], [100.0, 99.0, 101.01])
+        self.assertNotIn('2', self.broker._orders)      # Forgotten
+        self.assertEqual(self.broker._metric_quote_requests.get('BTC-USD', 'new'), 4)
+
+    def test_replace_after_cancel(self):
+        self.quotes.quote(asks=[(101.0, 1.0)])
+        self.quotes.step()
+        self.broker.ack()
+        self.quotes.quote(asks=[(101.0, 3.0)])
+        self.quotes.step()
+        self.assertEqual(self.broker.sent[1:], [('cancel', -1.0, 101.0)])       # Not a second order at the same price yet
+        self.broker.done(101.0)
+        self.quotes.step()
+        self.assertEqual(self.broker.sent[2:], [('new', -3.0, 101.0)])
+
+    def test_coalesce_and_disconnect(self):
+        self.broker.connected = False
+        self.quotes.quote(bids=[(100.0, 1.0)])
+        self.quotes.quote(bids=[(99.0, 1.0)])
+        self.assertEqual(self.quotes.step(), 0)
+        self.broker.connected = True
+        self.quotes.step()
+        self.assertEqual(self.broker.sent, [('new', 1.0, 99.0)])        # Only the latest wish
+
+    def test_invalid(self):
+        self.quotes.quote(bids=[(100.0, 1.0)])
+        with self.assertRaises(OrderRejected):
+            self.quotes.quote(bids=[(100.0, 0.001)])
+        self.quotes.step()
+        self.assertEqual(self.broker.sent, [('new', 1.0, 100.0)])
+
+    def test_rejected_until_wish_changes(self):
+        self.broker.unfunded.add(100.0)
+        self.quotes.quote(bids=[(100.0, 1.0)])
+        self.assertEqual(self.quotes.step(), 1)
+        self.broker.unfunded.clear()
+        self.time = 100.0
+        self.assertEqual(self.quotes.step(), 0)         # Not retried
+        self.quotes.quote(bids=[(100.0, 2.0)])
+        self.quotes.step()
+        self.assertEqual(self.broker.sent, [('new', 2.0, 100.0)])
+
+    def test_retry_with_backoff(self):
+        from gbroke.quotes import RETRY_MIN_SEC
+        self.broker.failures = 2
+        self.quotes.quote(bids=[(100.0, 1.0)])
+        self.assertEqual(self.quotes.step(), 1)
+        self.assertEqual(self.quotes.step(), 0)         # Waiting
+        self.time += RETRY_MIN_SEC
+        self.assertEqual(self.quotes.step(), 1)         # Fails again
+        self.time += RETRY_MIN_SEC
+        self.assertEqual(self.quotes.step(), 0)         # Backed off twice as long
+        self.time += RETRY_MIN_SEC
+        self.quotes.step()
+        self.assertEqual(self.broker.sent, [('new', 1.0, 100.0)])
+        self.assertEqual(self.quotes._retry, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
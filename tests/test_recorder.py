@@ -0,0 +1,65 @@
+import os
+import unittest
+
+import numpy as np
+
+from gbroke import Bar, Ticumulator
+from gbroke.recorder import FIELD_IDS, HEADER_SIZE, iter_records, KIND_QUOTES, KIND_TICKS, list_recordings, QUOTE_FIELDS, QuoteRecorder, read_header, read_records, TickRecorder
+
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_ticks_rotate(self):
+        rec = TickRecorder(self.dir, 'BTC-USD', file_size=HEADER_SIZE + 24 * 10, flush_sec=60)
+        for i in range(25):
+            rec(1000.0 + i, 'last', 100.0 + i)
+        rec.close()
+        paths = list_recordings(self.dir, 'BTC-USD', KIND_TICKS)
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(os.path.getsize(paths[-1]), HEADER_SIZE + 24 * 5)      # Truncated on close
+        self.assertEqual(read_header(paths[0]).count, 10)
+        self.assertEqual(read_header(paths[0]).last_time, 1009.0)
+        records = np.concatenate(list(iter_records(self.dir, 'BTC-USD')))
+        self.assertEqual(len(records), 25)
+        self.assertTrue((records['field'] == FIELD_IDS['last']).all())
+        self.assertEqual(records['value'][-1], 124.0)
+
+    def test_zero_copy_and_flush(self):
+        rec = TickRecorder(self.dir, 'ETH-USD', flush_sec=60)
+        rec(1.0, 'bid', 10.0)
+        rec(2.0, 'ask', 11.0)
+        self.assertEqual(len(read_records(rec.path)), 0)    # Not visible until flushed
+        rec.flush()
+        records = read_records(rec.path)
+        self.assertEqual(records['value'].tolist(), [10.0, 11.0])
+        self.assertFalse(records.flags.owndata)
+        self.assertFalse(records.flags.writeable)
+        rec.close()
+        with self.assertRaises(ValueError):
+            rec.append(3.0, 0, 0.0)
+
+    def test_quotes(self):
+        rec = QuoteRecorder(self.dir, 'BTC-USD', flush_sec=60)
+        bar = Bar._make(range(len(Bar._fields)))
+        rec(None, bar)
+        rec.close()
+        records = read_records(list_recordings(self.dir, kind=KIND_QUOTES)[0])
+        self.assertEqual(records.dtype.names, QUOTE_FIELDS)
+        self.assertEqual(tuple(records[0]), tuple(float(getattr(bar, field)) for field in QUOTE_FIELDS))
+
+    def test_ticumulator_listener(self):
+        acc = Ticumulator()
+        rec = TickRecorder(self.dir, 'BTC-USD', flush_sec=60)
+        acc.listeners.append(rec)
+        acc.add('last', 5.0)
+        acc.add('lastsize', 2.0)
+        rec.close()
+        records = read_records(rec.path)
+        self.assertEqual([Ticumulator.INPUT_FIELDS[f] for f in records['field']], ['last', 'lastsize'])
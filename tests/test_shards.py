@@ -0,0 +1,33 @@
+import multiprocessing
+import threading
+import unittest
+
+from gbroke.shards import _Shard, ShardSupervisor
+
+
+class TestShards(unittest.TestCase):
+    def test_assignment(self):
+        """Products spread over the least loaded workers and stay put; no processes are started here."""
+        from gbroke.metrics import MetricsRegistry
+        sup = ShardSupervisor.__new__(ShardSupervisor)
+        sup._shards = [_Shard(i, 'test-{}'.format(i)) for i in range(3)]
+        sup._lock = threading.Lock()
+        sup._metric_products = MetricsRegistry().gauge('products', '', ('shard',))
+        started = []
+        sup._start = lambda shard: (setattr(shard, 'process', True), setattr(shard, 'control', multiprocessing.Queue()), started.append(shard.index))
+        sup._route = lambda *args: None
+        sup._broker = type('Broker', (), {'log': type('Log', (), {'info': lambda *args: None})()})()
+
+        class Inst:
+            def __init__(self, symbol):
+                self.symbol = symbol
+
+        for product in ('BTC-USD', 'ETH-USD', 'LTC-USD', 'BCH-USD'):
+            sup.subscribe(Inst(product), 'time', 1.0)
+        sup.subscribe(Inst('ETH-USD'), 'tick', 1.0)
+        sup.subscribe(Inst('ETH-USD'), 'tick', 5.0)     # Duplicate: bar_size is ignored for ticks
+        self.assertEqual(started, [0, 1, 2])
+        self.assertEqual([len(shard.products) for shard in sup._shards], [2, 1, 1])
+        self.assertEqual(sup.shard_of('ETH-USD'), 1)
+        self.assertEqual(sup._shards[1].subscriptions, [('ETH-USD', 'time', 1.0), ('ETH-USD', 'tick', 0.0)])
+        self.assertIsNone(sup.shard_of('XRP-USD'))
@@ -0,0 +1,43 @@
+import unittest
+
+from gbroke.history import BAR_FIELDS
+from gbroke.sharedfeed import FeedPublisher, FeedSubscriber, KIND_BAR
+
+
+class TestSharedFeed(unittest.TestCase):
+    def setUp(self):
+        import os
+        self.name = 'gbroke-test-{}'.format(os.getpid())
+        self.pub = FeedPublisher(self.name, slots=8)
+
+    def tearDown(self):
+        self.pub.close()
+
+    def bar(self, i):
+        return tuple(float(i * 100 + j) for j in range(len(BAR_FIELDS)))
+
+    def test_fan_out(self):
+        subs = [FeedSubscriber(self.name) for _ in range(2)]
+        got = [[] for _ in subs]
+        for sub, out in zip(subs, got):
+            sub.register('BTC-USD', lambda inst, bar, out=out: out.append((inst.symbol, bar.close)), bar_size=60)
+            sub.register('BTC-USD', lambda inst, bar, out=out: out.append(('tick', bar.close)), bar_type='tick')
+        inst = subs[0]._instrument(b'BTC-USD')
+        self.pub.on_tick(inst, self.bar(1))
+        self.pub.bar_handler(60)(inst, self.bar(2))
+        self.pub.bar_handler(1)(inst, self.bar(3))      # Nobody registered 1 sec bars
+        for sub, out in zip(subs, got):
+            self.assertEqual(sub.poll(), 3)
+            self.assertEqual(out, [('tick', 111.0), ('BTC-USD', 211.0)])
+            sub.close()
+
+    def test_overrun(self):
+        sub = FeedSubscriber(self.name)
+        closes = []
+        sub.register('ETH-USD', lambda inst, bar: closes.append(bar.close))
+        for i in range(20):
+            self.pub.publish(KIND_BAR, 'ETH-USD', 1.0, self.bar(i))
+        sub.poll()
+        self.assertEqual(sub.dropped, 12)
+        self.assertEqual(closes, [i * 100 + 11.0 for i in range(12, 20)])
+        sub.close()
@@ -0,0 +1,41 @@
+import threading
+import unittest
+
+from gbroke import history
+from gbroke.streams import Stream
+
+
+class TestStream(unittest.TestCase):
+    def test_bounded_batches(self):
+        closed = []
+        stream = Stream(3, on_close=lambda: closed.append(True))
+        self.assertEqual(stream.batch(), [])
+        for i in range(5):
+            stream.put(i)
+        self.assertEqual(stream.dropped, 2)
+        self.assertEqual(stream.batch(max_items=2), [2, 3])
+        self.assertEqual(stream.batch(), [4])
+        with self.assertRaises(TimeoutError):
+            stream.get(timeout=0.01)
+        stream.put(5)
+        stream.close()
+        stream.close()
+        self.assertEqual(closed, [True])
+        self.assertEqual(list(stream), [5])
+
+    def test_blocking_consumer(self):
+        stream = Stream()
+        threading.Timer(0.01, lambda: [stream.put(i) for i in range(3)]).start()
+        first = stream.get(timeout=5)
+        rest = stream.batch(timeout=5)
+        self.assertEqual([first] + rest + stream.batch(timeout=0.1), [0, 1, 2])
+
+    def test_batch_arrays(self):
+        if not history.available():
+            self.skipTest('numpy not installed')
+        stream = Stream()
+        for i in range(4):
+            stream.put(tuple(float(i * 100 + j) for j in range(len(history.BAR_FIELDS))))
+        bars = stream.batch_arrays()
+        self.assertEqual(bars.close.tolist(), [11.0, 111.0, 211.0, 311.0])
+        self.assertEqual(len(stream.batch_arrays().close), 0)
@@ -0,0 +1,73 @@
+import sys
+import unittest
+
+from gbroke import Bar, TickView, Ticumulator
+from tests.util import make_broker
+
+
+class TestTickView(unittest.TestCase):
+    def setUp(self):
+        self.inst = type('Inst', (), {'id': 'BTC-USD'})()
+        self.broker = make_broker('test.ticks', _instruments={'BTC-USD': self.inst}, _ticumulators={'BTC-USD': Ticumulator()})
+        self.acc = self.broker._ticumulators['BTC-USD']
+
+    def test_view_and_mask(self):
+        views, quotes, bars = [], [], []
+        self.broker._add_tick_view(self.inst, lambda inst, view: views.append(view), None)
+        self.broker._add_tick_view(self.inst, lambda inst, view: quotes.append((inst, view.bid, view.ask)), ('bid', 'ask'))
+        self.broker._tick_handlers['BTC-USD'].append(lambda inst, bar: bars.append(bar))
+        self.acc.add('bid', 100.0)
+        self.acc.add('ask', 101.0)
+        self.broker._call_tick_handlers('BTC-USD')
+        self.acc.add('last', 100.5)
+        self.acc.add('lastsize', 2.0)
+        self.broker._call_tick_handlers('BTC-USD')
+        self.assertIs(views[0], views[1])
+        self.assertIsInstance(views[0], TickView)
+        self.assertEqual(quotes, [(self.inst, 100.0, 101.0)])      # Trade didn't touch the quote
+        self.assertEqual((views[0].close, views[0].vwap), (100.5, 100.5))
+        self.assertEqual(views[0].bar()[1:], bars[-1][1:])
+        self.assertIsInstance(bars[-1], Bar)
+        with self.assertRaises(AttributeError):
+            views[0].bid = 1.0
+        with self.assertRaises(ValueError):
+            self.broker._add_tick_view(self.inst, print, ('bogus',))
+
+    def test_forwarded_tick(self):
+        got = []
+        self.broker._add_tick_view(self.inst, lambda inst, view: got.append(view.close), ('close',))
+        self.broker._call_tick_handlers('BTC-USD', tuple(float(i) for i in range(len(Bar._fields))))
+        self.assertEqual(got, [11.0])
+
+    def test_full_book_changes_only(self):
+        trades, quotes = [], []
+        self.broker._add_tick_view(self.inst, lambda inst, view: trades.append(view.last), ('last',))
+        self.broker._add_tick_view(self.inst, lambda inst, view: quotes.append(view.bid), ('bid',))
+        top = (100.0, 1.0, 3.0, 101.0, 2.0, 2.0)
+        self.broker._quote_full('BTC-USD', top)
+        self.broker._call_tick_handlers('BTC-USD')
+        self.broker._quote_full('BTC-USD', top[:2] + (4.0,) + top[3:])       # Another order joins the best bid
+        self.assertEqual(self.acc.changed, Ticumulator.FIELD_BITS['bid_depth'])
+        self.broker._call_tick_handlers('BTC-USD')
+        self.assertEqual((trades, quotes), ([], [100.0]))
+        self.broker._quote_full('BTC-USD', top[:2] + (4.0,) + top[3:])
+        self.assertEqual(self.acc.changed, 0)       # Nothing for the feed to dispatch
+        self.acc.add('last', 100.5)
+        self.broker._call_tick_handlers('BTC-USD')
+        self.assertEqual((trades, quotes), ([100.5], [100.0]))
+
+    def test_no_allocation(self):
+        self.broker._add_tick_view(self.inst, lambda inst, view: view.bid, None)
+        self.acc.add('bid', 100.0)
+        call = self.broker._call_tick_handlers
+        for _ in range(100):
+            call('BTC-USD')
+        before = sys.getallocatedblocks()
+        for _ in range(10000):
+            self.acc.changed = 1
+            call('BTC-USD')
+        self.assertLess(sys.getallocatedblocks() - before, 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import math
+import unittest
+
+import numpy as np
+
+from gbroke import Bar, Ticumulator
+from gbroke.tickstore import TickStore
+
+
+class TestTickStore(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        from gbroke.recorder import HEADER_SIZE, TickRecorder
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+        rng = np.random.RandomState(42)
+        self.ticks = []
+        t = 1000.0
+        for _ in range(3000):
+            t += rng.exponential(0.05)
+            what = rng.choice(('bid', 'ask', 'bidsize', 'asksize', 'last', 'trade'))
+            if what == 'trade':     # Trades come as last followed by lastsize, as in _match()
+                price = round(100 + rng.normal(), 2)
+                self.ticks.append((t, 'last', price))
+                self.ticks.append((t, 'lastsize', round(rng.exponential(), 3)))
+            else:
+                self.ticks.append((t, what, round(rng.uniform(90, 110), 2)))
+        rec = TickRecorder(self.dir, 'BTC-USD', file_size=HEADER_SIZE + 24 * 1000, flush_sec=60)
+        for tick in self.ticks:
+            rec(*tick)
+        rec.close()
+        self.store = TickStore(self.dir, 'BTC-USD')
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_range(self):
+        self.assertGreater(len(self.store._files), 1)
+        times = np.array([t for t, _, _ in self.ticks])
+        for start, end in ((1010.0, 1050.5), (None, 1020.0), (1100.0, None), (0.0, 1.0), (None, None)):
+            got = self.store.range(start, end)
+            lo = -math.inf if start is None else start
+            hi = math.inf if end is None else end
+            self.assertEqual(len(got), ((times >= lo) & (times < hi)).sum())
+            if len(got):
+                self.assertTrue(lo <= got['time'][0] and got['time'][-1] < hi)
+
+    def test_resample_matches_ticumulator(self):
+        bar_size = 2.0
+        start, end = 1003.0, 1060.0
+        bars = self.store.resample(bar_size, start, end)
+        ends = np.arange(math.floor(start / bar_size) + 1, math.floor(end / bar_size) + 1) * bar_size
+        self.assertEqual(bars['time'].tolist(), ends.tolist())
+        acc = Ticumulator()
+        ticks = iter(t for t in self.ticks if t[0] >= start)
+        tick = next(ticks)
+        for bar_end, row in zip(ends, bars):
+            while tick is not None and tick[0] < bar_end:
+                acc.add(tick[1], tick[2])
+                tick = next(ticks, None)
+            expected = Bar._make(acc.bar())._replace(time=bar_end)
+            for field, want, got in zip(Bar._fields, expected, Bar._make(row)):
+                if isinstance(want, float) and math.isnan(want):
+                    self.assertTrue(math.isnan(got), field)
+                else:
+                    self.assertAlmostEqual(want, got, 9, '{} at {}'.format(field, bar_end))
@@ -0,0 +1,124 @@
+import random
+import timeit
+import unittest
+
+from gbroke import _OrderRecord
+from gbroke.triggers import TriggerEngine
+
+#: Budget for a trade that fires nothing, with thousands of triggers resting
+QUIET_TICK_SEC = 5e-6
+
+
+class Inst:
+    def __init__(self, id_):
+        self.id = id_
+
+
+class TestTriggers(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.engine = TriggerEngine(self.order, threaded=False)
+        self.engine.log.disabled = True
+        self.inst = Inst('BTC-USD')
+
+    def order(self, instrument, quantity, limit=0.0):
+        self.sent.append((instrument.id, quantity, limit))
+        return len(self.sent)
+
+    def prices(self, *prices):
+        for price in prices:
+            self.engine.on_price('BTC-USD', price)
+
+    def test_stops(self):
+        buy = self.engine.stop(self.inst, 1.0, 105.0)
+        sell = self.engine.stop(self.inst, -2.0, 95.0, limit=94.5)
+        self.prices(100.0, 104.99, 95.01)
+        self.assertEqual(self.sent, [])
+        self.prices(105.0)
+        self.assertEqual(self.sent, [('BTC-USD', 1.0, 0.0)])
+        self.assertEqual((buy.fired, buy.order), (True, 1))
+        self.prices(94.0, 90.0)
+        self.assertEqual(self.sent[1:], [('BTC-USD', -2.0, 94.5)])
+        self.assertEqual(self.engine.triggers(), [])
+        self.assertFalse(self.engine.cancel(sell))
+
+    def test_trailing(self):
+        sell = self.engine.trailing_stop(self.inst, -1.0, 5.0, 100.0)
+        buy = self.engine.trailing_stop(self.inst, 1.0, 2.0, 100.0)
+        self.assertEqual((sell.price, buy.price), (95.0, 102.0))
+        self.prices(99.0, 103.0)        # Buy trails down to 101, then fires
+        self.assertEqual(self.sent, [('BTC-USD', 1.0, 0.0)])
+        self.assertEqual(sell.price, 98.0)
+        self.prices(98.5, 101.0)
+        self.assertEqual(len(self.sent), 1)
+        self.prices(97.9)
+        self.assertEqual(self.sent[1:], [('BTC-USD', -1.0, 0.0)])
+
+    def test_bracket(self):
+        entry = _OrderRecord('1', self.inst, 100.0, 2.0, 0, True, False)
+        target, stop = self.engine.bracket(entry, 2.0, 110.0, 90.0)
+        self.prices(120.0, 80.0)        # Not armed until the entry is done
+        self.assertEqual(self.sent, [])
+        entry.filled = 1.5
+        self.engine.on_order(entry)
+        self.assertEqual(self.engine.triggers(), [])
+        entry.open = False
+        self.engine.on_order(entry)
+        self.assertEqual(sorted(t.quantity for t in self.engine.triggers()), [-1.5, -1.5])
+        self.prices(100.0, 110.0)
+        self.assertEqual(self.sent, [('BTC-USD', -1.5, 110.0)])
+        self.assertTrue(target.fired)
+        self.assertFalse(stop.active)       # One cancels other
+        self.prices(80.0)
+        self.assertEqual(len(self.sent), 1)
+
+    def test_cancel(self):
+        entry = _OrderRecord('1', self.inst, 100.0, -1.0, 0, True, False)
+        target, _ = self.engine.bracket(entry, -1.0, 90.0, 110.0)
+        self.assertTrue(self.engine.cancel(target))
+        entry.filled, entry.open = 1.0, False
+        self.engine.on_order(entry)
+        stop = self.engine.stop(self.inst, 1.0, 105.0)
+        self.assertEqual(self.engine.cancel_all(Inst('ETH-USD')), 0)
+        self.assertEqual(self.engine.cancel_all(self.inst), 1)
+        self.prices(106.0)
+        self.assertEqual(self.sent, [])
+        self.assertFalse(stop.active)
+
+    def test_random(self):
+        rng = random.Random(47)
+        triggers = [self.engine.stop(self.inst, rng.choice((-1.0, 1.0)), round(rng.uniform(90, 110), 2)) for _ in range(500)]
+        triggers += [self.engine.trailing_stop(self.inst, rng.choice((-1.0, 1.0)), rng.uniform(0.5, 5.0), 100.0) for _ in range(500)]
+        for t in rng.sample(triggers, 100):
+            self.engine.cancel(t)
+        armed = [t for t in triggers if t.active]
+        marks = {t: 100.0 for t in armed}
+        price = 100.0
+        for _ in range(2000):
+            price = min(115.0, max(85.0, price + rng.gauss(0, 0.3)))
+            self.prices(price)
+            for t in [t for t in armed if not t.fired]:         # Brute force: every trigger on every trade
+                if t.kind == 'trailing':
+                    marks[t] = max(marks[t], price) if t.quantity < 0 else min(marks[t], price)
+                    level = marks[t] - t.trail if t.quantity < 0 else marks[t] + t.trail
+                    self.assertAlmostEqual(t.price, level)
+                    due = price <= level if t.quantity < 0 else price >= level
+                else:
+                    due = price >= t.price if t.quantity > 0 else price <= t.price
+                self.assertEqual(t.fired, due, (t, price))
+                if due:
+                    armed.remove(t)
+
+    def test_quiet_tick(self):
+        rng = random.Random(1)
+        for _ in range(5000):
+            self.engine.stop(self.inst, 1.0, rng.uniform(101, 200))
+            self.engine.stop(self.inst, -1.0, rng.uniform(1, 99))
+        n = 10000
+        sec = min(timeit.repeat(lambda: self.engine.on_price('BTC-USD', 100.0), number=n, repeat=3)) / n
+        self.assertLess(sec, QUIET_TICK_SEC, 'quiet tick took {:.1f} us'.format(sec * 1e6))
+        self.assertEqual(self.sent, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
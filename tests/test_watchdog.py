@@ -0,0 +1,69 @@
+import logging
+import unittest
+
+from gbroke.metrics import MetricsRegistry
+from gbroke.watchdog import FeedWatchdog
+
+
+class Conn:
+    def __init__(self, started):
+        self.started = self.last_message = started
+        self.live = False
+        self.closed = False
+
+
+class Broker:
+    """Just enough broker for the watchdog, with a clock the test controls."""
+    def __init__(self):
+        self.now = 100.0
+        self.metrics = MetricsRegistry()
+        self.log = logging.getLogger('gbroke.test.watchdog')
+        self.log.disabled = True
+        self._feeds = {'BTC-USD': ('ticker', Conn(self.now))}
+        self.alerts = []
+        self.connected = True
+
+    def _call_alert_handlers(self, alert, product):
+        self.alerts.append((alert, product))
+
+    def _reconnect_feed(self, product):
+        self._feeds[product] = ('ticker', Conn(self.now))
+
+
+class TestFeedWatchdog(unittest.TestCase):
+    def test_stall_backoff_recover(self):
+        broker = Broker()
+        dog = FeedWatchdog(broker, stall_sec=5.0, backoff_sec=1.0, start=False)
+        conn = broker._feeds['BTC-USD'][1]
+        dog.check(104.0)        # Still connecting
+        conn.live, conn.last_message = True, 104.5
+        dog.check(109.0)
+        self.assertIs(broker._feeds['BTC-USD'][1], conn)
+        broker.now = 109.6
+        dog.check(broker.now)       # Stalled: down, first reconnect immediately
+        self.assertEqual(broker.alerts, [('Disconnect', 'BTC-USD')])
+        self.assertFalse(broker.connected)
+        first = broker._feeds['BTC-USD'][1]
+        self.assertIsNot(first, conn)
+        dog.check(112.0)        # The new connection gets stall_sec to come up
+        self.assertIs(broker._feeds['BTC-USD'][1], first)
+        first.closed = True
+        broker.now = 112.1
+        dog.check(broker.now)       # Closed, and past the first backoff (at most 1 sec)
+        second = broker._feeds['BTC-USD'][1]
+        self.assertIsNot(second, first)
+        self.assertEqual(broker.metrics['gbroke_feed_reconnects_total'].get('BTC-USD'), 2)
+        dog.up('BTC-USD', 113.6)
+        self.assertEqual(broker.alerts, [('Disconnect', 'BTC-USD'), ('Reconnect', 'BTC-USD')])
+        self.assertEqual(broker.metrics['gbroke_feed_recovery_seconds'].count('BTC-USD'), 1)
+        self.assertIn('gbroke_feed_recovery_seconds_sum{product="BTC-USD"} 4\n', broker.metrics.render())
+
+    def test_backoff(self):
+        dog = FeedWatchdog(Broker(), backoff_sec=0.5, max_backoff_sec=30.0, start=False)
+        for attempts, ceiling in ((1, 0.5), (2, 1.0), (4, 4.0), (20, 30.0)):
+            delay = dog.backoff(attempts)
+            self.assertTrue(ceiling / 2 <= delay <= ceiling, (attempts, delay))
+
+
+if __name__ == '__main__':
+    unittest.main()
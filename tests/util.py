@@ -0,0 +1,24 @@
+import logging
+
+from gbroke import GBroke
+from gbroke.clock import ClockSync
+from gbroke.products import ProductRegistry
+from tests.test_products import PRODUCTS
+
+
+def make_broker(name: str = 'test', **attrs) -> GBroke:
+    """:Return: a :class:`GBroke` with the local state of a real one (see ``GBroke._init_state()``) but no connection,
+    feeds, timers or threads, logging to ``gbroke.<name>`` (disabled), with `attrs` then set on it to override
+    whatever the test needs, e.g. stub methods."""
+    broker = GBroke.__new__(GBroke)
+    broker.log = logging.getLogger('gbroke.' + name)
+    broker.log.disabled = True
+    broker.verbose = 3
+    broker._init_state(0, 0, None, 1, threaded=False)
+    broker.products = ProductRegistry(lambda: PRODUCTS).load()
+    broker.clock = ClockSync()
+    broker._watchdog = broker._paper = broker._shards = None
+    broker.user_id = broker.profile_id = None
+    for attr, value in attrs.items():
+        setattr(broker, attr, value)
+    return broker